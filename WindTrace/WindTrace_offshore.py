@@ -1242,12 +1242,15 @@ def lci_offshore_turbine(new_db, cutoff391, biosphere3,
                          lifetime: int = 20,
                          electricity_mix_steel: Optional[Literal['Norway', 'Europe', 'Poland']] = None,
                          generator_type: Literal['dd_eesg', 'dd_pmsg', 'gb_pmsg', 'gb_dfig'] = 'gb_dfig',
+                         ei_index: Optional[dict] = None
                          ):
     """
     It creates an activity for the turbine. Inputs: materials, manufacturing, transport, installation, maintenance, and
     eol of a single turbine.
+    ei_index: index of cutoff391 (get_bw_index(cutoff391)). If None, it is taken from the registry.
     """
-    ei_index = build_bw_index(cutoff391)
+    if ei_index is None:
+        ei_index = get_bw_index(cutoff391)
     # create offshore turbine activity
     offshore_turbine_act = new_db.new_activity(name=f'{park_name}_offshore_turbine',
                                                code=f'{park_name}_offshore_turbine',
@@ -1,12 +1,19 @@
 import consts
 import bw2data as bd
+import hashlib
+import multiprocessing
+import os
+import pickle
 from geopy.distance import geodesic
 import random
 from typing import Optional, List, Literal
 from stats_arrays import NormalUncertainty, UniformUncertainty
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from WindTrace.helper_functions import *
-from config_parameters import VESTAS_FILE, NEW_DB_NAME
+from bw2data.backends import Activity, ActivityDataset
+from WindTrace import park_inventory
+from config_parameters import VESTAS_FILE
 
 
 def steel_turbine(plot_mat: bool = False, regression_adjustment: Literal['D2h', 'Hub height'] = 'D2h'):
@@ -311,6 +318,48 @@ def foundations_mat(mat_file: str, plot_mat=False, regression_adjustment: Litera
     return materials_polyfits, mat_polyfits_short, intersection
 
 
+##### fitted models cache #####
+# Folder with the on-disk cache of the fitted materials models (next to the Vestas file).
+REGRESSIONS_CACHE_FOLDER = os.path.join(os.path.dirname(VESTAS_FILE), 'regressions_cache')
+# In-process cache: (Vestas file path, modification time, regression_adjustment) -> fitted models
+_MATERIALS_MODELS: Dict[Tuple[str, float, str], Tuple[Dict, Dict, Dict]] = {}
+
+
+def fitted_materials_models(regression_adjustment: Literal['D2h', 'Hub height'] = 'D2h',
+                            mat_file: str = VESTAS_FILE) -> Tuple[Dict, Dict, Dict]:
+    """
+    Same output as foundations_mat(), but the models are fitted only once per version of the Vestas file (its
+    modification time) and regression_adjustment. The fit is kept in memory and in a pickle file in
+    REGRESSIONS_CACHE_FOLDER, so other processes and later runs do not fit the models again. Editing the Vestas file
+    changes its modification time, so the models are fitted again.
+    """
+    mat_file = os.path.abspath(mat_file)
+    key = (mat_file, os.path.getmtime(mat_file), regression_adjustment)
+    if key in _MATERIALS_MODELS:
+        return _MATERIALS_MODELS[key]
+
+    key_hash = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:16]
+    cache_file = os.path.join(REGRESSIONS_CACHE_FOLDER, f'materials_models_{key_hash}.pkl')
+    models = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                models = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            print(f'Could not read the regressions cache {cache_file} ({e}). Fitting the models again.')
+    if models is None:
+        print(f'Fitting WindTrace materials models ({regression_adjustment})')
+        models = foundations_mat(mat_file=mat_file, regression_adjustment=regression_adjustment)
+        os.makedirs(REGRESSIONS_CACHE_FOLDER, exist_ok=True)
+        # write to a temporary file and rename it, so parallel processes never read a half-written cache
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(models, f)
+        os.replace(tmp_file, cache_file)
+    _MATERIALS_MODELS[key] = models
+    return models
+
+
 def materials_mass(generator_type: Literal['dd_eesg', 'dd_pmsg', 'gb_pmsg', 'gb_dfig'],
                    turbine_power: float, hub_height: float, rotor_diameter: float,
                    regression_adjustment: Literal['D2h', 'Hub height'] = 'D2h'):
@@ -320,7 +369,7 @@ def materials_mass(generator_type: Literal['dd_eesg', 'dd_pmsg', 'gb_pmsg', 'gb_
     """
     mass_materials = {}
     (materials_polyfits, mat_polyfits_short,
-     intersection) = foundations_mat(mat_file=VESTAS_FILE, regression_adjustment=regression_adjustment)
+     intersection) = fitted_materials_models(regression_adjustment=regression_adjustment)
 
     uncertainty = {}
     if regression_adjustment == 'Hub height':
@@ -378,6 +427,63 @@ def materials_mass(generator_type: Literal['dd_eesg', 'dd_pmsg', 'gb_pmsg', 'gb_
     return mass_materials, uncertainty
 
 
+def materials_mass_matrix(generator_type, turbine_power, hub_height, rotor_diameter,
+                          regression_adjustment: Literal['D2h', 'Hub height'] = 'D2h') -> Tuple[pd.DataFrame,
+                                                                                               pd.DataFrame]:
+    """
+    Vectorized materials_mass() for many turbine designs at once. All the arguments can be arrays (of the same length)
+    or single values, which are used for all the turbines.
+    Returns two DataFrames with materials as rows and turbines as columns (in the order of the input arrays):
+    the masses (kg; m3 for 'Concrete_foundations') and the uncertainty (std_dev of the regression used), with the same
+    short/full range switching as materials_mass().
+    """
+    (materials_polyfits, mat_polyfits_short,
+     intersection) = fitted_materials_models(regression_adjustment=regression_adjustment)
+    turbine_power, hub_height, rotor_diameter, generator_type = np.broadcast_arrays(
+        np.asarray(turbine_power, dtype=float), np.asarray(hub_height, dtype=float),
+        np.asarray(rotor_diameter, dtype=float), np.asarray(generator_type))
+    turbine_power, hub_height, rotor_diameter, generator_type = (np.atleast_1d(a) for a in (
+        turbine_power, hub_height, rotor_diameter, generator_type))
+
+    masses = {}
+    uncertainty = {}
+    # steel of the turbine, as a function of hub height or D2h
+    if regression_adjustment == 'Hub height':
+        x_steel = hub_height
+    else:
+        x_steel = hub_height * rotor_diameter * rotor_diameter
+    is_larger = x_steel > intersection['Low alloy steel'].item()
+    masses['Low alloy steel'] = np.where(is_larger,
+                                         materials_polyfits['Low alloy steel']['polyfit'](x_steel),
+                                         mat_polyfits_short['Low alloy steel']['polyfit'](x_steel)) * 1000
+
+    # rest of materials (and steel uncertainty), as a function of power
+    for k in materials_polyfits.keys():
+        if k in intersection.keys():
+            is_larger = turbine_power > intersection[k].item()
+            full_fit, short_fit = materials_polyfits[k], mat_polyfits_short[k]
+            uncertainty[k] = np.where(is_larger, full_fit['std_dev'], short_fit['std_dev'])
+            values = np.where(is_larger, full_fit['polyfit'](turbine_power), short_fit['polyfit'](turbine_power))
+        else:
+            uncertainty[k] = np.full(turbine_power.shape, materials_polyfits[k]['std_dev'], dtype=float)
+            values = materials_polyfits[k]['polyfit'](turbine_power)
+        if k == 'Concrete_foundations':
+            # transform concrete mass (t) to volume in m3
+            masses[k] = np.clip(values / 2.4, 0.0, None)
+        elif k != 'Low alloy steel':
+            # in kg instead of tonnes
+            masses[k] = np.clip(values * 1000, 0.0, None)
+
+    # rare earth elements (kg), by generator type
+    for k in consts.RARE_EARTH_DICT.keys():
+        intensity = np.array([consts.RARE_EARTH_DICT[k][g] for g in generator_type], dtype=float)
+        masses[k] = intensity * turbine_power
+
+    masses_df = pd.DataFrame(np.vstack(list(masses.values())), index=list(masses.keys()))
+    uncertainty_df = pd.DataFrame(np.vstack(list(uncertainty.values())), index=list(uncertainty.keys()))
+    return masses_df, uncertainty_df
+
+
 def cabling_materials(turbine_power: float, rotor_diameter: float, number_of_turbines: int,
                       cu_density=8960, al_density=2700, pe_density=930, pvc_density=1400):
     """
@@ -549,6 +655,10 @@ def manipulate_steel_activities(new_db: bd.Database, cutoff391: bd.Database, ei_
     - All countries produce the same share of recycled and non-recycled steel.
     - The consumption amount of gas and electricity in the furnaces does not change between countries.
     - The manufacture of the turbine takes place 1 year before the commissioning
+    Each distinct market (year, recycled share and electricity mix), with its steel and chromium steel activities, is
+    computed once per process and database (see _STEEL_MARKETS) and written in ´´new_db´´ the first time it is
+    needed; later calls return the activities already in ´´new_db´´. Returns the market and the list of chromium steel
+    markets for the electricity mix (empty if ´´electricity_mix´´ is None).
     :param: recycled_share -> needs to be inputted with a value from 0 to 1 (or None)
     :param: electricity_mix -> ony accepts 'Europe', 'Poland' or 'Norway' (or None). For other values, 'Europe'
     is applied by default.
@@ -588,242 +698,281 @@ def manipulate_steel_activities(new_db: bd.Database, cutoff391: bd.Database, ei_
             print('Electricity mix: European mix from Eurofer')
         act_name = "market for steel, low-alloyed, " + str(commissioning_year - 1)
         code_name = "steel, " + str(commissioning_year - 1)
-        try:
-            steel_act = new_db.get(code=code_name)
-        except Exception:
-            steel_act = None
     else:
         act_name = "market for steel, low-alloyed, defined " + str(recycled_share) + str(electricity_mix)
         code_name = "steel, defined " + str(recycled_share) + str(electricity_mix)
-        try:
-            steel_act = new_db.get(code=code_name)
-        except Exception:
-            steel_act = None
+        if recycled_share is None:
+            # the share is taken from the year of manufacturing, so markets of different years must not be mixed up
+            act_name += ', ' + str(commissioning_year - 1)
+            code_name += ', ' + str(commissioning_year - 1)
+    ch_name = 'market for steel, chromium steel 18/8' + str(electricity_mix)
 
-    # check if we already created a steel market for that year and skip if we did
-    steel_act_check = 0
+    # skip the creation if we already created this steel market in new_db
+    steel_act = new_db.get(code_name) if _has_activity(new_db, code_name) else None
     if steel_act is not None:
-        steel_act_check = len(steel_act.exchanges())
+        if len(steel_act.exchanges()) != 3:
+            raise ValueError(f"The steel market '{code_name}' in {new_db.name} is incomplete. Delete it, so it is "
+                             f"created again")
+        return steel_act, _activities_named(new_db, ch_name)
+
+    if ei_index is None:
+        ei_index = get_bw_index(cutoff391)
+    registry_key = (bd.projects.current, new_db.name, cutoff391.name,
+                    str(bd.databases[cutoff391.name].get('modified')), code_name)
+    if registry_key not in _STEEL_MARKETS:
+        draft = park_inventory.ParkDraft(new_db.name, code_name)
+        _build_steel_market(draft, cutoff391, ei_index, commissioning_year, recycled_share, electricity_mix,
+                            act_name, code_name)
+        _STEEL_MARKETS[registry_key] = draft.inventory()
+    if isinstance(new_db, park_inventory.ParkDraft):
+        new_db.add_inventory(_STEEL_MARKETS[registry_key])
+    else:
+        park_inventory.write_inventories([_STEEL_MARKETS[registry_key]], new_db.name)
+    return new_db.get(code_name), _activities_named(new_db, ch_name)
 
-    if steel_act_check == 0:
-        # find recycled steel production activity in Ecoinvent
-        recycled_ei = find_unique_act(index=ei_index,
-                                      database=cutoff391,
-                                      name='steel production, electric, low-alloyed',
-                                      location='Europe without Switzerland and Austria',
-                                      reference_product='steel, low-alloyed')
-        # find primary steel production activity in Ecoinvent
-        primary_ei = find_unique_act(index=ei_index,
-                                     database=cutoff391,
-                                     name='steel production, converter, low-alloyed',
-                                     location='RER',
-                                     reference_product='steel, low-alloyed')
-        # Create a copy to manipulate them in the new_db database
-        recycled_act = recycled_ei.copy(database=NEW_DB_NAME)
-        primary_act = primary_ei.copy(database=NEW_DB_NAME)
-        acts = [recycled_act, primary_act]
-
-        # Manipulate both the primary and secondary activities in the same way
-        for act in acts:
-            # Calculate the total amount of gas and electricity inputs in the activity
-            elect_ex = [e for e in act.technosphere() if
-                        e.input._data['name'] == 'market for electricity, medium voltage'
-                        or e.input._data['name'] == 'market group for electricity, medium voltage']
-            gas_ex = [e for e in act.technosphere() if
-                      e.input._data['name'] == 'market for natural gas, high pressure' or
-                      e.input._data['name'] == 'market group for natural gas, high pressure']
-            total_elect_amount = sum([a['amount'] for a in elect_ex])
-            total_gas_amount = sum([a['amount'] for a in gas_ex])
-            # Delete current gas and electricity exchanges
-            for ex in elect_ex:
-                ex.delete()
-            for ex in gas_ex:
-                ex.delete()
 
-            # Add new exchanges with adjusted location. The total amount of gas and electricity inputs are maintained
-            # from the original Ecoinvent activity. The only main change is the share of each country.
-            if electricity_mix is None:
-                for country in consts.STEEL_DATA_EU27.keys():
-                    elect_act = find_unique_act(index=ei_index,
-                                                database=cutoff391,
-                                                name=consts.STEEL_DATA_EU27[country]['elect']['name'],
-                                                location=consts.STEEL_DATA_EU27[country]['elect']['location'],
-                                                reference_product=consts.STEEL_DATA_EU27[country]['elect'][
-                                                    'reference product'])
-                    gas_act = find_unique_act(index=ei_index,
-                                              database=cutoff391,
-                                              name=consts.STEEL_DATA_EU27[country]['gas']['name'],
-                                              location=consts.STEEL_DATA_EU27[country]['gas']['location'],
-                                              reference_product=consts.STEEL_DATA_EU27[country]['gas']
-                                              ['reference product'])
-                    elect_amount = total_elect_amount * consts.STEEL_DATA_EU27[country]['share'] / 100
-                    gas_amount = total_gas_amount * consts.STEEL_DATA_EU27[country]['share'] / 100
-                    new_elect_ex = act.new_exchange(input=elect_act, amount=elect_amount, unit='kilowatt hour',
-                                                    type='technosphere')
-                    new_gas_ex = act.new_exchange(input=gas_act, amount=gas_amount, unit='cubic meter',
-                                                  type='technosphere')
-                    new_elect_ex.save()
-                    new_gas_ex.save()
-            else:
-                # gas is always changed independently of the electricity mix chosen
-                for country in consts.STEEL_DATA_EU27.keys():
-                    gas_act = find_unique_act(index=ei_index,
-                                              database=cutoff391,
-                                              name=consts.STEEL_DATA_EU27[country]['gas']['name'],
-                                              location=consts.STEEL_DATA_EU27[country]['gas']['location'],
-                                              reference_product=consts.STEEL_DATA_EU27[country]['gas']
-                                              ['reference product'])
-                    gas_amount = total_gas_amount * consts.STEEL_DATA_EU27[country]['share'] / 100
-                    new_gas_ex = act.new_exchange(input=gas_act, amount=gas_amount, unit='cubic meter',
-                                                  type='technosphere')
-                    new_gas_ex.save()
-                if electricity_mix == 'Norway':
-                    electricity_norway = [a for a in cutoff391 if
-                                          a._data['name'] == 'market for electricity, medium voltage' and a._data[
-                                              'location'] == 'NO'][0]
-                    new_elect_ex = act.new_exchange(input=electricity_norway, amount=total_elect_amount,
-                                                    unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                elif electricity_mix == 'Poland':
-                    electricity_poland = [a for a in cutoff391 if
-                                          a._data['name'] == 'market for electricity, medium voltage' and a._data[
-                                              'location'] == 'PL'][0]
-                    new_elect_ex = act.new_exchange(input=electricity_poland, amount=total_elect_amount,
-                                                    unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                elif electricity_mix == 'Europe':
-                    electricity_europe = [a for a in cutoff391 if
-                                          a._data['name'] == 'market group for electricity, medium voltage' and a._data[
-                                              'location'] == 'RER'][0]
-                    new_elect_ex = act.new_exchange(input=electricity_europe, amount=total_elect_amount,
-                                                    unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                # if the electricity_mix variable inputed is not in the list ('Europe', 'Norway' or 'Poland'),
-                # Europe is chosen by default
-                else:
-                    electricity_europe = [a for a in cutoff391 if
-                                          a._data['name'] == 'market group for electricity, medium voltage' and a._data[
-                                              'location'] == 'RER'][0]
-                    new_elect_ex = act.new_exchange(input=electricity_europe, amount=total_elect_amount,
-                                                    unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-        if electricity_mix is not None:
-            ch_act_name = 'market for steel, chromium steel 18/8' + str(electricity_mix)
-            ch_act = [a for a in new_db if a._data['name'] == ch_act_name]
-            if len(ch_act) == 0:
-                ch_steel_act_cutoff = [a for a in cutoff391 if a._data['name'] ==
-                                       'market for steel, chromium steel 18/8'][0]
-                ch_steel_act_newdb = ch_steel_act_cutoff.copy(database=NEW_DB_NAME)
-                ch_steel_act_newdb._data['name'] = 'market for steel, chromium steel 18/8' + str(electricity_mix)
-                ch_steel_act_newdb.save()
-                ch_steel_electric_input = [e.input for e in ch_steel_act_newdb.technosphere() if
-                                           'transport' not in e.input._data['name'] and e.input._data[
-                                               'location'] == 'RER'][0]
-                ch_steel_act = ch_steel_electric_input.copy(database=NEW_DB_NAME)
-                ch_steel_act._data['name'] = 'steel production, electric, chromium steel 18/8' + str(electricity_mix)
-                ch_steel_act.save()
-                # Calculate the total amount of electricity inputs in the activity
-                elect_ex = [e for e in ch_steel_act.technosphere() if
-                            e.input._data['name'] == 'market for electricity, medium voltage'
-                            or e.input._data['name'] == 'market group for electricity, medium voltage']
-                total_elect_amount = sum([a['amount'] for a in elect_ex])
-                for ex in elect_ex:
-                    ex.delete()
-                if electricity_mix == 'Norway':
-                    electricity_norway = [a for a in cutoff391 if
-                                          a._data['name'] == 'market for electricity, medium voltage' and a._data[
-                                              'location'] == 'NO'][0]
-                    new_elect_ex = ch_steel_act.new_exchange(input=electricity_norway, amount=total_elect_amount,
-                                                             unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                elif electricity_mix == 'Poland':
-                    electricity_poland = [a for a in cutoff391 if
-                                          a._data['name'] == 'market for electricity, medium voltage' and a._data[
-                                              'location'] == 'PL'][0]
-                    new_elect_ex = ch_steel_act.new_exchange(input=electricity_poland, amount=total_elect_amount,
-                                                             unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                elif electricity_mix == 'Europe':
-                    electricity_europe = [a for a in cutoff391 if
-                                          a._data['name'] == 'market group for electricity, medium voltage' and a._data[
-                                              'location'] == 'RER'][0]
-                    new_elect_ex = ch_steel_act.new_exchange(input=electricity_europe, amount=total_elect_amount,
-                                                             unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                # if the electricity_mix variable inputted is not in the list ('Europe', 'Norway' or 'Poland'),
-                # Europe is chosen by default
-                else:
-                    electricity_europe = [a for a in cutoff391 if
-                                          a._data['name'] == 'market group for electricity, medium voltage' and a._data[
-                                              'location'] == 'RER'][0]
-                    new_elect_ex = ch_steel_act.new_exchange(input=electricity_europe, amount=total_elect_amount,
-                                                             unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-
-                original_inputs = [e for e in ch_steel_act_newdb.technosphere() if
-                                   'transport' not in e.input._data['name']]
-                for e in original_inputs:
-                    name = e.input._data['name'] + str(electricity_mix)
-                    new_db_act = [a for a in new_db if a._data['name'] == name][0]
-                    amount = e.amount
-                    new_elect_ex = ch_steel_act_newdb.new_exchange(input=new_db_act, amount=amount,
-                                                                   unit='kilowatt hour', type='technosphere')
-                    new_elect_ex.save()
-                    e.delete()
-
-        # Create an empty market activity in new_db
-        try:
-            steel_market = new_db.new_activity(name=act_name, code=code_name, unit='kilogram', location='RER')
-            steel_market['reference product'] = 'steel, low-alloyed'
-            steel_market.save()
-        except bd.errors.DuplicateNode:
-            steel_market = new_db.get(code=code_name)
-
-        # Add exchanges with the annual share of primary a secondary steel to the recently created activity
-        # Historic primary and secondary shares according to Eurofer data.
-        if recycled_share is None:
-            if str(commissioning_year - 1) in consts.SECONDARY_STEEL.keys():
-                # We assume that the turbine was manufactured a year before the commissioning date
-                secondary_amount = consts.SECONDARY_STEEL[str(commissioning_year - 1)]
-                primary_amount = 1 - secondary_amount
+# (project, new_db name, cutoff391 name, cutoff391 modification time, market code) -> inventory of the steel market
+# and its steel and chromium steel activities, computed once with _build_steel_market()
+_STEEL_MARKETS: Dict[Tuple[str, str, str, str, str], park_inventory.ParkInventory] = {}
+
+
+def _has_activity(new_db: bd.Database, code: str) -> bool:
+    if isinstance(new_db, park_inventory.ParkDraft) and code in new_db.activities:
+        return True
+    return ActivityDataset.select().where((ActivityDataset.database == new_db.name) &
+                                          (ActivityDataset.code == code)).exists()
+
+
+def _activities_named(new_db: bd.Database, name: str) -> list:
+    """
+    Activities of ´´new_db´´ (a database or a ParkDraft) called ´´name´´, with one query instead of iterating the
+    whole database.
+    """
+    found = []
+    if isinstance(new_db, park_inventory.ParkDraft):
+        found = [act for act in new_db.activities.values() if act['name'] == name]
+    drafted = {act.key for act in found}
+    for document in ActivityDataset.select().where((ActivityDataset.database == new_db.name) &
+                                                   (ActivityDataset.name == name)):
+        act = Activity(document)
+        if act.key not in drafted:
+            found.append(act)
+    return found
+
+
+def _first_named(index: Optional[dict], database: bd.Database, name: str, location: Optional[str] = None):
+    """
+    First activity of ´´database´´ called ´´name´´ (and in ´´location´´, if given), as found iterating the database,
+    but looked up in its ´´index´´ (see get_bw_index()).
+    """
+    if index is None:
+        index = get_bw_index(database)
+    for (act_name, act_location, _), key in index.items():
+        if act_name == name and (location is None or act_location == location):
+            return database.get(key[1])
+    raise bd.errors.UnknownObject(f"No activity called '{name}'" + (f" in {location}" if location else '') +
+                                  f" in {database.name}")
+
+
+def _build_steel_market(new_db: park_inventory.ParkDraft, cutoff391: bd.Database, ei_index: dict,
+                        commissioning_year: int, recycled_share: Optional[float], electricity_mix: Optional[str],
+                        act_name: str, code_name: str):
+    """
+    Creates the steel market ´´code_name´´ in ´´new_db´´, with its primary and secondary steel activities and (with an
+    ´´electricity_mix´´) the chromium steel ones, as described in manipulate_steel_activities().
+    """
+    # find recycled steel production activity in Ecoinvent
+    recycled_ei = find_unique_act(index=ei_index,
+                                  database=cutoff391,
+                                  name='steel production, electric, low-alloyed',
+                                  location='Europe without Switzerland and Austria',
+                                  reference_product='steel, low-alloyed')
+    # find primary steel production activity in Ecoinvent
+    primary_ei = find_unique_act(index=ei_index,
+                                 database=cutoff391,
+                                 name='steel production, converter, low-alloyed',
+                                 location='RER',
+                                 reference_product='steel, low-alloyed')
+    # Create a copy to manipulate them in the new_db database
+    recycled_act = park_inventory.copy_to(recycled_ei, new_db, suffix=str(electricity_mix))
+    primary_act = park_inventory.copy_to(primary_ei, new_db, suffix=str(electricity_mix))
+    acts = [recycled_act, primary_act]
+
+    # Manipulate both the primary and secondary activities in the same way
+    for act in acts:
+        # Calculate the total amount of gas and electricity inputs in the activity
+        elect_ex = [e for e in act.technosphere() if
+                    e.input._data['name'] == 'market for electricity, medium voltage'
+                    or e.input._data['name'] == 'market group for electricity, medium voltage']
+        gas_ex = [e for e in act.technosphere() if
+                  e.input._data['name'] == 'market for natural gas, high pressure' or
+                  e.input._data['name'] == 'market group for natural gas, high pressure']
+        total_elect_amount = sum([a['amount'] for a in elect_ex])
+        total_gas_amount = sum([a['amount'] for a in gas_ex])
+        # Delete current gas and electricity exchanges
+        for ex in elect_ex:
+            ex.delete()
+        for ex in gas_ex:
+            ex.delete()
+
+        # Add new exchanges with adjusted location. The total amount of gas and electricity inputs are maintained
+        # from the original Ecoinvent activity. The only main change is the share of each country.
+        if electricity_mix is None:
+            for country in consts.STEEL_DATA_EU27.keys():
+                elect_act = find_unique_act(index=ei_index,
+                                            database=cutoff391,
+                                            name=consts.STEEL_DATA_EU27[country]['elect']['name'],
+                                            location=consts.STEEL_DATA_EU27[country]['elect']['location'],
+                                            reference_product=consts.STEEL_DATA_EU27[country]['elect'][
+                                                'reference product'])
+                gas_act = find_unique_act(index=ei_index,
+                                          database=cutoff391,
+                                          name=consts.STEEL_DATA_EU27[country]['gas']['name'],
+                                          location=consts.STEEL_DATA_EU27[country]['gas']['location'],
+                                          reference_product=consts.STEEL_DATA_EU27[country]['gas']
+                                          ['reference product'])
+                elect_amount = total_elect_amount * consts.STEEL_DATA_EU27[country]['share'] / 100
+                gas_amount = total_gas_amount * consts.STEEL_DATA_EU27[country]['share'] / 100
+                new_elect_ex = act.new_exchange(input=elect_act, amount=elect_amount, unit='kilowatt hour',
+                                                type='technosphere')
+                new_gas_ex = act.new_exchange(input=gas_act, amount=gas_amount, unit='cubic meter',
+                                              type='technosphere')
+                new_elect_ex.save()
+                new_gas_ex.save()
+        else:
+            # gas is always changed independently of the electricity mix chosen
+            for country in consts.STEEL_DATA_EU27.keys():
+                gas_act = find_unique_act(index=ei_index,
+                                          database=cutoff391,
+                                          name=consts.STEEL_DATA_EU27[country]['gas']['name'],
+                                          location=consts.STEEL_DATA_EU27[country]['gas']['location'],
+                                          reference_product=consts.STEEL_DATA_EU27[country]['gas']
+                                          ['reference product'])
+                gas_amount = total_gas_amount * consts.STEEL_DATA_EU27[country]['share'] / 100
+                new_gas_ex = act.new_exchange(input=gas_act, amount=gas_amount, unit='cubic meter',
+                                              type='technosphere')
+                new_gas_ex.save()
+            if electricity_mix == 'Norway':
+                electricity_norway = _first_named(ei_index, cutoff391, 'market for electricity, medium voltage',
+                                                  location='NO')
+                new_elect_ex = act.new_exchange(input=electricity_norway, amount=total_elect_amount,
+                                                unit='kilowatt hour', type='technosphere')
+                new_elect_ex.save()
+            elif electricity_mix == 'Poland':
+                electricity_poland = _first_named(ei_index, cutoff391, 'market for electricity, medium voltage',
+                                                  location='PL')
+                new_elect_ex = act.new_exchange(input=electricity_poland, amount=total_elect_amount,
+                                                unit='kilowatt hour', type='technosphere')
+                new_elect_ex.save()
+            elif electricity_mix == 'Europe':
+                electricity_europe = _first_named(ei_index, cutoff391, 'market group for electricity, medium voltage',
+                                                  location='RER')
+                new_elect_ex = act.new_exchange(input=electricity_europe, amount=total_elect_amount,
+                                                unit='kilowatt hour', type='technosphere')
+                new_elect_ex.save()
+            # if the electricity_mix variable inputed is not in the list ('Europe', 'Norway' or 'Poland'),
+            # Europe is chosen by default
             else:
-                secondary_amount = consts.SECONDARY_STEEL['other']
-                primary_amount = 1 - secondary_amount
-            # Add primary steel
-            primary_ex = steel_market.new_exchange(input=primary_act, amount=primary_amount, unit='kilogram',
-                                                   type='technosphere')
-            primary_ex.save()
-            # Add secondary steel
-            secondary_ex = steel_market.new_exchange(input=recycled_act, amount=secondary_amount, unit='kilogram',
-                                                     type='technosphere')
-            secondary_ex.save()
-        # Manually selected primary and secondary shares
+                electricity_europe = _first_named(ei_index, cutoff391, 'market group for electricity, medium voltage',
+                                                  location='RER')
+                new_elect_ex = act.new_exchange(input=electricity_europe, amount=total_elect_amount,
+                                                unit='kilowatt hour', type='technosphere')
+                new_elect_ex.save()
+    if electricity_mix is not None:
+        ch_steel_act_cutoff = _first_named(ei_index, cutoff391, 'market for steel, chromium steel 18/8')
+        ch_steel_act_newdb = park_inventory.copy_to(ch_steel_act_cutoff, new_db, suffix=str(electricity_mix))
+        ch_steel_act_newdb._data['name'] = 'market for steel, chromium steel 18/8' + str(electricity_mix)
+        ch_steel_act_newdb.save()
+        ch_steel_electric_input = [e.input for e in ch_steel_act_newdb.technosphere() if
+                                   'transport' not in e.input._data['name'] and e.input._data[
+                                       'location'] == 'RER'][0]
+        ch_steel_act = park_inventory.copy_to(ch_steel_electric_input, new_db, suffix=str(electricity_mix))
+        ch_steel_act._data['name'] = 'steel production, electric, chromium steel 18/8' + str(electricity_mix)
+        ch_steel_act.save()
+        # Calculate the total amount of electricity inputs in the activity
+        elect_ex = [e for e in ch_steel_act.technosphere() if
+                    e.input._data['name'] == 'market for electricity, medium voltage'
+                    or e.input._data['name'] == 'market group for electricity, medium voltage']
+        total_elect_amount = sum([a['amount'] for a in elect_ex])
+        for ex in elect_ex:
+            ex.delete()
+        if electricity_mix == 'Norway':
+            electricity_norway = _first_named(ei_index, cutoff391, 'market for electricity, medium voltage',
+                                              location='NO')
+            new_elect_ex = ch_steel_act.new_exchange(input=electricity_norway, amount=total_elect_amount,
+                                                     unit='kilowatt hour', type='technosphere')
+            new_elect_ex.save()
+        elif electricity_mix == 'Poland':
+            electricity_poland = _first_named(ei_index, cutoff391, 'market for electricity, medium voltage',
+                                              location='PL')
+            new_elect_ex = ch_steel_act.new_exchange(input=electricity_poland, amount=total_elect_amount,
+                                                     unit='kilowatt hour', type='technosphere')
+            new_elect_ex.save()
+        elif electricity_mix == 'Europe':
+            electricity_europe = _first_named(ei_index, cutoff391, 'market group for electricity, medium voltage',
+                                              location='RER')
+            new_elect_ex = ch_steel_act.new_exchange(input=electricity_europe, amount=total_elect_amount,
+                                                     unit='kilowatt hour', type='technosphere')
+            new_elect_ex.save()
+        # if the electricity_mix variable inputted is not in the list ('Europe', 'Norway' or 'Poland'),
+        # Europe is chosen by default
         else:
-            # Add primary steel
-            primary_share = 1 - recycled_share
-            primary_ex = steel_market.new_exchange(input=primary_act, amount=primary_share, unit='kilogram',
-                                                   type='technosphere')
-            primary_ex.save()
-            # Add secondary steel
-            secondary_ex = steel_market.new_exchange(input=recycled_act, amount=recycled_share, unit='kilogram',
-                                                     type='technosphere')
-            secondary_ex.save()
-        # Add production and save
-        production_exc = steel_market.new_exchange(input=steel_market.key, amount=1.0, unit="kilogram",
-                                                   type='production')
-        production_exc.save()
-        steel_market.save()
-
-        ch_name = 'market for steel, chromium steel 18/8' + str(electricity_mix)
-        ch_steel_market = [a for a in new_db if a._data['name'] == ch_name]
-        return steel_market, ch_steel_market
-
-    elif steel_act_check == 3:
-        ch_name = 'market for steel, chromium steel 18/8' + str(electricity_mix)
-        ch_steel_market = [a for a in new_db if a._data['name'] == ch_name]
-        return steel_act, ch_steel_market
+            electricity_europe = _first_named(ei_index, cutoff391, 'market group for electricity, medium voltage',
+                                              location='RER')
+            new_elect_ex = ch_steel_act.new_exchange(input=electricity_europe, amount=total_elect_amount,
+                                                     unit='kilowatt hour', type='technosphere')
+            new_elect_ex.save()
+
+        original_inputs = [e for e in ch_steel_act_newdb.technosphere() if
+                           'transport' not in e.input._data['name']]
+        for e in original_inputs:
+            name = e.input._data['name'] + str(electricity_mix)
+            new_db_act = _activities_named(new_db, name)[0]
+            amount = e.amount
+            new_elect_ex = ch_steel_act_newdb.new_exchange(input=new_db_act, amount=amount,
+                                                           unit='kilowatt hour', type='technosphere')
+            new_elect_ex.save()
+            e.delete()
+
+    # Create an empty market activity in new_db
+    steel_market = new_db.new_activity(name=act_name, code=code_name, unit='kilogram', location='RER')
+    steel_market['reference product'] = 'steel, low-alloyed'
+    steel_market.save()
+
+    # Add exchanges with the annual share of primary a secondary steel to the recently created activity
+    # Historic primary and secondary shares according to Eurofer data.
+    if recycled_share is None:
+        if str(commissioning_year - 1) in consts.SECONDARY_STEEL.keys():
+            # We assume that the turbine was manufactured a year before the commissioning date
+            secondary_amount = consts.SECONDARY_STEEL[str(commissioning_year - 1)]
+            primary_amount = 1 - secondary_amount
+        else:
+            secondary_amount = consts.SECONDARY_STEEL['other']
+            primary_amount = 1 - secondary_amount
+        # Add primary steel
+        primary_ex = steel_market.new_exchange(input=primary_act, amount=primary_amount, unit='kilogram',
+                                               type='technosphere')
+        primary_ex.save()
+        # Add secondary steel
+        secondary_ex = steel_market.new_exchange(input=recycled_act, amount=secondary_amount, unit='kilogram',
+                                                 type='technosphere')
+        secondary_ex.save()
+    # Manually selected primary and secondary shares
     else:
-        print('Something went wrong during the creation of the steel market')
+        # Add primary steel
+        primary_share = 1 - recycled_share
+        primary_ex = steel_market.new_exchange(input=primary_act, amount=primary_share, unit='kilogram',
+                                               type='technosphere')
+        primary_ex.save()
+        # Add secondary steel
+        secondary_ex = steel_market.new_exchange(input=recycled_act, amount=recycled_share, unit='kilogram',
+                                                 type='technosphere')
+        secondary_ex.save()
+    # Add production and save
+    production_exc = steel_market.new_exchange(input=steel_market.key, amount=1.0, unit="kilogram",
+                                               type='production')
+    production_exc.save()
+    steel_market.save()
 
 
 def lci_materials(new_db: bd.Database, cutoff391: bd.Database, ei_index: dict, park_name: str, park_power: float,
@@ -868,7 +1017,7 @@ def lci_materials(new_db: bd.Database, cutoff391: bd.Database, ei_index: dict, p
             'WARNING: if you run delete_new_db() '
             'ALL WIND PARKS STORED IN THAT DATABASE WILL '
             'BE DELETED!')
-        sys.exit()
+        raise
 
     cables_act = new_db.new_activity(name=park_name + '_cables', code=park_name + '_intra_cables', unit='unit')
     cables_act['reference product'] = f'{park_name}_cables'
@@ -1811,7 +1960,7 @@ def auxiliary_road_materials(new_db: bd.Database, cutoff391: bd.Database, ei_ind
                                    location='RoW',
                                    reference_product='road'
                                    )
-        road_new = road_act.copy(database=NEW_DB_NAME)
+        road_new = park_inventory.copy_to(road_act, new_db)
         technosphere_activities_to_remove = ['bitumen', 'concrete', 'steel']
         for ex in road_new.biosphere():
             if 'Transformation' in ex.input._data['name'] or 'Occupation' in ex.input._data['name']:
@@ -1935,7 +2084,7 @@ def lci_wind_turbine(new_db: bd.Database, cutoff391: bd.Database, biosphere3: bd
                      include_life_cycle_stages: bool = True,
                      eol: bool = True, transportation: bool = True,
                      use_and_maintenance: bool = True, installation: bool = True,
-                     comment: str = ''):
+                     comment: str = '', ei_index: Optional[dict] = None):
     """
     It creates the life-cycle inventories per unit (turbine and wind park) and per kwh (also turbine and wind park)
     and store them as activities in the database new_db.
@@ -1954,6 +2103,10 @@ def lci_wind_turbine(new_db: bd.Database, cutoff391: bd.Database, biosphere3: bd
     this is set to False, all the inputs would be added to the single_turbine activity. Important note: if this is set
     to False, the lca_wind_turbine_extended() function WON'T WORK AS EXPECTED (because it relies on inventories that
     contain an activity for each stage).
+
+    ei_index: index of cutoff391 (get_bw_index(cutoff391)). If None, it is taken from the registry.
+    new_db can also be a park_inventory.ParkDraft, to compute the inventories without writing them (see
+    lci_wind_parks()).
     """
     if park_power != number_of_turbines * turbine_power:
         print("WARNING. The power of the park does not match the power sum of the unitary turbines. "
@@ -1972,7 +2125,8 @@ def lci_wind_turbine(new_db: bd.Database, cutoff391: bd.Database, biosphere3: bd
                    f'land_cover_type: {land_cover_type}, eol_scenario: {eol_scenario}, cf: {cf * 100} %, '
                    f'annual attrition rate: {time_adjusted_cf}'
                    )
-    ei_index = build_bw_index(cutoff391)
+    if ei_index is None:
+        ei_index = get_bw_index(cutoff391)
     mass_materials_park = lci_materials(park_name=park_name, park_power=park_power,
                                         number_of_turbines=number_of_turbines,
                                         park_location=park_location, park_coordinates=park_coordinates,
@@ -2060,7 +2214,7 @@ def lci_wind_turbine(new_db: bd.Database, cutoff391: bd.Database, biosphere3: bd
             'WARNING: if you run delete_new_db() '
             'ALL WIND PARKS STORED IN THAT DATABASE WILL '
             'BE DELETED!')
-        sys.exit()
+        raise
 
     # add infrastructure
     elec_turbine, elec_park = electricity_production(park_name=park_name, park_power=park_power,
@@ -2090,6 +2244,55 @@ def lci_wind_turbine(new_db: bd.Database, cutoff391: bd.Database, biosphere3: bd
         return mass_materials_park, trans, occ
 
 
+def park_inventory_lci(new_db_name: str, cutoff_name: str, biosphere_name: str, park: dict,
+                       ei_index: Optional[dict] = None) -> Tuple[park_inventory.ParkInventory, tuple]:
+    """
+    Compute phase of lci_wind_turbine() for one park (´´park´´: its lci_wind_turbine() arguments, without the
+    databases): the inventory is computed in a ParkDraft of ´´new_db_name´´, so nothing is written.
+    Returns the inventory and the lci_wind_turbine() results.
+    """
+    draft = park_inventory.ParkDraft(new_db_name, park['park_name'])
+    cutoff391 = bd.Database(cutoff_name)
+    results = lci_wind_turbine(new_db=draft, cutoff391=cutoff391, biosphere3=bd.Database(biosphere_name),
+                               ei_index=ei_index if ei_index is not None else get_bw_index(cutoff391), **park)
+    return draft.inventory(), results
+
+
+def _park_worker(task: Tuple[str, str, str, str, dict]) -> Tuple[park_inventory.ParkInventory, tuple]:
+    project_name, new_db_name, cutoff_name, biosphere_name, park = task
+    if bd.projects.current != project_name:
+        bd.projects.set_current(project_name)
+    # the index of the ecoinvent database is built once per worker (get_bw_index() keeps it)
+    return park_inventory_lci(new_db_name, cutoff_name, biosphere_name, park)
+
+
+def lci_wind_parks(new_db: bd.Database, cutoff391: bd.Database, biosphere3: bd.Database, parks: List[dict],
+                   processes: int = 1, ei_index: Optional[dict] = None) -> List[tuple]:
+    """
+    Life-cycle inventories of several wind parks, as lci_wind_turbine() does for each one. ´´parks´´: the
+    lci_wind_turbine() arguments of each park (without new_db, cutoff391, biosphere3 and ei_index).
+    The parks are first computed (park_inventory_lci(), which only reads the databases), and then all their activities
+    and exchanges are written in ´´new_db´´ at once (park_inventory.write_inventories()), in a single transaction.
+    With ´´processes´´ > 1, the parks are computed in a pool of worker processes. The workers read the project as it was
+    last committed, so activities shared by several parks (transformer, steel markets, road) that are not committed
+    yet are computed again in each worker, and written only once.
+    Returns the lci_wind_turbine() results of each park, in the order of ´´parks´´.
+    """
+    if processes <= 1 or len(parks) <= 1:
+        if ei_index is None:
+            ei_index = get_bw_index(cutoff391)
+        computed = [park_inventory_lci(new_db.name, cutoff391.name, biosphere3.name, park, ei_index=ei_index)
+                    for park in parks]
+    else:
+        tasks = [(bd.projects.current, new_db.name, cutoff391.name, biosphere3.name, park) for park in parks]
+        # 'spawn': a forked worker would share the SQLite connection (and the open transaction) of this process
+        with ProcessPoolExecutor(max_workers=min(processes, len(parks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            computed = list(pool.map(_park_worker, tasks))
+    park_inventory.write_inventories([inventory for inventory, _ in computed], new_db.name)
+    return [results for _, results in computed]
+
+
 def lca_wind_turbine(new_db: bd.Database,
                      park_name: str, park_power: float,
                      method: str = 'ReCiPe 2016 v1.03, midpoint (H)',
@@ -2168,7 +2371,13 @@ def lca_wind_turbine(new_db: bd.Database,
     return results, results_kwh
 
 
-def find_unique_act(index: dict, database: bd.Database, name: str, location: str, reference_product: str):
+def find_unique_act(index: Optional[dict], database: bd.Database, name: str, location: str, reference_product: str):
+    """
+    ´´index´´: (name, location, reference product) -> key, as returned by get_bw_index(database). If None, it is taken
+    from the registry.
+    """
+    if index is None:
+        index = get_bw_index(database)
     key = index.get((name, location, reference_product))
     return database.get(key[1])
 
@@ -2178,9 +2387,27 @@ def delete_db(db_name: str):
         a.delete()
 
 def build_bw_index(database: bd.Database):
-    data = database.load()
+    # only the activities table is read (database.load() would also read all the exchanges)
     return {
-        (v['name'], v['location'], v['reference product']): k
-        for k, v in data.items()
+        (act['name'], act['location'], act.get('reference product')): act.key
+        for act in database
     }
 
+
+# (project, database name, database modification time) -> index built with build_bw_index()
+_BW_INDEXES: Dict[Tuple[str, str, str], dict] = {}
+
+
+def get_bw_index(database: bd.Database) -> dict:
+    """
+    Index of ´´database´´, built only once while the database is not modified. It is shared by all the turbines (and
+    fleets) using the same database.
+    """
+    key = (bd.projects.current, database.name, str(bd.databases[database.name].get('modified')))
+    if key not in _BW_INDEXES:
+        # drop the indexes of older versions of the database
+        for old_key in [k for k in _BW_INDEXES if k[:2] == key[:2]]:
+            del _BW_INDEXES[old_key]
+        _BW_INDEXES[key] = build_bw_index(database)
+    return _BW_INDEXES[key]
+
@@ -0,0 +1,235 @@
+import copy
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import bw2data as bd
+from bw2data.backends import Activity
+
+import bulk_write
+from country_expansion import copy_code
+
+Key = Tuple[str, str]
+
+
+class ParkInventory(NamedTuple):
+    """
+    Plain-data inventory of a wind park, as computed in a ParkDraft: the data of each activity (as in bw2data) and of
+    each exchange (with its 'input' and 'output' keys). It can be sent between processes and written with
+    write_inventories().
+    """
+    park_name: str
+    activities: List[dict]
+    exchanges: List[dict]
+
+
+class DraftExchange:
+    """
+    Exchange of a DraftActivity. It is part of the inventory once saved.
+    """
+
+    def __init__(self, activity: 'DraftActivity', data: dict):
+        self.activity = activity
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    @property
+    def input(self) -> Union[Activity, 'DraftActivity']:
+        return self.activity.draft.resolve(self._data['input'])
+
+    @property
+    def output(self) -> 'DraftActivity':
+        return self.activity
+
+    @property
+    def amount(self) -> float:
+        return self._data['amount']
+
+    def save(self):
+        if not any(ex is self for ex in self.activity.draft_exchanges):
+            self.activity.draft_exchanges.append(self)
+
+    def delete(self):
+        self.activity.draft_exchanges = [ex for ex in self.activity.draft_exchanges if ex is not self]
+
+
+class DraftActivity:
+    """
+    Activity of a ParkDraft, with the part of the bw2data Activity interface used by WindTrace.
+    """
+
+    def __init__(self, draft: 'ParkDraft', data: dict):
+        self.draft = draft
+        self._data = data
+        self.draft_exchanges: List[DraftExchange] = []
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    @property
+    def key(self) -> Key:
+        return self._data['database'], self._data['code']
+
+    def save(self):
+        # the activity is part of the draft since it was created
+        pass
+
+    def new_exchange(self, **kwargs) -> DraftExchange:
+        data = dict(kwargs, output=self.key)
+        data['input'] = tuple(getattr(data['input'], 'key', data['input']))
+        return DraftExchange(self, data)
+
+    def exchanges(self) -> List[DraftExchange]:
+        return list(self.draft_exchanges)
+
+    def technosphere(self) -> List[DraftExchange]:
+        return [ex for ex in self.draft_exchanges if ex['type'] == 'technosphere']
+
+    def biosphere(self) -> List[DraftExchange]:
+        return [ex for ex in self.draft_exchanges if ex['type'] == 'biosphere']
+
+    def production(self) -> List[DraftExchange]:
+        return [ex for ex in self.draft_exchanges if ex['type'] == 'production']
+
+
+class ParkDraft:
+    """
+    Stands in for the database ´´name´´ (´´new_db´´ in WindTrace) while the inventory of ´´park_name´´ is computed:
+    the new activities and exchanges are kept in memory, and the reads fall back to the database for the activities
+    that are not in the draft. Nothing is written, so several parks can be computed at the same time (e.g., in worker
+    processes) and written at once with write_inventories(inventory()).
+    """
+
+    def __init__(self, name: str, park_name: str):
+        self.name = name
+        self.park_name = park_name
+        self.activities: Dict[str, DraftActivity] = {}
+        self._resolved: Dict[Key, Activity] = {}
+
+    @property
+    def database(self) -> bd.Database:
+        return bd.Database(self.name)
+
+    def new_activity(self, code: str, **kwargs) -> DraftActivity:
+        if code in self.activities:
+            raise bd.errors.DuplicateNode(f"Activity '{code}' already exists in the draft of {self.park_name}")
+        data = dict(kwargs, database=self.name, code=code)
+        data.setdefault('type', 'process')
+        act = DraftActivity(self, data)
+        self.activities[code] = act
+        return act
+
+    def copy_activity(self, source: Activity, code: str) -> DraftActivity:
+        """
+        Copy of ´´source´´ (with its exchanges), as Activity.copy() does in a database.
+        """
+        data = {k: v for k, v in copy.deepcopy(source._data).items() if k not in ('id', 'database', 'code')}
+        act = self.new_activity(code, **data)
+        for ex in source.exchanges():
+            ex_data = dict(copy.deepcopy(ex._data), output=act.key)
+            ex_data['input'] = act.key if tuple(ex_data['input']) == source.key else tuple(ex_data['input'])
+            act.draft_exchanges.append(DraftExchange(act, ex_data))
+        return act
+
+    def add_inventory(self, inventory: ParkInventory):
+        """
+        Adds the activities of ´´inventory´´ (e.g., computed once for several parks) that are not in the draft yet, with
+        their exchanges.
+        """
+        added = {}
+        for data in inventory.activities:
+            if data['code'] not in self.activities:
+                added[data['code']] = self.new_activity(**copy.deepcopy(data))
+        for data in inventory.exchanges:
+            if data['output'][1] in added:
+                act = added[data['output'][1]]
+                act.draft_exchanges.append(DraftExchange(act, copy.deepcopy(data)))
+
+    def get(self, code: Optional[str] = None, **kwargs) -> Union[Activity, DraftActivity]:
+        if code in self.activities:
+            return self.activities[code]
+        return self.database.get(code, **kwargs)
+
+    def search(self, string: str, **kwargs) -> List[Union[Activity, DraftActivity]]:
+        found = [act for act in self.activities.values() if string.lower() in act['name'].lower()]
+        return found or self.database.search(string, **kwargs)
+
+    def resolve(self, key: Key) -> Union[Activity, DraftActivity]:
+        key = tuple(key)
+        if key[0] == self.name and key[1] in self.activities:
+            return self.activities[key[1]]
+        if key not in self._resolved:
+            self._resolved[key] = bd.get_activity(key)
+        return self._resolved[key]
+
+    def __iter__(self) -> Iterator[Union[Activity, DraftActivity]]:
+        yield from self.database
+        yield from self.activities.values()
+
+    def inventory(self) -> ParkInventory:
+        return ParkInventory(park_name=self.park_name,
+                             activities=[copy.deepcopy(act._data) for act in self.activities.values()],
+                             exchanges=[copy.deepcopy(ex._data) for act in self.activities.values()
+                                        for ex in act.draft_exchanges])
+
+
+def copy_to(act: Activity, new_db: Union[bd.Database, ParkDraft], suffix: str = '') -> Union[Activity, DraftActivity]:
+    """
+    Copy of ´´act´´ in ´´new_db´´ (a database or a ParkDraft), with a code derived from ´´act´´ and ´´suffix´´, so the
+    same copy made by several parks is written once.
+    """
+    code = copy_code(act.key, new_db.name, suffix)
+    if isinstance(new_db, ParkDraft):
+        return new_db.copy_activity(act, code)
+    return act.copy(database=new_db.name, code=code)
+
+
+def write_inventories(inventories: Sequence[ParkInventory], database: str) -> int:
+    """
+    Writes the activities and exchanges of ´´inventories´´ in ´´database´´, in a single transaction. The activities of
+    a park are those whose code starts with its name, and they must not exist yet (bd.errors.DuplicateNode). The rest
+    (transformer, steel markets, road) are shared by the parks: they are written only if they are not in the database
+    yet, once, and otherwise their exchanges are left as they are.
+    Returns the number of activities written.
+    """
+    existing = bulk_write.existing_codes(database, [act['code'] for inventory in inventories for act in inventory.activities])
+    written = set()
+    new_activities, new_exchanges = [], []
+    for inventory in inventories:
+        duplicated = sorted(act['code'] for act in inventory.activities if act['code'].startswith(inventory.park_name)
+                            and (act['code'] in existing or act['code'] in written))
+        if duplicated:
+            raise bd.errors.DuplicateNode(f"An inventory for a park with the name '{inventory.park_name}' was already "
+                                          f"created before in the database '{database}': {duplicated}. Give another "
+                                          f"name to the wind park, or delete its activities first.")
+        outputs = set()
+        for data in inventory.activities:
+            if data['code'] in existing or data['code'] in written:
+                continue
+            written.add(data['code'])
+            outputs.add(data['code'])
+            new_activities.append(bulk_write.activity_row(dict(data, database=database)))
+        for data in inventory.exchanges:
+            if data['output'][1] not in outputs:
+                continue
+            new_exchanges.append(bulk_write.exchange_row(dict(data, output=(database, data['output'][1]))))
+
+    bulk_write.write_rows(database, new_activities, new_exchanges)
+    print(f'{len(inventories)} inventories written in {database}: {len(new_activities)} activities and '
+          f'{len(new_exchanges)} exchanges')
+    return len(new_activities)
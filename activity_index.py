@@ -0,0 +1,293 @@
+import bisect
+import functools
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import bw2data as bd
+import wurst.errors
+from bw2data.backends import Activity, SQLiteBackend
+
+# fields with a dictionary index. 'name' is additionally kept sorted to resolve prefix (startswith) searches.
+INDEXED_FIELDS = ('name', 'location', 'reference product')
+
+
+##### search filters #####
+class Filter:
+    """
+    Search condition over the data of an activity. It behaves like the wurst.searching filters (it can be called with
+    the activity data and returns a boolean), but it also keeps the field and the value so the index can use them.
+    """
+
+    def __init__(self, kind: str, field: Optional[str], value: Any, inner: Optional['Filter'] = None):
+        self.kind = kind
+        self.field = field
+        self.value = value
+        self.inner = inner
+
+    def __call__(self, data: dict) -> bool:
+        if self.kind == 'equals':
+            return data.get(self.field) == self.value
+        if self.kind == 'contains':
+            return self.value in (data.get(self.field) or '')
+        if self.kind == 'startswith':
+            return (data.get(self.field) or '').startswith(self.value)
+        if self.kind == 'in':
+            return data.get(self.field) in self.value
+        if self.kind == 'exclude':
+            return not self.inner(data)
+        raise ValueError(f'Unknown filter type: {self.kind}')
+
+    def __repr__(self):
+        if self.kind == 'exclude':
+            return f'exclude({self.inner!r})'
+        return f'{self.kind}({self.field!r}, {self.value!r})'
+
+
+def equals(field: str, value: Any) -> Filter:
+    return Filter('equals', field, value)
+
+
+def contains(field: str, value: str) -> Filter:
+    return Filter('contains', field, value)
+
+
+def startswith(field: str, value: str) -> Filter:
+    return Filter('startswith', field, value)
+
+
+def is_in(field: str, values: Iterable[Any]) -> Filter:
+    return Filter('in', field, frozenset(values))
+
+
+def exclude(inner: Filter) -> Filter:
+    return Filter('exclude', None, None, inner=inner)
+
+
+##### index #####
+class ActivityIndex:
+    """
+    In-memory index of all the activities of a database, built with a single pass over the database. Activities are
+    identified by their id in the SQLite database, so a change of code or location is an update and not a new entry.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.activities: Dict[int, Activity] = {}
+        self.order: Dict[int, int] = {}
+        self.fields: Dict[str, Dict[Any, Set[int]]] = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        self._entries: Dict[int, Tuple[Any, ...]] = {}
+        self._sorted_names: Optional[List[str]] = None
+        self._counter = 0
+        if db_name in bd.databases:
+            for act in bd.Database(db_name):
+                self.add(act)
+
+    def __len__(self):
+        return len(self.activities)
+
+    def add(self, act: Activity):
+        """
+        Adds the activity to the index, or updates it if it was already there.
+        """
+        act_id = act.id
+        if act_id in self.activities:
+            self.remove(act_id)
+        else:
+            self.order[act_id] = self._counter
+            self._counter += 1
+        values = tuple(act._data.get(field) for field in INDEXED_FIELDS)
+        for field, value in zip(INDEXED_FIELDS, values):
+            if field == 'name' and value not in self.fields['name']:
+                self._sorted_names = None
+            self.fields[field][value].add(act_id)
+        self.activities[act_id] = act
+        self._entries[act_id] = values
+
+    def remove(self, act_id: int):
+        values = self._entries.pop(act_id, None)
+        if values is None:
+            return
+        for field, value in zip(INDEXED_FIELDS, values):
+            ids = self.fields[field][value]
+            ids.discard(act_id)
+            if not ids:
+                del self.fields[field][value]
+                if field == 'name':
+                    self._sorted_names = None
+        del self.activities[act_id]
+
+    def discard(self, act_id: int):
+        """
+        Removes the activity from the index, forgetting also its position in the database order.
+        """
+        self.remove(act_id)
+        self.order.pop(act_id, None)
+
+    def names_starting_with(self, prefix: str) -> List[str]:
+        if self._sorted_names is None:
+            self._sorted_names = sorted(n for n in self.fields['name'] if isinstance(n, str))
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        names = []
+        for name in self._sorted_names[start:]:
+            if not name.startswith(prefix):
+                break
+            names.append(name)
+        return names
+
+    def _candidates(self, filters: Iterable[Filter]) -> Iterable[int]:
+        """
+        Narrows the search to the ids matching the indexed filters (equality or membership on name, location and
+        reference product, and name prefix). The remaining filters are checked afterwards on each candidate.
+        """
+        candidate_sets = []
+        for f in filters:
+            if not isinstance(f, Filter):
+                continue
+            if f.kind == 'equals' and f.field in INDEXED_FIELDS:
+                candidate_sets.append(self.fields[f.field].get(f.value, set()))
+            elif f.kind == 'in' and f.field in INDEXED_FIELDS:
+                ids = set()
+                for value in f.value:
+                    ids |= self.fields[f.field].get(value, set())
+                candidate_sets.append(ids)
+            elif f.kind == 'startswith' and f.field == 'name':
+                ids = set()
+                for name in self.names_starting_with(f.value):
+                    ids |= self.fields['name'][name]
+                candidate_sets.append(ids)
+        if not candidate_sets:
+            return self.activities.keys()
+        candidate_sets.sort(key=len)
+        ids = set(candidate_sets[0])
+        for other in candidate_sets[1:]:
+            ids &= other
+            if not ids:
+                break
+        return ids
+
+    def search(self, *filters: Callable[[dict], bool]) -> List[Activity]:
+        ids = self._candidates(filters)
+        results = [act_id for act_id in ids if all(f(self.activities[act_id]._data) for f in filters)]
+        results.sort(key=self.order.__getitem__)
+        return [self.activities[act_id] for act_id in results]
+
+
+##### registry #####
+# one index per (project, database). Built on first use.
+_INDEXES: Dict[Tuple[str, str], ActivityIndex] = {}
+
+
+def get_index(db_name: str) -> ActivityIndex:
+    key = (bd.projects.current, db_name)
+    if key not in _INDEXES:
+        _INDEXES[key] = ActivityIndex(db_name)
+    return _INDEXES[key]
+
+
+def loaded_index(db_name: str) -> Optional[ActivityIndex]:
+    """
+    Index of ´´db_name´´ if it was already built (None otherwise, without building it).
+    """
+    return _INDEXES.get((bd.projects.current, db_name))
+
+
+def invalidate(db_name: Optional[str] = None):
+    """
+    Drops the index of ´´db_name´´ (or all of them if None), so it is rebuilt in the next search.
+    """
+    if db_name is None:
+        _INDEXES.clear()
+        return
+    for key in [k for k in _INDEXES if k[1] == db_name]:
+        del _INDEXES[key]
+
+
+def get_many(db_name: str, *filters: Callable[[dict], bool]) -> List[Activity]:
+    """
+    Indexed equivalent of wurst.searching.get_many(bd.Database(db_name), *filters).
+    """
+    return get_index(db_name).search(*filters)
+
+
+def get_one(db_name: str, *filters: Callable[[dict], bool]) -> Activity:
+    """
+    Indexed equivalent of wurst.searching.get_one(bd.Database(db_name), *filters). It raises the same wurst errors.
+    """
+    results = get_many(db_name, *filters)
+    if not results:
+        raise wurst.errors.NoResults(f'No results found in {db_name} for {filters}')
+    if len(results) > 1:
+        raise wurst.errors.MultipleResults(f'Multiple results found in {db_name} for {filters}: '
+                                           f'{[(a["name"], a["location"]) for a in results]}')
+    return results[0]
+
+
+##### keep the indexes up to date with the writes of the pipeline #####
+def _loaded_indexes() -> List[ActivityIndex]:
+    return [index for (project, _), index in _INDEXES.items() if project == bd.projects.current]
+
+
+def _on_activity_saved(act: Activity):
+    act_id = act.id
+    for index in _loaded_indexes():
+        if index.db_name == act['database']:
+            index.add(act)
+        elif act_id in index.activities:
+            # the activity was moved to another database
+            index.discard(act_id)
+
+
+def _on_activity_deleted(db_name: str, act_id: int):
+    for index in _loaded_indexes():
+        if index.db_name == db_name:
+            index.discard(act_id)
+
+
+def _wrap_activity_save(save):
+    @functools.wraps(save)
+    def wrapper(self, *args, **kwargs):
+        result = save(self, *args, **kwargs)
+        _on_activity_saved(self)
+        return result
+    wrapper._activity_index_hook = True
+    return wrapper
+
+
+def _wrap_activity_delete(delete):
+    @functools.wraps(delete)
+    def wrapper(self, *args, **kwargs):
+        db_name, act_id = self['database'], self.id
+        result = delete(self, *args, **kwargs)
+        _on_activity_deleted(db_name, act_id)
+        return result
+    wrapper._activity_index_hook = True
+    return wrapper
+
+
+def _wrap_database_method(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            invalidate(self.name)
+    wrapper._activity_index_hook = True
+    return wrapper
+
+
+def install_write_hooks():
+    """
+    Activity saves and deletions update the loaded indexes in place. Whole-database writes (write, copy target,
+    delete) drop the index of that database. Exchange writes do not change the index.
+    """
+    if not getattr(Activity.save, '_activity_index_hook', False):
+        Activity.save = _wrap_activity_save(Activity.save)
+    if not getattr(Activity.delete, '_activity_index_hook', False):
+        Activity.delete = _wrap_activity_delete(Activity.delete)
+    for method_name in ['write', 'delete']:
+        method = getattr(SQLiteBackend, method_name)
+        if not getattr(method, '_activity_index_hook', False):
+            setattr(SQLiteBackend, method_name, _wrap_database_method(method))
+
+
+install_write_hooks()
@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import bw2data as bd
+import pandas as pd
+
+import instrumentation
+from functions import delete_infrastructure_main, premise_base_auxiliary, update_cement_iron_foreground
+from instrumentation import span
+from main import avoid_double_accounting, create_fleets, update_background, update_foreground
+from synthetic_project import DEFAULT_MAPPING_FILE, build_synthetic_project
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_RESULTS_FILE = os.path.join(script_dir, 'benchmark_results.jsonl')
+BENCHMARK_TRACES_FOLDER = os.path.join(script_dir, 'benchmark_traces')
+DEFAULT_SIZES = (1000, 10000, 50000)
+
+
+def benchmark_stages(mapping_file: str = DEFAULT_MAPPING_FILE) -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    The stages benchmarked, in the order of run(), with their default parameters.
+    """
+    return [
+        ('update_background', update_background),
+        ('premise_base_auxiliary', premise_base_auxiliary),
+        ('update_foreground', update_foreground),
+        ('fleets', create_fleets),
+        ('update_cement_iron_foreground', lambda: update_cement_iron_foreground(file_path=mapping_file)),
+        ('delete_infrastructure_main', lambda: delete_infrastructure_main(file_path=mapping_file)),
+        ('avoid_double_accounting', lambda: avoid_double_accounting(
+            electricity=True, heat=True, co2=True, hydrogen=True, biomass=True, methane=True, methanol=True,
+            kerosene=True, diesel=True)),
+    ]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _stage_result(tracer: instrumentation.Tracer, stage: str) -> Dict[str, Any]:
+    # the span of the stage is the last one closed with its name; its children are the spans inside it
+    event = next(e for e in reversed(tracer.events) if e['name'] == stage)
+    start, end = event['ts'], event['ts'] + event['dur']
+    children = instrumentation.Tracer()
+    children.events = [e for e in tracer.events if e is not event and start <= e['ts'] and e['ts'] + e['dur'] <= end]
+    return {'seconds': event['dur'] / 1e6, **{c: event['args'][c] for c in instrumentation.COUNTERS},
+            'spans': children.summary()}
+
+
+def run_benchmark(sizes: Sequence[int] = DEFAULT_SIZES, mapping_file: str = DEFAULT_MAPPING_FILE,
+                  results_file: str = BENCHMARK_RESULTS_FILE, seed: int = 0,
+                  keep_projects: bool = False) -> List[Dict[str, Any]]:
+    """
+    Runs the stages (benchmark_stages()) on synthetic projects of each of ´´sizes´´ activities
+    (see synthetic_project.py), so they can be timed without ecoinvent nor premise. For each size and stage, the time,
+    the counters of the trace (database reads and writes, activity searches and copies) and the time of the spans
+    inside the stage (e.g., each fleet) are appended to ´´results_file´´ (one JSON object per line), together with the
+    git commit, so that runs of different commits can be compared (compare_results()). A stage that fails is recorded
+    with its error and the next ones still run. The traces are saved in BENCHMARK_TRACES_FOLDER.
+    """
+    commit = git_commit()
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    verbosity = instrumentation.VERBOSITY
+    instrumentation.set_verbosity(0)
+    results = []
+    try:
+        for size in sizes:
+            project_name = f'benchmark_{size}'
+            build_synthetic_project(project_name, n_activities=size, seed=seed, mapping_file=mapping_file)
+            tracer = instrumentation.start_trace()
+            for stage, function in benchmark_stages(mapping_file):
+                print(f'Benchmark {size} activities: {stage}')
+                error = None
+                with span(stage, size=size):
+                    try:
+                        function()
+                    except Exception:
+                        error = traceback.format_exc(limit=3)
+                        print(f'  {stage} failed:\n{error}')
+                result = {'commit': commit, 'timestamp': timestamp, 'size': size, 'seed': seed, 'stage': stage,
+                          'status': 'failed' if error else 'ok', 'error': error, **_stage_result(tracer, stage)}
+                results.append(result)
+                with open(results_file, 'a') as f:
+                    f.write(json.dumps(result, default=str) + '\n')
+            instrumentation.stop_trace(os.path.join(BENCHMARK_TRACES_FOLDER, f'{project_name}_{timestamp}.json'))
+            if not keep_projects:
+                bd.projects.set_current('default')
+                bd.projects.delete_project(project_name, delete_dir=True)
+    finally:
+        instrumentation.stop_trace()
+        instrumentation.set_verbosity(verbosity)
+    return results
+
+
+def compare_results(results_file: str = BENCHMARK_RESULTS_FILE, value: str = 'seconds') -> pd.DataFrame:
+    """
+    ´´value´´ of each (size, stage) (rows) in each benchmarked commit (columns, in the order they were run), e.g., to
+    spot regressions. Only the last run of each commit is kept, and failed stages are left empty.
+    """
+    with open(results_file) as f:
+        results = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    results = results[results['status'] == 'ok']
+    last_runs = results.groupby('commit')['timestamp'].transform('max')
+    results = results[results['timestamp'] == last_runs]
+    commits = list(dict.fromkeys(results.sort_values('timestamp')['commit']))
+    table = results.pivot_table(index=['size', 'stage'], columns='commit', values=value, aggfunc='first')
+    return table[commits]
+
+
+if __name__ == '__main__':
+    run_benchmark()
+    print(compare_results())
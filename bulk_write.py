@@ -0,0 +1,156 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import bw2data as bd
+from bw2data import geomapping
+from bw2data.backends import Activity, ActivityDataset, ExchangeDataset, sqlite3_lci_db
+from bw2data.search import IndexManager
+from bw2data.snowflake_ids import snowflake_id_generator
+from peewee import chunked
+
+import activity_index
+import consumer_index
+
+# max. number of ids per query, and rows per INSERT statement (SQLite variables limit)
+CHUNK = 900
+BATCH = 100
+
+Key = Tuple[str, str]
+
+
+##### reading rows #####
+def exchange_rows(keys: Iterable[Key]) -> Dict[Key, List[dict]]:
+    """
+    Rows of the exchanges of the activities ´´keys´´, by output key, with one query per database and chunk of codes.
+    """
+    codes = defaultdict(list)
+    for database, code in keys:
+        codes[database].append(code)
+    rows = defaultdict(list)
+    for database, database_codes in codes.items():
+        for start in range(0, len(database_codes), CHUNK):
+            for row in ExchangeDataset.select().where(
+                    (ExchangeDataset.output_database == database) &
+                    (ExchangeDataset.output_code.in_(database_codes[start:start + CHUNK]))).dicts():
+                rows[(row['output_database'], row['output_code'])].append(row)
+    return rows
+
+
+def existing_codes(database: str, codes: Iterable[str]) -> set:
+    """
+    The ´´codes´´ that are already in ´´database´´.
+    """
+    codes = sorted(set(codes))
+    existing = set()
+    for start in range(0, len(codes), CHUNK):
+        existing.update(code for (code,) in ActivityDataset.select(ActivityDataset.code).where(
+            (ActivityDataset.database == database) & (ActivityDataset.code.in_(codes[start:start + CHUNK]))).tuples())
+    return existing
+
+
+##### writing rows #####
+def activity_row(data: dict) -> dict:
+    """
+    Row of the activities table for the activity ´´data´´ (with its 'database' and 'code'), with a new id, as
+    Database.write() makes it. The id of a copied activity, if any, is dropped from its data.
+    """
+    data = {k: v for k, v in data.items() if k != 'id'}
+    return {'id': next(snowflake_id_generator), 'data': data, 'code': data['code'], 'database': data['database'],
+            'location': data.get('location'), 'name': data.get('name'), 'product': data.get('reference product'),
+            'type': data.get('type', 'process')}
+
+
+def exchange_row(data: dict) -> dict:
+    """
+    Row of the exchanges table for the exchange ´´data´´ (with its 'input' and 'output' keys), with a new id.
+    """
+    return {'id': next(snowflake_id_generator), 'data': data, 'input_database': data['input'][0],
+            'input_code': data['input'][1], 'output_database': data['output'][0], 'output_code': data['output'][1],
+            'type': data['type']}
+
+
+def copied_exchange_row(row: dict, source: Key, new_key: Key) -> dict:
+    """
+    Row of the copy of the exchange ´´row´´ of ´´source´´ in its copy ´´new_key´´ (the production exchange, or any
+    other input from ´´source´´ itself, is relinked to the copy), as Activity.copy() does.
+    """
+    data = dict(row['data'], output=new_key)
+    if (row['input_database'], row['input_code']) == source:
+        data['input'] = new_key
+    return exchange_row(data)
+
+
+def relabelled_activity_row(row: dict, target: str) -> dict:
+    """
+    Row of the copy in the database ´´target´´ of the activity ´´row´´ (a row of the activities table).
+    """
+    return activity_row(dict(row['data'], database=target))
+
+
+def relabelled_exchange_row(row: dict, source: str, target: str) -> dict:
+    """
+    Row of the copy of the exchange ´´row´´ of the database ´´source´´ in its copy ´´target´´: the inputs from
+    ´´source´´ are relinked to ´´target´´, and the inputs from other databases are kept, as Database.copy() does.
+    """
+    data = dict(row['data'], output=(target, row['output_code']))
+    if row['input_database'] == source:
+        data['input'] = (target, row['input_code'])
+    return exchange_row(data)
+
+
+def insert_rows(activities: Iterable[dict], exchanges: Iterable[dict]) -> Tuple[List[dict], int]:
+    """
+    Inserts the rows (activity_row(), exchange_row()) in batches, in the open transaction, and adds the technosphere
+    exchanges to the loaded consumer indexes. Returns the activity rows and the number of exchanges inserted.
+    Call registered() with the activity rows once the transaction is committed.
+    """
+    inserted = []
+    for batch in chunked(activities, BATCH):
+        ActivityDataset.insert_many(batch).execute()
+        inserted += batch
+    n_exchanges = 0
+    for batch in chunked(exchanges, BATCH):
+        ExchangeDataset.insert_many(batch).execute()
+        consumer_index.add_exchange_rows(batch)
+        n_exchanges += len(batch)
+    return inserted, n_exchanges
+
+
+def registered(database: str, activities: Sequence[dict]):
+    """
+    What Activity.save() does after writing, once for all the activity rows inserted in ´´database´´ with
+    insert_rows(): the database is marked as dirty, the new locations are added to the geomapping, and the activities
+    are added to the search index (if the database is searchable) and to the loaded activity index. bw2data 4 has no
+    key mapping to update: the rows carry their ids.
+    """
+    bd.databases.set_dirty(database)
+    if not activities:
+        return
+    locations = {row['location'] for row in activities if row['location']}
+    if locations:
+        geomapping.add(locations)
+    if bd.databases[database].get('searchable', True):
+        IndexManager(bd.Database(database).filename).add_datasets([row['data'] for row in activities])
+    index = activity_index.loaded_index(database)
+    if index is not None:
+        for row in activities:
+            index.add(Activity(ActivityDataset(**row)))
+
+
+def write_rows(database: str, activities: Iterable[dict], exchanges: Iterable[dict],
+               deleted_exchanges: Sequence[int] = ()) -> Tuple[int, int]:
+    """
+    Deletes the exchanges with the ids ´´deleted_exchanges´´ and writes the activity and exchange rows of ´´database´´,
+    in one transaction, and then registers the new activities (registered()). Returns the number of activities and
+    exchanges written.
+    """
+    try:
+        with sqlite3_lci_db.db.atomic():
+            consumer_index.delete_exchange_ids(deleted_exchanges)
+            inserted, n_exchanges = insert_rows(activities, exchanges)
+    except BaseException:
+        # the consumer indexes were updated with the rows that have been rolled back
+        consumer_index.invalidate()
+        raise
+    registered(database, inserted)
+    return len(inserted), n_exchanges
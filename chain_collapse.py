@@ -0,0 +1,94 @@
+import copy
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import activity_index as ix
+import bulk_write
+import tier_aggregation
+from country_expansion import copy_code
+
+Key = Tuple[str, str]
+
+
+class ChainSpec(NamedTuple):
+    """
+    A chain of activities collapsed into its root (one item of config_parameters.METHANOL_CHAINS or FT_FUEL_CHAINS).
+    """
+    name: str
+    database: str
+    inputs: Tuple[str, ...]
+    tier_limit: int
+    biosphere_inputs: Optional[Tuple[str, ...]] = None
+    biosphere_tier_limit: int = 0
+
+    @classmethod
+    def from_config(cls, chain: dict) -> 'ChainSpec':
+        biosphere_inputs = chain.get('biosphere_inputs')
+        return cls(name=chain['name'], database=chain['database'], inputs=tuple(chain['inputs']),
+                   tier_limit=chain['tier_limit'],
+                   biosphere_inputs=tuple(biosphere_inputs) if biosphere_inputs is not None else None,
+                   biosphere_tier_limit=chain.get('biosphere_tier_limit', 0))
+
+    @property
+    def members(self) -> frozenset:
+        return frozenset(self.inputs) | frozenset(self.biosphere_inputs or ())
+
+
+def _new_row(input_key: Key, output_key: Key, amount: float, ex_type: str) -> dict:
+    return bulk_write.exchange_row({'input': input_key, 'output': output_key, 'amount': float(amount), 'type': ex_type})
+
+
+def collapse_chains(chains: Sequence[dict], target: str = 'additional_acts') -> Dict[str, Key]:
+    """
+    Collapses (de-nests) each chain of ´´chains´´ (see config_parameters.METHANOL_CHAINS) into its root activity, in
+    ´´target´´:
+    - technosphere: the inputs of the root, without the one named as the first member of the chain, plus the
+    aggregated technosphere of the chain (tier_aggregation.technosphere_inputs()).
+    - biosphere: the biosphere of the root and of its 'biosphere_inputs' (tier_aggregation.biosphere_flows()), or the
+    one of the root if there are no 'biosphere_inputs'.
+    Roots outside ´´target´´ are copied into it (with a code derived from the root, so collapsing twice rewrites the
+    same copy); roots in ´´target´´ are rewritten in place. The chain members are not modified.
+    All the chains share one sub-graph, read once for all of them, and everything is written in a single transaction.
+    Returns the key of the collapsed activity of each root name.
+    """
+    specs = [ChainSpec.from_config(chain) for chain in chains]
+    roots = [ix.get_one(spec.database, ix.equals('name', spec.name)) for spec in specs]
+    members = frozenset().union(*(spec.members for spec in specs))
+    depth = max(max(spec.tier_limit, spec.biosphere_tier_limit) for spec in specs)
+    graph = tier_aggregation.TierGraph([root.key for root in roots], members, depth)
+    names = dict(zip(graph.inputs, graph.names))
+    exchanges = bulk_write.exchange_rows([root.key for root in roots])
+
+    new_keys = {root.key: root.key if root['database'] == target else (target, copy_code(root.key, target))
+                for root in roots}
+    existing = bulk_write.existing_codes(target, [k[1] for k in new_keys.values()])
+    new_activities, new_exchanges, rewritten = [], [], []
+    for spec, root in zip(specs, roots):
+        new_key = new_keys[root.key]
+        if new_key[1] in existing:
+            rewritten.append(new_key)
+        else:
+            new_activities.append(bulk_write.activity_row(dict(copy.deepcopy(root._data), database=target,
+                                                               code=new_key[1])))
+        for row in exchanges.get(root.key, []):
+            input_key = (row['input_database'], row['input_code'])
+            if row['type'] == 'technosphere' and names.get(input_key) == spec.inputs[0]:
+                continue
+            if row['type'] == 'biosphere' and spec.biosphere_inputs is not None:
+                continue
+            new_exchanges.append(bulk_write.copied_exchange_row(row, root.key, new_key))
+        technosphere = graph.collapsed_technosphere(spec.tier_limit, excluded=members - frozenset(spec.inputs))
+        for input_key, amount in graph.amounts(technosphere, root.key, graph.inputs).items():
+            new_exchanges.append(_new_row(input_key, new_key, amount, 'technosphere'))
+        if spec.biosphere_inputs is not None:
+            biosphere = graph.biosphere_series(spec.biosphere_tier_limit,
+                                               excluded=members - frozenset(spec.biosphere_inputs))
+            for flow, amount in graph.amounts(biosphere, root.key, graph.flows).items():
+                new_exchanges.append(_new_row(flow, new_key, amount, 'biosphere'))
+
+    # the exchanges of the roots collapsed before are written again
+    rewritten_exchanges = [row['id'] for rows in bulk_write.exchange_rows(rewritten).values() for row in rows]
+    bulk_write.write_rows(target, new_activities, new_exchanges, deleted_exchanges=rewritten_exchanges)
+    tier_aggregation.invalidate()
+    print(f'{len(specs)} chains collapsed into {target}: {len(new_activities)} activities and {len(new_exchanges)} '
+          f'exchanges written')
+    return {spec.name: new_keys[root.key] for spec, root in zip(specs, roots)}
@@ -0,0 +1,413 @@
+import copy
+import functools
+import pickle
+from typing import Any, Callable, Dict, List, Optional
+
+import bw2data as bd
+import pandas as pd
+from bw2data.backends import Activity, ActivityDataset, Exchange, ExchangeDataset, SQLiteBackend, sqlite3_lci_db
+from bw2data.backends.proxies import Exchanges
+from bw2data.meta import Databases
+from bw2data.search import IndexManager
+from peewee import fn
+
+import activity_index
+import bulk_write
+import chain_collapse
+import consumer_index
+import country_expansion
+import database_copy
+import tier_aggregation
+from WindTrace import WindTrace_onshore, park_inventory
+from write_buffer import exchange_write_buffer
+
+# operations that can be applied again with apply_changeset()
+REPLAYABLE_OPS = ('create_activity', 'update_activity', 'copy_activity', 'delete_activity',
+                  'create_exchange', 'relink_exchange', 'change_amount', 'update_exchange', 'delete_exchange',
+                  'copy_database', 'register_database', 'expand_countries', 'collapse_chains',
+                  'write_park_inventories')
+
+
+class Changeset:
+    """
+    Ordered list of the writes a stage would do, recorded by plan_stage(). Each operation is a dictionary with the key
+    'op' and:
+        - activities ('create_activity', 'update_activity', 'copy_activity', 'delete_activity'): 'key' and 'data'
+          (or 'source' and 'kwargs' for copies).
+        - exchanges ('create_exchange', 'relink_exchange', 'change_amount', 'update_exchange', 'delete_exchange'):
+          'output', 'input', 'amount' and, for updates, 'old_input' and 'old_amount'. Updates and deletes also have
+          the 'exchange' they change, as (output, input, type, position) (see _exchange_identity()).
+        - databases ('copy_database', 'register_database', 'write_database', 'delete_database').
+        - bulk country expansions ('expand_countries'): 'kwargs' and the resulting 'activities'.
+        - bulk chain collapses ('collapse_chains'): 'chains' and the resulting 'activities'.
+        - bulk wind park writes ('write_park_inventories'): the 'inventories' and the database 'name'.
+    ´´fingerprint´´ identifies the state of the project when the plan was made. The changeset can only be applied to
+    that same state.
+    """
+
+    def __init__(self, stage_name: str, fingerprint: Dict[str, Any]):
+        self.stage_name = stage_name
+        self.fingerprint = fingerprint
+        # hash of the stage inputs, when planned by a StageRunner (to record the stage as completed once applied)
+        self.stage_hash: Optional[str] = None
+        self.operations: List[Dict[str, Any]] = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        One row per operation, with the activity it changes (the output, for exchanges).
+        """
+        rows = []
+        for operation in self.operations:
+            rows.append({'op': operation['op'],
+                         'activity': operation.get('key', operation.get('output', operation.get('name'))),
+                         'input': operation.get('input'), 'old_input': operation.get('old_input'),
+                         'amount': operation.get('amount'), 'old_amount': operation.get('old_amount')})
+        return pd.DataFrame(rows, columns=['op', 'activity', 'input', 'old_input', 'amount', 'old_amount'])
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Number of operations of each type per database.
+        """
+        df = self.to_dataframe()
+        if df.empty:
+            return pd.DataFrame(columns=['database', 'op', 'count'])
+        df['database'] = df['activity'].apply(lambda a: a[0] if isinstance(a, tuple) else a)
+        return df.groupby(['database', 'op']).size().reset_index(name='count')
+
+    def save(self, file_path: str):
+        with open(file_path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(file_path: str) -> 'Changeset':
+        with open(file_path, 'rb') as f:
+            return pickle.load(f)
+
+
+def project_fingerprint() -> Dict[str, Any]:
+    """
+    Last modification of each database and highest activity and exchange ids. A changeset replays the same writes only
+    if the project is still in this state.
+    """
+    return {'project': bd.projects.current,
+            'databases': {name: bd.databases[name].get('modified') for name in sorted(bd.databases)},
+            'max_activity_id': ActivityDataset.select(fn.MAX(ActivityDataset.id)).scalar(),
+            'max_exchange_id': ExchangeDataset.select(fn.MAX(ExchangeDataset.id)).scalar()}
+
+
+##### recording #####
+def _exchange_identity(row: ExchangeDataset) -> tuple:
+    # (output, input, type, position among the exchanges with the same output, input and type, by id). Replaying a plan
+    # gives new ids to the exchanges it creates (directly, or in copies and bulk writes), but the same positions
+    position = ExchangeDataset.select().where(
+        (ExchangeDataset.output_database == row.output_database) & (ExchangeDataset.output_code == row.output_code) &
+        (ExchangeDataset.input_database == row.input_database) & (ExchangeDataset.input_code == row.input_code) &
+        (ExchangeDataset.type == row.type) & (ExchangeDataset.id < row.id)).count()
+    return (row.output_database, row.output_code), (row.input_database, row.input_code), row.type, position
+
+
+class _Recorder:
+    """
+    Wraps the bw2data write methods to record every write in a Changeset. Writes done inside another recorded write
+    (e.g., the activity and exchanges created by Activity.copy()) are part of that operation and are not recorded
+    again. The writes to files outside the lci transaction (processed arrays, search indexes) are skipped.
+    """
+
+    def __init__(self, changeset: Changeset):
+        self.changeset = changeset
+        self.depth = 0
+        self.originals = []
+
+    def _patch(self, owner, name: str, record: Callable):
+        original = getattr(owner, name)
+        self.originals.append((owner, name, original))
+        recorder = self
+
+        @functools.wraps(original)
+        def wrapper(obj, *args, **kwargs):
+            if recorder.depth > 0:
+                return original(obj, *args, **kwargs)
+            recorder.depth += 1
+            try:
+                return record(original, obj, *args, **kwargs)
+            finally:
+                recorder.depth -= 1
+        setattr(owner, name, wrapper)
+
+    def _skip(self, owner, name: str, message: Optional[Callable] = None):
+        # also inside other recorded writes (e.g., the search index update of Activity.save())
+        original = getattr(owner, name)
+        self.originals.append((owner, name, original))
+
+        @functools.wraps(original)
+        def skipped(obj, *args, **kwargs):
+            if message is not None:
+                print(message(obj))
+        setattr(owner, name, skipped)
+
+    def _add(self, **operation):
+        self.changeset.operations.append(operation)
+
+    # activities
+    def _activity_save(self, save, act, *args, **kwargs):
+        is_new = act._document.id is None
+        result = save(act, *args, **kwargs)
+        self._add(op='create_activity' if is_new else 'update_activity', id=act.id, key=act.key,
+                  data=copy.deepcopy(act._data))
+        return result
+
+    def _activity_copy(self, act_copy, act, *args, **kwargs):
+        new_act = act_copy(act, *args, **kwargs)
+        self._add(op='copy_activity', source=act.key, key=new_act.key, id=new_act.id, code=new_act['code'],
+                  kwargs={k: v for k, v in kwargs.items() if k != 'code'})
+        return new_act
+
+    def _activity_delete(self, delete, act, *args, **kwargs):
+        self._add(op='delete_activity', id=act.id, key=act.key)
+        return delete(act, *args, **kwargs)
+
+    # exchanges
+    def _exchange_save(self, save, ex, *args, **kwargs):
+        ex_id = ex._document.id
+        if ex_id is None:
+            result = save(ex, *args, **kwargs)
+            self._add(op='create_exchange', id=ex._document.id, output=ex['output'], input=ex['input'],
+                      amount=ex['amount'], data=copy.deepcopy(ex._data))
+            return result
+        old = ExchangeDataset.get_by_id(ex_id)
+        old_input, old_amount = (old.input_database, old.input_code), old.data.get('amount')
+        identity = _exchange_identity(old)
+        result = save(ex, *args, **kwargs)
+        if tuple(ex['input']) != old_input:
+            op = 'relink_exchange'
+        elif ex['amount'] != old_amount:
+            op = 'change_amount'
+        else:
+            op = 'update_exchange'
+        self._add(op=op, id=ex_id, exchange=identity, output=ex['output'], input=ex['input'], amount=ex['amount'],
+                  old_input=old_input, old_amount=old_amount, data=copy.deepcopy(ex._data))
+        return result
+
+    def _exchange_delete(self, delete, ex, *args, **kwargs):
+        self._add(op='delete_exchange', id=ex._document.id, exchange=_exchange_identity(ex._document),
+                  output=ex['output'], input=ex['input'], amount=ex['amount'])
+        return delete(ex, *args, **kwargs)
+
+    def _exchanges_delete(self, delete, exchanges, *args, **kwargs):
+        # bulk delete (e.g., act.technosphere().delete()): record each exchange
+        for ex in exchanges:
+            self._add(op='delete_exchange', id=ex._document.id, exchange=_exchange_identity(ex._document),
+                      output=ex['output'], input=ex['input'], amount=ex['amount'])
+        return delete(exchanges, *args, **kwargs)
+
+    def _exchange_ids_delete(self, delete, exchange_ids, *args, **kwargs):
+        # bulk delete by id (consumer_index.delete_exchange_ids)
+        ids = [int(i) for i in exchange_ids]
+        for start in range(0, len(ids), bulk_write.CHUNK):
+            for row in ExchangeDataset.select().where(ExchangeDataset.id.in_(ids[start:start + bulk_write.CHUNK])):
+                self._add(op='delete_exchange', id=row.id, exchange=_exchange_identity(row),
+                          output=(row.output_database, row.output_code), input=(row.input_database, row.input_code),
+                          amount=row.data.get('amount'))
+        return delete(exchange_ids, *args, **kwargs)
+
+    def _country_expansion(self, expand, name, *args, **kwargs):
+        # bulk write (see country_expansion.py). Its codes are derived from the sources, so replaying it gives the
+        # same activities
+        availability = expand(name, *args, **kwargs)
+        self._add(op='expand_countries', name=name, args=args, kwargs=copy.deepcopy(kwargs),
+                  activities=sorted(k for k in availability['activity'] if k is not None))
+        return availability
+
+    def _chain_collapse(self, collapse, chains, *args, **kwargs):
+        # bulk write (see chain_collapse.py). The codes of the copies are derived from the roots
+        collapsed = collapse(chains, *args, **kwargs)
+        self._add(op='collapse_chains', chains=copy.deepcopy(chains), args=args, kwargs=copy.deepcopy(kwargs),
+                  activities=sorted(collapsed.values()))
+        return collapsed
+
+    def _park_inventories_write(self, write, inventories, database, *args, **kwargs):
+        # bulk write (see WindTrace/park_inventory.py). The inventories are plain data, so they are written again as
+        # they are
+        written = write(inventories, database, *args, **kwargs)
+        self._add(op='write_park_inventories', name=database, inventories=copy.deepcopy(list(inventories)),
+                  written=written)
+        return written
+
+    # databases
+    def _database_copy(self, db_copy, db, name, *args, **kwargs):
+        self._add(op='copy_database', source=db.name, name=name)
+        return db_copy(db, name, *args, **kwargs)
+
+    def _fast_database_copy(self, db_copy, source, target, *args, **kwargs):
+        self._add(op='copy_database', source=source, name=target)
+        return db_copy(source, target, *args, **kwargs)
+
+    def _database_register(self, register, db, *args, **kwargs):
+        self._add(op='register_database', name=db.name, kwargs=copy.deepcopy(kwargs))
+        return register(db, *args, **kwargs)
+
+    def _database_write(self, write, db, *args, **kwargs):
+        self._add(op='write_database', name=db.name)
+        return write(db, *args, **kwargs)
+
+    def _database_delete(self, delete, db, *args, **kwargs):
+        self._add(op='delete_database', name=db.name)
+        return delete(db, *args, **kwargs)
+
+    def install(self):
+        self._patch(Activity, 'save', self._activity_save)
+        self._patch(Activity, 'copy', self._activity_copy)
+        self._patch(Activity, 'delete', self._activity_delete)
+        self._patch(Exchange, 'save', self._exchange_save)
+        self._patch(Exchange, 'delete', self._exchange_delete)
+        self._patch(Exchanges, 'delete', self._exchanges_delete)
+        self._patch(consumer_index, 'delete_exchange_ids', self._exchange_ids_delete)
+        self._patch(SQLiteBackend, 'copy', self._database_copy)
+        self._patch(database_copy, 'copy_database', self._fast_database_copy)
+        self._patch(country_expansion, 'expand_countries', self._country_expansion)
+        self._patch(chain_collapse, 'collapse_chains', self._chain_collapse)
+        self._patch(park_inventory, 'write_inventories', self._park_inventories_write)
+        self._patch(SQLiteBackend, 'register', self._database_register)
+        self._patch(SQLiteBackend, 'write', self._database_write)
+        self._patch(SQLiteBackend, 'delete', self._database_delete)
+        self._skip(SQLiteBackend, 'process', lambda db: f'Plan mode: skipping processing of {db.name}')
+        # they write the databases metadata file on every activity and exchange save. It is restored after the plan
+        self._skip(Databases, 'set_dirty')
+        self._skip(Databases, 'set_modified')
+        for name in ('add_dataset', 'add_datasets', 'update_dataset', 'delete_dataset', 'delete_database'):
+            self._skip(IndexManager, name)
+
+    def uninstall(self):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+
+def plan_stage(stage_name: str, function: Callable, **inputs) -> Changeset:
+    """
+    Runs ´´function´´(**inputs) (e.g., update_background, delete_infrastructure_main, avoid_double_accounting) in plan
+    mode: the selection logic of the stage runs as usual, but its writes to the lci database happen inside a single
+    transaction that is always rolled back, without the snapshot and restore of the databases, the metadata file
+    writes on every save, the processing and the search index updates of a real run. Returns the Changeset with the
+    intended creates, relinks, amount changes and deletes, in order. Example:
+    changes = plan_stage('avoid_double_accounting', avoid_double_accounting, electricity=True, ...)
+    print(changes.summary())
+    apply_changeset(changes)
+    Outside the lci database:
+    - the databases metadata (not marked as modified or dirty), the geomapping and the calculation setups are restored
+      afterwards.
+    - processing and the search index writes are skipped (so searches made by the stage do not find the activities
+      it writes, as in Database.search() on a database that is not searchable).
+    - the in-memory indexes (activity_index, consumer_index, tier_aggregation, WindTrace) are reset.
+    Not undone: the files written by the stage itself (e.g., exported spreadsheets and logs), and the empty search index
+    file of a database registered by the stage.
+    """
+    changeset = Changeset(stage_name, project_fingerprint())
+    # serialized dictionaries of the project written by bw2data next to the lci database
+    serialized = [(serialized_dict, copy.deepcopy(serialized_dict.data))
+                  for serialized_dict in (bd.databases, bd.geomapping, bd.calculation_setups)]
+    recorder = _Recorder(changeset)
+    print(f"Planning stage '{stage_name}'")
+    recorder.install()
+    try:
+        with sqlite3_lci_db.db.atomic() as transaction:
+            try:
+                function(**inputs)
+            finally:
+                transaction.rollback()
+    finally:
+        recorder.uninstall()
+        for serialized_dict, data in serialized:
+            serialized_dict.data = data
+            serialized_dict.flush()
+        # the in-memory indexes were updated with the planned activities
+        activity_index.invalidate()
+        consumer_index.invalidate()
+        tier_aggregation.invalidate()
+        WindTrace_onshore._BW_INDEXES.clear()
+    print(f"Stage '{stage_name}' would do {len(changeset)} operations:")
+    print(changeset.summary().to_string(index=False))
+    return changeset
+
+
+##### applying #####
+def _find_exchange(identity: tuple) -> Exchange:
+    # the exchange at ´´identity´´ (see _exchange_identity())
+    (output_database, output_code), (input_database, input_code), exchange_type, position = identity
+    row = ExchangeDataset.select().where(
+        (ExchangeDataset.output_database == output_database) & (ExchangeDataset.output_code == output_code) &
+        (ExchangeDataset.input_database == input_database) & (ExchangeDataset.input_code == input_code) &
+        (ExchangeDataset.type == exchange_type)).order_by(ExchangeDataset.id).offset(position).first()
+    if row is None:
+        raise ValueError(f'Exchange {identity} not found. The project changed since the plan was made.')
+    return Exchange(row)
+
+
+def _apply_operation(operation: Dict[str, Any]):
+    # activities are found by their key and exchanges by their identity, which the replay keeps (their ids change)
+    op = operation['op']
+    if op == 'create_activity':
+        act = Activity(**{k: v for k, v in copy.deepcopy(operation['data']).items() if k != 'id'})
+        act.save()
+    elif op == 'update_activity':
+        act = bd.get_activity(operation['key'])
+        act._data = dict(copy.deepcopy(operation['data']), id=act.id)
+        act.save()
+    elif op == 'copy_activity':
+        bd.get_activity(operation['source']).copy(code=operation['code'], **operation['kwargs'])
+    elif op == 'delete_activity':
+        bd.get_activity(operation['key']).delete()
+    elif op == 'create_exchange':
+        Exchange(**copy.deepcopy(operation['data'])).save()
+    elif op in ('relink_exchange', 'change_amount', 'update_exchange'):
+        ex = _find_exchange(operation['exchange'])
+        ex._data = copy.deepcopy(operation['data'])
+        ex.save()
+    elif op == 'delete_exchange':
+        _find_exchange(operation['exchange']).delete()
+    elif op == 'copy_database':
+        database_copy.copy_database(operation['source'], operation['name'])
+        return
+    elif op == 'register_database':
+        bd.Database(operation['name']).register(**operation['kwargs'])
+        return
+    elif op == 'expand_countries':
+        availability = country_expansion.expand_countries(operation['name'], *operation['args'], **operation['kwargs'])
+        if sorted(k for k in availability['activity'] if k is not None) != operation['activities']:
+            raise ValueError(f"Expansion of '{operation['name']}' found other activities than when the plan was made. "
+                             f"The project changed since the plan was made.")
+        return
+    elif op == 'collapse_chains':
+        collapsed = chain_collapse.collapse_chains(operation['chains'], *operation['args'], **operation['kwargs'])
+        if sorted(collapsed.values()) != operation['activities']:
+            raise ValueError('The chain collapse wrote other activities than when the plan was made. The project '
+                             'changed since the plan was made.')
+        return
+    elif op == 'write_park_inventories':
+        if park_inventory.write_inventories(operation['inventories'], operation['name']) != operation['written']:
+            raise ValueError('The wind park inventories wrote other activities than when the plan was made. The '
+                             'project changed since the plan was made.')
+        return
+    else:
+        raise ValueError(f"Operation '{op}' cannot be applied")
+
+
+def apply_changeset(changeset: Changeset, process: bool = False):
+    """
+    Applies the operations of ´´changeset´´ in order, in a single transaction (if one fails, none is applied).
+    The project must be in the same state as when the plan was made (same databases, not modified since).
+    """
+    not_replayable = sorted({o['op'] for o in changeset.operations if o['op'] not in REPLAYABLE_OPS})
+    if not_replayable:
+        raise ValueError(f'The changeset contains operations that cannot be applied: {not_replayable}. '
+                         f'Run the stage instead.')
+    if project_fingerprint() != changeset.fingerprint:
+        raise ValueError(f"The project changed since the plan of stage '{changeset.stage_name}' was made. "
+                         f"Make the plan again.")
+    print(f"Applying {len(changeset)} operations of stage '{changeset.stage_name}'")
+    with exchange_write_buffer(process=process):
+        for operation in changeset.operations:
+            _apply_operation(operation)
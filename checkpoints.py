@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import bw2data as bd
+from bw2data.backends import sqlite3_lci_db
+
+import activity_index
+import consumer_index
+import tier_aggregation
+from changesets import Changeset, apply_changeset, plan_stage
+from instrumentation import span
+
+CHECKPOINTS_FILE = 'stage_checkpoints.json'
+SNAPSHOTS_FOLDER = 'stage_snapshots'
+
+
+def file_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def inputs_hash(stage_name: str, inputs: Dict[str, Any], previous_hash: Optional[str] = None) -> str:
+    """
+    Hash of the stage name, its arguments, and the hash of the previous stage. Chaining the previous hash makes a
+    change in an earlier stage invalidate all the stages after it. Arguments that are paths to existing files (e.g.,
+    the mapping file) are hashed by content.
+    """
+    hashed_inputs = {k: {'path': v, 'content': file_hash(v)} if isinstance(v, str) and os.path.isfile(v) else v
+                     for k, v in inputs.items()}
+    payload = json.dumps({'stage': stage_name, 'inputs': hashed_inputs, 'previous': previous_hash},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+##### completion markers #####
+def _checkpoints_path() -> str:
+    return os.path.join(str(bd.projects.dir), CHECKPOINTS_FILE)
+
+
+def load_checkpoints() -> Dict[str, Dict[str, str]]:
+    path = _checkpoints_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(stage_name: str, stage_hash: str):
+    checkpoints = load_checkpoints()
+    checkpoints[stage_name] = {'hash': stage_hash, 'completed': datetime.now().isoformat()}
+    with open(_checkpoints_path(), 'w') as f:
+        json.dump(checkpoints, f, indent=2)
+
+
+def reset_checkpoints(stage_name: Optional[str] = None):
+    """
+    Deletes the completion marker of ´´stage_name´´ (or all of them if None). Only use it together with a fresh copy of
+    the databases, since the stages cannot safely run twice on the same databases.
+    """
+    if stage_name is None:
+        checkpoints = {}
+    else:
+        checkpoints = load_checkpoints()
+        checkpoints.pop(stage_name, None)
+    with open(_checkpoints_path(), 'w') as f:
+        json.dump(checkpoints, f, indent=2)
+
+
+##### snapshots #####
+# files and folders of the project (relative to its folder) with the state of its databases: the SQLite files with the
+# activities, exchanges and parameters, the serialized metadata (databases, geomapping, calculation setups), the
+# search indexes and the processed arrays
+SNAPSHOT_FILES = (os.path.join('lci', 'databases.db'), 'parameters.db', 'databases.json', 'geomapping.pickle',
+                  'setups.pickle')
+SNAPSHOT_FOLDERS = ('search', 'processed')
+
+
+def _snapshot_folder(stage_name: str) -> str:
+    return os.path.join(str(bd.projects.dir), SNAPSHOTS_FOLDER, stage_name)
+
+
+def _close_connections():
+    # the copies of the SQLite files are consistent only if no write is pending (write-ahead log written to the file)
+    sqlite3_lci_db.db.close()
+    bd.parameters.db.db.close()
+
+
+def take_snapshot(stage_name: str):
+    """
+    Copies the project files (SNAPSHOT_FILES and SNAPSHOT_FOLDERS) before running a stage. The SQLite connections are
+    closed first, so the copy is consistent.
+    """
+    folder = _snapshot_folder(stage_name)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    _close_connections()
+    project_dir = str(bd.projects.dir)
+    for file_name in SNAPSHOT_FILES:
+        if os.path.exists(os.path.join(project_dir, file_name)):
+            os.makedirs(os.path.dirname(os.path.join(folder, file_name)), exist_ok=True)
+            shutil.copy2(os.path.join(project_dir, file_name), os.path.join(folder, file_name))
+    for folder_name in SNAPSHOT_FOLDERS:
+        if os.path.isdir(os.path.join(project_dir, folder_name)):
+            shutil.copytree(os.path.join(project_dir, folder_name), os.path.join(folder, folder_name))
+
+
+def restore_snapshot(stage_name: str):
+    """
+    Puts back the project files copied by take_snapshot(). Files written by the stage outside the project folder
+    (e.g., exported spreadsheets) are not removed.
+    """
+    folder = _snapshot_folder(stage_name)
+    _close_connections()
+    project_dir = str(bd.projects.dir)
+    for file_name in SNAPSHOT_FILES:
+        path = os.path.join(project_dir, file_name)
+        if os.path.exists(os.path.join(folder, file_name)):
+            shutil.copy2(os.path.join(folder, file_name), path)
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    for folder_name in SNAPSHOT_FOLDERS:
+        if os.path.isdir(os.path.join(folder, folder_name)):
+            # files created by the stage (e.g., the search index of a new database) are removed too
+            shutil.rmtree(os.path.join(project_dir, folder_name), ignore_errors=True)
+            shutil.copytree(os.path.join(folder, folder_name), os.path.join(project_dir, folder_name))
+    for serialized_dict in (bd.databases, bd.geomapping, bd.calculation_setups):
+        serialized_dict.load()
+    activity_index.invalidate()
+    consumer_index.invalidate()
+    tier_aggregation.invalidate()
+
+
+def delete_snapshot(stage_name: str):
+    shutil.rmtree(_snapshot_folder(stage_name), ignore_errors=True)
+
+
+##### stages #####
+def apply_planned_stage(changeset: Changeset, process: bool = False):
+    """
+    Applies the changeset planned by a StageRunner in plan mode and records its stage as completed, so the next run()
+    continues after it.
+    """
+    apply_changeset(changeset, process=process)
+    if changeset.stage_hash is not None:
+        save_checkpoint(changeset.stage_name, changeset.stage_hash)
+
+
+class StageRunner:
+    """
+    Runs the stages of the pipeline in order, skipping those already completed with the same inputs.
+    runner = StageRunner()
+    runner.run('update_background', update_background, ccs_clinker=True, ...)
+    The inputs of each stage are its keyword arguments (except ´´rerunnable´´). A stage that fails is rolled back to
+    the snapshot taken right before it, so the pipeline can be run again and it resumes from that stage.
+    With ´´plan´´=True, the databases are not modified: the first stage not completed yet is planned (see
+    changesets.plan_stage, which lists what it does not undo) and its changeset is kept in ´´runner.changeset´´.
+    apply_planned_stage() applies it and marks the stage completed.
+    """
+
+    def __init__(self, snapshots: bool = True, plan: bool = False):
+        self.snapshots = snapshots
+        self.plan = plan
+        self.changeset: Optional[Changeset] = None
+        self.previous_hash: Optional[str] = None
+
+    def run(self, stage_name: str, function: Callable, rerunnable: bool = False, **inputs):
+        """
+        Runs ´´function´´(**inputs) as the stage ´´stage_name´´, unless it was already completed with the same inputs.
+        A ´´rerunnable´´ stage (one that rewrites what it wrote before, e.g., the fleets) completed with other inputs is
+        run again, if no later stage was completed after it. Any other stage completed with other inputs raises.
+        """
+        stage_hash = inputs_hash(stage_name, inputs, self.previous_hash)
+        checkpoints = load_checkpoints()
+        checkpoint = checkpoints.get(stage_name)
+        if checkpoint is not None and checkpoint['hash'] == stage_hash:
+            print(f"Stage '{stage_name}' already completed on {checkpoint['completed']}. Skipping.")
+            self.previous_hash = stage_hash
+            return None
+        if checkpoint is not None:
+            later = [name for name, c in checkpoints.items() if c['completed'] > checkpoint['completed']]
+            if not rerunnable or later:
+                raise ValueError(f"Stage '{stage_name}' was already completed in project '{bd.projects.current}' "
+                                 f"with different inputs (or after different previous stages). It cannot safely run "
+                                 f"twice on the same databases"
+                                 + (f" (stages completed after it: {later})" if rerunnable else '') +
+                                 ". Use a fresh project, or restore the databases and call reset_checkpoints().")
+            print(f"Stage '{stage_name}' was completed with other inputs. Running it again.")
+
+        if self.plan:
+            # only the first pending stage can be planned: the next ones depend on its writes
+            if self.changeset is None:
+                with span(stage_name, plan=True):
+                    self.changeset = plan_stage(stage_name, function, **inputs)
+                self.changeset.stage_hash = stage_hash
+            else:
+                print(f"Plan mode: stage '{stage_name}' not planned (it runs after '{self.changeset.stage_name}')")
+            self.previous_hash = stage_hash
+            return None
+
+        print(f"Starting stage '{stage_name}'")
+        if self.snapshots:
+            take_snapshot(stage_name)
+        try:
+            with span(stage_name):
+                result = function(**inputs)
+        except BaseException:
+            if self.snapshots:
+                print(f"Stage '{stage_name}' failed. Restoring the databases to their state before the stage.")
+                restore_snapshot(stage_name)
+                delete_snapshot(stage_name)
+            raise
+        save_checkpoint(stage_name, stage_hash)
+        if self.snapshots:
+            delete_snapshot(stage_name)
+        self.previous_hash = stage_hash
+        return result
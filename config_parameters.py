@@ -13,6 +13,62 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 windtrace_folder = os.path.join(script_dir, "WindTrace")
 VESTAS_FILE = os.path.join(windtrace_folder, 'clean_data.xlsx')
 
+# folder with the strategy-applied ecoinvent imports, reused by new projects (see import_cache.py)
+ECOINVENT_CACHE_FOLDER = os.path.join(script_dir, 'data', 'ecoinvent_cache')
+# folder with the generated premise databases, reused by new projects (see premise_cache.py)
+PREMISE_CACHE_FOLDER = os.path.join(script_dir, 'data', 'premise_cache')
+
+# chains of activities collapsed (de-nested) into their root activity, in 'additional_acts' (see chain_collapse.py):
+# - 'name', 'database': the root activity. Roots outside 'additional_acts' are copied into it.
+# - 'inputs': names of the chain members, explored down to 'tier_limit' tiers. The input of the root named as the
+#   first member is replaced by the aggregated technosphere of the chain.
+# - 'biosphere_inputs': members whose biosphere (down to 'biosphere_tier_limit' tiers) replaces the biosphere of the
+#   root. None keeps the biosphere of the root.
+METHANOL_CHAINS = [
+    {'name': 'methanol distillation, from wood, without CCS', 'database': 'additional_acts',
+     'inputs': ['methanol synthesis, from wood, without CCS'], 'tier_limit': 1},
+    {'name': 'methanol distillation, hydrogen from electrolysis, CO2 from DAC', 'database': 'premise_base',
+     'inputs': ['methanol synthesis, hydrogen from electrolysis, CO2 from DAC'], 'tier_limit': 1},
+]
+FT_FUEL_CHAINS = [
+    {'name': 'diesel production, synthetic, from Fischer Tropsch process, hydrogen from wood gasification, '
+             'energy allocation, at fuelling station', 'database': 'premise_base',
+     'inputs': ['diesel production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
+                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
+                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'],
+     'tier_limit': 3,
+     'biosphere_inputs': ['diesel production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
+                          'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
+                          'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'],
+     'biosphere_tier_limit': 3},
+    {'name': 'diesel production, synthetic, from Fischer Tropsch process, hydrogen from electrolysis, '
+             'energy allocation, at fuelling station', 'database': 'premise_base',
+     'inputs': ['diesel production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation',
+                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from electrolysis',
+                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from electrolysis'],
+     'tier_limit': 3,
+     'biosphere_inputs': ['diesel production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation'],
+     'biosphere_tier_limit': 1},
+    {'name': 'kerosene production, synthetic, from Fischer Tropsch process, hydrogen from wood gasification, '
+             'energy allocation, at fuelling station', 'database': 'premise_base',
+     'inputs': ['kerosene production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
+                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
+                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'],
+     'tier_limit': 3,
+     'biosphere_inputs': ['kerosene production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
+                          'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
+                          'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'],
+     'biosphere_tier_limit': 3},
+    {'name': 'kerosene production, synthetic, from Fischer Tropsch process, hydrogen from electrolysis, '
+             'energy allocation, at fuelling station', 'database': 'premise_base',
+     'inputs': ['kerosene production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation',
+                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from electrolysis',
+                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from electrolysis'],
+     'tier_limit': 3,
+     'biosphere_inputs': ['kerosene production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation'],
+     'biosphere_tier_limit': 1},
+]
+
 ###### ----- SCENARIOS CONFIG ----- ######
 
 # battery predefined scenarios
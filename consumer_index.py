@@ -0,0 +1,298 @@
+import functools
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bw2data as bd
+from bw2data.backends import Activity, ActivityDataset, Exchange, ExchangeDataset, SQLiteBackend, sqlite3_lci_db
+from bw2data.backends.proxies import Exchanges
+
+import bulk_write
+
+Key = Tuple[str, str]
+
+
+class ConsumerIndex:
+    """
+    Reverse-dependency index of the activities of a database: for each activity (input), the technosphere exchanges
+    that consume it, from any database, as {exchange id: (output key, amount)}. It answers act.upstream() without
+    querying the exchanges table. Built with a single query.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.consumers: Dict[str, Dict[int, Tuple[Key, float]]] = defaultdict(dict)
+        self.input_of: Dict[int, str] = {}
+        query = ExchangeDataset.select(ExchangeDataset.id, ExchangeDataset.input_code, ExchangeDataset.output_database,
+                                       ExchangeDataset.output_code, ExchangeDataset.data).where(
+            (ExchangeDataset.input_database == db_name) & (ExchangeDataset.type == 'technosphere'))
+        for ex_id, input_code, output_database, output_code, data in query.tuples():
+            self.add(ex_id, input_code, (output_database, output_code), data.get('amount'))
+
+    def add(self, ex_id: int, input_code: str, output: Key, amount: float):
+        self.remove(ex_id)
+        self.consumers[input_code][ex_id] = (tuple(output), amount)
+        self.input_of[ex_id] = input_code
+
+    def remove(self, ex_id: int):
+        input_code = self.input_of.pop(ex_id, None)
+        if input_code is not None:
+            del self.consumers[input_code][ex_id]
+
+    def consumers_of(self, code: str) -> List[Tuple[Key, int, float]]:
+        """
+        (output key, exchange id, amount) of the exchanges consuming the activity with ´´code´´, by exchange id.
+        """
+        return [(output, ex_id, amount) for ex_id, (output, amount) in sorted(self.consumers.get(code, {}).items())]
+
+
+##### registry #####
+# one index per (project, input database). Built on first use.
+_INDEXES: Dict[Tuple[str, str], ConsumerIndex] = {}
+
+
+def get_index(db_name: str) -> ConsumerIndex:
+    key = (bd.projects.current, db_name)
+    if key not in _INDEXES:
+        _INDEXES[key] = ConsumerIndex(db_name)
+    return _INDEXES[key]
+
+
+def invalidate(db_name: Optional[str] = None):
+    """
+    Drops the index of ´´db_name´´ (or all of them if None), so it is rebuilt in the next search.
+    """
+    if db_name is None:
+        _INDEXES.clear()
+        return
+    for key in [k for k in _INDEXES if k[1] == db_name]:
+        del _INDEXES[key]
+
+
+def consumers(act: Activity) -> List[Tuple[Key, int, float]]:
+    return get_index(act['database']).consumers_of(act['code'])
+
+
+##### upstream #####
+class IndexedExchange(Exchange):
+    """
+    Exchange whose output activity was loaded in bulk by upstream_of(), so reading ´´ex.output´´ does not query the
+    database again.
+    """
+    _output_activity: Optional[Activity] = None
+
+    @property
+    def output(self):
+        if self._output_activity is None or self._output_activity.key != tuple(self['output']):
+            self._output_activity = bd.get_activity(tuple(self['output']))
+        return self._output_activity
+
+    @output.setter
+    def output(self, value):
+        Exchange.output.fset(self, value)
+        self._output_activity = None
+
+
+def _load_activities(keys: Iterable[Key]) -> Dict[Key, Activity]:
+    codes_per_database = defaultdict(set)
+    for database, code in keys:
+        codes_per_database[database].add(code)
+    activities = {}
+    for database, codes in codes_per_database.items():
+        codes = list(codes)
+        for start in range(0, len(codes), bulk_write.CHUNK):
+            chunk = codes[start:start + bulk_write.CHUNK]
+            for document in ActivityDataset.select().where((ActivityDataset.database == database) &
+                                                           (ActivityDataset.code.in_(chunk))):
+                activities[(document.database, document.code)] = Activity(document)
+    return activities
+
+
+def upstream_of(acts: Iterable[Activity]) -> List[IndexedExchange]:
+    """
+    Technosphere exchanges consuming any of ´´acts´´ (same as act.upstream() for each act), resolved in one pass: the
+    exchanges and their output activities are loaded with one query per chunk of ids, instead of one query per
+    activity (and per exchange output).
+    """
+    ex_ids = []
+    for act in acts:
+        ex_ids += [ex_id for _, ex_id, _ in consumers(act)]
+    exchanges = {}
+    for start in range(0, len(ex_ids), bulk_write.CHUNK):
+        for document in ExchangeDataset.select().where(ExchangeDataset.id.in_(ex_ids[start:start + bulk_write.CHUNK])):
+            exchanges[document.id] = IndexedExchange(document)
+    outputs = _load_activities({tuple(ex['output']) for ex in exchanges.values()})
+    result = []
+    for ex_id in ex_ids:
+        ex = exchanges[ex_id]
+        ex._output_activity = outputs.get(tuple(ex['output']))
+        result.append(ex)
+    return result
+
+
+def upstream(act: Activity) -> List[IndexedExchange]:
+    return upstream_of([act])
+
+
+def delete_exchange_ids(exchange_ids: Iterable[int]) -> List[Key]:
+    """
+    Deletes the exchanges in a single transaction (one statement per chunk of ids) and keeps the indexes up to date.
+    Returns the output (consumer) key of each deleted exchange.
+    """
+    ids = [int(i) for i in exchange_ids]
+    outputs = []
+    with sqlite3_lci_db.db.atomic():
+        for start in range(0, len(ids), bulk_write.CHUNK):
+            chunk = ids[start:start + bulk_write.CHUNK]
+            outputs.extend(ExchangeDataset.select(ExchangeDataset.output_database, ExchangeDataset.output_code).where(
+                ExchangeDataset.id.in_(chunk)).tuples())
+            ExchangeDataset.delete().where(ExchangeDataset.id.in_(chunk)).execute()
+    for ex_id in ids:
+        _on_exchange_deleted(ex_id)
+    for name in sorted({database for database, _ in outputs}):
+        if name in bd.databases:
+            bd.databases.set_dirty(name)
+    return outputs
+
+
+def delete_exchanges(exchanges: Iterable[Exchange]) -> List[Key]:
+    return delete_exchange_ids([ex._document.id for ex in exchanges])
+
+
+def delete_upstream(acts: Iterable[Activity]) -> List[Key]:
+    """
+    Deletes all the technosphere exchanges consuming any of ´´acts´´ (act.upstream().delete() for each act) at once.
+    """
+    return delete_exchange_ids([ex_id for act in acts for _, ex_id, _ in consumers(act)])
+
+
+##### keep the indexes up to date with the writes of the pipeline #####
+def _loaded_indexes() -> List[ConsumerIndex]:
+    return [index for (project, _), index in _INDEXES.items() if project == bd.projects.current]
+
+
+def _on_exchange_saved(ex: Exchange):
+    ex_id = ex._document.id
+    for index in _loaded_indexes():
+        index.remove(ex_id)
+    if ex.get('type') != 'technosphere':
+        return
+    input_database, input_code = ex['input']
+    for index in _loaded_indexes():
+        if index.db_name == input_database:
+            index.add(ex_id, input_code, ex['output'], ex.get('amount'))
+
+
+def add_exchange_rows(rows: Iterable[dict]):
+    """
+    Adds exchanges inserted in bulk (rows of the exchanges table, with their ids) to the loaded indexes.
+    """
+    indexes = {index.db_name: index for index in _loaded_indexes()}
+    if not indexes:
+        return
+    for row in rows:
+        if row['type'] == 'technosphere' and row['input_database'] in indexes:
+            indexes[row['input_database']].add(row['id'], row['input_code'],
+                                               (row['output_database'], row['output_code']), row['data'].get('amount'))
+
+
+def _on_exchange_deleted(ex_id: int):
+    for index in _loaded_indexes():
+        index.remove(ex_id)
+
+
+def _on_activity_copied(new_act: Activity):
+    # Activity.copy() writes the exchanges of the copy directly in the exchanges table
+    for ex in new_act.technosphere():
+        _on_exchange_saved(ex)
+
+
+def _wrap_exchange_save(save):
+    @functools.wraps(save)
+    def wrapper(self, *args, **kwargs):
+        result = save(self, *args, **kwargs)
+        _on_exchange_saved(self)
+        return result
+    wrapper._consumer_index_hook = True
+    return wrapper
+
+
+def _wrap_exchange_delete(delete):
+    @functools.wraps(delete)
+    def wrapper(self, *args, **kwargs):
+        ex_id = self._document.id
+        result = delete(self, *args, **kwargs)
+        _on_exchange_deleted(ex_id)
+        return result
+    wrapper._consumer_index_hook = True
+    return wrapper
+
+
+def _wrap_exchanges_delete(delete):
+    @functools.wraps(delete)
+    def wrapper(self, *args, **kwargs):
+        ex_ids = [ex._document.id for ex in self] if _loaded_indexes() else []
+        result = delete(self, *args, **kwargs)
+        for ex_id in ex_ids:
+            _on_exchange_deleted(ex_id)
+        return result
+    wrapper._consumer_index_hook = True
+    return wrapper
+
+
+def _wrap_activity_copy(act_copy):
+    @functools.wraps(act_copy)
+    def wrapper(self, *args, **kwargs):
+        new_act = act_copy(self, *args, **kwargs)
+        if _loaded_indexes():
+            _on_activity_copied(new_act)
+        return new_act
+    wrapper._consumer_index_hook = True
+    return wrapper
+
+
+def _wrap_activity_delete(delete):
+    # Activity.delete() deletes the exchanges of the activity and its consumers with Exchanges.delete(), whose hook
+    # removes them from the loaded indexes: only the entry of the deleted code is left
+    @functools.wraps(delete)
+    def wrapper(self, *args, **kwargs):
+        database, code = self.key
+        try:
+            result = delete(self, *args, **kwargs)
+        except BaseException:
+            invalidate(database)
+            raise
+        for index in _loaded_indexes():
+            if index.db_name == database:
+                index.consumers.pop(code, None)
+        return result
+    wrapper._consumer_index_hook = True
+    return wrapper
+
+
+def _wrap_invalidating(method):
+    # writes that change many exchanges at once (database deletions and writes)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            invalidate()
+    wrapper._consumer_index_hook = True
+    return wrapper
+
+
+def install_write_hooks():
+    """
+    Exchange saves and deletions (single and bulk) and activity copies and deletions update the loaded indexes in
+    place. Whole-database writes and deletions drop all the indexes.
+    """
+    for owner, name, wrap in [(Exchange, 'save', _wrap_exchange_save), (Exchange, 'delete', _wrap_exchange_delete),
+                              (Exchanges, 'delete', _wrap_exchanges_delete), (Activity, 'copy', _wrap_activity_copy),
+                              (Activity, 'delete', _wrap_activity_delete), (SQLiteBackend, 'write', _wrap_invalidating),
+                              (SQLiteBackend, 'delete', _wrap_invalidating)]:
+        method = getattr(owner, name)
+        if not getattr(method, '_consumer_index_hook', False):
+            setattr(owner, name, wrap(method))
+
+
+install_write_hooks()
@@ -0,0 +1,172 @@
+import copy
+import hashlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from bw2data.backends import Activity, ActivityDataset
+
+import activity_index as ix
+import bulk_write
+import consts
+
+Key = Tuple[str, str]
+
+AVAILABILITY_COLUMNS = ['status', 'source', 'activity', 'matches']
+
+
+def copy_code(source: Key, target: str, suffix: str = '') -> str:
+    """
+    Code of the copy of ´´source´´ in ´´target´´ (with ´´suffix´´ added to its name). It is derived from the source, so
+    expanding the same activity twice finds the copies already made instead of duplicating them.
+    """
+    return hashlib.md5(f'{source[0]}|{source[1]}|{target}|{suffix}'.encode('utf-8')).hexdigest()
+
+
+def country_variants(name: str, reference_product: Optional[str], countries: Sequence[str], databases: Sequence[str],
+                     excluded_name: Optional[str] = 'renewable energy products') -> Dict[str, Dict[str, List[Key]]]:
+    """
+    Activities whose name contains ´´name´´ (and not ´´excluded_name´´) and whose reference product contains
+    ´´reference_product´´, located in any of ´´countries´´, as {country: {database: [keys]}}. One indexed search per
+    database for all the countries.
+    """
+    filters = [ix.contains('name', name), ix.is_in('location', countries)]
+    if excluded_name:
+        filters.append(ix.exclude(ix.contains('name', excluded_name)))
+    if reference_product:
+        filters.append(ix.contains('reference product', reference_product))
+    variants = defaultdict(lambda: defaultdict(list))
+    for db_name in databases:
+        for act in ix.get_many(db_name, *filters):
+            variants[act['location']][db_name].append(act.key)
+    return variants
+
+
+def _activities(keys: Iterable[Key]) -> Dict[Key, Activity]:
+    # activities of ´´keys´´, with one query per database and chunk of codes
+    codes = defaultdict(set)
+    for database, code in keys:
+        codes[database].add(code)
+    activities = {}
+    for database, database_codes in codes.items():
+        database_codes = sorted(database_codes)
+        for start in range(0, len(database_codes), bulk_write.CHUNK):
+            for document in ActivityDataset.select().where(
+                    (ActivityDataset.database == database) &
+                    (ActivityDataset.code.in_(database_codes[start:start + bulk_write.CHUNK]))):
+                activities[(database, document.code)] = Activity(document)
+    return activities
+
+
+def _input_units(exchanges: Iterable[dict]) -> Dict[Key, Optional[str]]:
+    # unit of the input activity of each technosphere exchange, with one query per database and chunk of codes
+    codes = defaultdict(set)
+    for row in exchanges:
+        if row['type'] == 'technosphere':
+            codes[row['input_database']].add(row['input_code'])
+    units = {}
+    for database, database_codes in codes.items():
+        database_codes = list(database_codes)
+        for start in range(0, len(database_codes), bulk_write.CHUNK):
+            for code, data in ActivityDataset.select(ActivityDataset.code, ActivityDataset.data).where(
+                    (ActivityDataset.database == database) &
+                    (ActivityDataset.code.in_(database_codes[start:start + bulk_write.CHUNK]))).tuples():
+                units[(database, code)] = data.get('unit')
+    return units
+
+
+def _activity_row(act: Activity, target: str, code: str, name: str) -> dict:
+    return bulk_write.activity_row(dict(copy.deepcopy(act._data), database=target, code=code, name=name))
+
+
+def expand_countries(name: str, reference_product: Optional[str], countries: Optional[Sequence[str]] = None,
+                     databases: Sequence[str] = ('additional_acts', 'premise_base'), target: str = 'additional_acts',
+                     strip_infrastructure: bool = True, split_spheres: bool = True,
+                     excluded_name: Optional[str] = 'renewable energy products') -> pd.DataFrame:
+    """
+    Expands a mapping row located in 'country' to all its country variants at once:
+    1. finds the variant of each country (country_variants()). As in a get_one() search for each database in order,
+    a country takes the only match of the first database with exactly one match.
+    2. variants outside ´´target´´ are copied into it.
+    3. if ´´strip_infrastructure´´, the technosphere inputs measured in units (infrastructure) are removed.
+    4. if ´´split_spheres´´, two copies are made: '<name>, biosphere' without technosphere exchanges and
+    '<name>, technosphere' without biosphere exchanges (as om_biosphere() and om_technosphere()).
+    All the rows are read with one query per table and written in a single transaction.
+    Returns the availability of the activity per country (index): 'status' ('expanded', 'already expanded', 'missing'
+    or 'ambiguous'), 'source' database, 'activity' key in ´´target´´, and 'matches' per database.
+    """
+    countries = list(consts.LOCATION_EQUIVALENCE.values()) if countries is None else list(countries)
+    variants = country_variants(name, reference_product, countries, databases, excluded_name)
+    availability = pd.DataFrame(index=pd.Index(countries, name='country'), columns=AVAILABILITY_COLUMNS, dtype=object)
+    selected: Dict[str, Key] = {}
+    for country in countries:
+        found = variants.get(country, {})
+        matches = {db: len(found.get(db, [])) for db in databases}
+        unique = next((db for db in databases if matches[db] == 1), None)
+        if unique is not None:
+            selected[country] = found[unique][0]
+            status, source = 'expanded', unique
+        else:
+            status, source = ('ambiguous' if any(n > 1 for n in matches.values()) else 'missing'), None
+        availability.loc[country] = [status, source, None, matches]
+
+    # the same activity can be the variant of several countries (e.g., a RER activity in a country list)
+    selected_keys = set(selected.values())
+    documents = _activities(selected_keys)
+    sources = {key: documents[key] for key in sorted(selected_keys)}
+    suffixes = [', biosphere', ', technosphere'] if split_spheres else []
+    existing = bulk_write.existing_codes(target, [copy_code(key, target, suffix) for key in sources
+                                                  for suffix in [''] + suffixes])
+    exchanges = bulk_write.exchange_rows(sources)
+    units = _input_units(row for rows in exchanges.values() for row in rows) if strip_infrastructure else {}
+
+    new_activities, new_exchanges, stripped_ids, base_keys, done = [], [], [], {}, set()
+    for key, act in sources.items():
+        if key[0] == target:
+            base_key = key
+        else:
+            base_key = (target, copy_code(key, target))
+        base_keys[key] = base_key
+        base_done = key[0] == target or base_key[1] in existing
+        if base_done and all(copy_code(key, target, s) in existing for s in suffixes) and (suffixes or
+                                                                                           key[0] != target):
+            done.add(key)
+            continue
+        rows = exchanges.get(key, [])
+        if strip_infrastructure:
+            infrastructure = {row['id'] for row in rows if row['type'] == 'technosphere' and
+                              units.get((row['input_database'], row['input_code'])) == 'unit'}
+            rows = [row for row in rows if row['id'] not in infrastructure]
+            if key[0] == target:
+                stripped_ids += sorted(infrastructure)
+        if key[0] != target and base_key[1] not in existing:
+            new_activities.append(_activity_row(act, target, base_key[1], act['name']))
+            new_exchanges += [bulk_write.copied_exchange_row(row, key, base_key) for row in rows]
+        for suffix, removed_type in zip(suffixes, ['technosphere', 'biosphere']):
+            sphere_key = (target, copy_code(key, target, suffix))
+            if sphere_key[1] in existing:
+                continue
+            new_activities.append(_activity_row(act, target, sphere_key[1], f"{act['name']}{suffix}"))
+            new_exchanges += [bulk_write.copied_exchange_row(row, key, sphere_key) for row in rows
+                              if row['type'] != removed_type]
+
+    if new_activities or stripped_ids:
+        bulk_write.write_rows(target, new_activities, new_exchanges, deleted_exchanges=stripped_ids)
+
+    for country, key in selected.items():
+        availability.at[country, 'activity'] = base_keys[key]
+        if key in done:
+            availability.at[country, 'status'] = 'already expanded'
+    print(f"'{name}' ({reference_product}): {len(selected)} of {len(countries)} countries expanded, "
+          f"{len(new_activities)} activities and {len(new_exchanges)} exchanges written")
+    return availability
+
+
+def availability_matrix(availabilities: Dict[str, pd.DataFrame], column: str = 'status') -> pd.DataFrame:
+    """
+    Matrix with one row per expanded mapping row (keys of ´´availabilities´´) and one column per country, with the
+    ´´column´´ of each availability table returned by expand_countries().
+    """
+    if not availabilities:
+        return pd.DataFrame()
+    return pd.DataFrame({label: table[column] for label, table in availabilities.items()}).T
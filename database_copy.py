@@ -0,0 +1,36 @@
+import copy
+
+import bw2data as bd
+from bw2data.backends import ActivityDataset, ExchangeDataset
+
+import activity_index
+import bulk_write
+
+
+def copy_database(source: str, target: str):
+    """
+    Same result as bd.Database(source).copy(target), but the rows are copied straight from the activities and
+    exchanges tables in one transaction: no loading of the whole database in a dictionary, no deep copy and no
+    validation of the data before writing it (it is already a valid database).
+    As in Database.copy(), the inputs from ´´source´´ are relinked to ´´target´´, and the inputs from other databases
+    are kept. The rows get new ids and are registered as Activity.save() does (geomapping and, if ´´source´´ is
+    searchable, search index; see bulk_write.registered()), and the copy is marked as dirty, so it is processed before
+    the next LCA.
+    """
+    if target in bd.databases:
+        raise ValueError(f'Database {target} already exists')
+    print(f"Copying database '{source}' into '{target}'")
+    metadata = copy.copy(bd.databases[source])
+    for k in ['modified', 'processed', 'number', 'dirty']:
+        metadata.pop(k, None)
+    metadata['format'] = f"Copied from '{source}'"
+    bd.Database(target).register(**metadata)
+    activity_index.invalidate(target)
+
+    activities = (bulk_write.relabelled_activity_row(row, target)
+                  for row in ActivityDataset.select().where(ActivityDataset.database == source).dicts())
+    exchanges = (bulk_write.relabelled_exchange_row(row, source, target)
+                 for row in ExchangeDataset.select().where(ExchangeDataset.output_database == source).dicts())
+    n_activities, n_exchanges = bulk_write.write_rows(target, activities, exchanges)
+    print(f"Copied {n_activities} activities and {n_exchanges} exchanges into '{target}'")
+
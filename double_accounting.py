@@ -0,0 +1,276 @@
+from typing import Dict, List, Optional, Tuple
+
+import bw2data as bd
+import numpy as np
+import pandas as pd
+from bw2data.backends import ActivityDataset, ExchangeDataset
+
+import activity_index as ix
+import consts
+import consumer_index
+import fleet_members
+
+# Databases where the double accounting protocol is applied (same order as in main.avoid_double_accounting)
+DOUBLE_ACCOUNTING_DATABASES = ['premise_base', 'additional_acts',
+                               'premise_auxiliary_for_infrastructure',
+                               'infrastructure (with European steel and concrete)']
+# Outputs (reference product) for which biomass, methane, kerosene and diesel are used as fuel or feedstock
+FUEL_OUTPUTS = ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,']
+# activity_index filter field -> column in the activities table
+_COLUMNS = {'name': 'name', 'location': 'location', 'reference product': 'product'}
+
+
+class CutRule:
+    """
+    One step of the unlink_* functions of functions.py, expressed over the whole exchanges table:
+        - side='upstream': cut the technosphere exchanges whose input is a target activity (act.upstream()).
+        - side='inventory': cut the exchanges of ´´kinds´´ whose output is a target activity (act.technosphere(),
+          act.biosphere()).
+    Target activities: activities of the database matching all the activity_index ´´filters´´. With
+    ´´with_inputs´´=True, also the technosphere inputs of those activities (market groups -> local markets).
+    ´´output_contains_any´´ / ´´output_not_containing´´ (upstream) and ´´input_contains´´ (inventory) restrict the
+    cut to the exchanges whose other side has a reference product containing the given strings.
+    ´´required´´=True mirrors ix.get_one(): if no activity matches, the rest of the carrier is skipped for the
+    database, as it happens when get_one() raises NoResults in the unlink_* functions.
+    """
+
+    def __init__(self, filters: Tuple[ix.Filter, ...], side: str = 'upstream', required: bool = False,
+                 with_inputs: bool = False, output_contains_any: Optional[List[str]] = None,
+                 output_not_containing: Optional[str] = None, input_contains: Optional[str] = None,
+                 kinds: Tuple[str, ...] = ('technosphere',)):
+        self.filters = filters
+        self.side = side
+        self.required = required
+        self.with_inputs = with_inputs
+        self.output_contains_any = output_contains_any
+        self.output_not_containing = output_not_containing
+        self.input_contains = input_contains
+        self.kinds = kinds
+
+
+def carrier_rules(carrier: str, avoid_countries_list: Optional[List[str]] = None) -> List[CutRule]:
+    """
+    Cut rules of each energy carrier, equivalent to unlink_<carrier>() in functions.py.
+    """
+    if carrier == 'electricity':
+        if avoid_countries_list is None:
+            return [CutRule((ix.contains('name', 'market group for electricity'), ix.equals('location', location)),
+                            with_inputs=True)
+                    for location in ['ENSTO-E', 'UCTE', 'Europe without Switzerland', 'RER']]
+        rules = []
+        for country in avoid_countries_list:
+            for voltage in ['high', 'low', 'medium']:
+                rules.append(CutRule((ix.equals('name', f'market for electricity, {voltage} voltage'),
+                                      ix.equals('location', country),
+                                      ix.equals('reference product', f'electricity, {voltage} voltage')),
+                                     side='inventory', required=True, kinds=('technosphere', 'biosphere')))
+        return rules
+    if carrier == 'heat':
+        rules = [CutRule((ix.contains('name', 'market group for heat'), ix.equals('location', 'RER')),
+                         with_inputs=True)]
+        for location in ['RER', 'Europe without Switzerland', 'CH']:
+            rules.append(CutRule((ix.contains('name', 'heat production,'), ix.equals('location', location),
+                                  ix.exclude(ix.contains('name', 'wheat')))))
+            rules.append(CutRule((ix.contains('name', 'market for heat,'), ix.equals('location', location))))
+        # steam (remove heat inputs to leave only water and direct emissions)
+        rules.append(CutRule((ix.equals('name', 'steam production, as energy carrier, in chemical industry'),
+                              ix.equals('location', 'RER')),
+                             side='inventory', required=True, input_contains='heat'))
+        return rules
+    if carrier == 'co2':
+        return [CutRule((ix.equals('reference product', 'carbon dioxide, captured from atmosphere'),
+                         ix.equals('location', 'RER')))]
+    if carrier == 'hydrogen':
+        return [CutRule((ix.contains('name', 'hydrogen production, gaseous'), ix.contains('name', source)))
+                for source in ['electrolysis', 'woody biomass']]
+    if carrier == 'biomass':
+        rules = [CutRule((ix.equals('name', 'market for wood pellet, measured as dry mass'),
+                          ix.equals('location', 'RER')), required=True, output_contains_any=FUEL_OUTPUTS),
+                 CutRule((ix.equals('name', 'market for biomass, used as fuel'), ix.equals('location', 'RER')),
+                         required=True)]
+        for location in ['Europe without Switzerland', 'CH', 'RER']:
+            rules.append(CutRule((ix.contains('name', 'market for wood chips,'), ix.equals('location', location)),
+                                 output_contains_any=FUEL_OUTPUTS))
+            if location != 'RER':
+                rules.append(CutRule((ix.contains('name', 'market for bark chips,'),
+                                      ix.equals('location', location)),
+                                     required=True, output_contains_any=FUEL_OUTPUTS))
+        return rules
+    if carrier == 'methane':
+        outputs = [o for o in FUEL_OUTPUTS if o != 'methane,']
+        rules = [CutRule((ix.startswith('reference product', 'biomethane'),
+                          ix.exclude(ix.contains('reference product', 'mixed')), ix.equals('location', location)),
+                         output_contains_any=outputs)
+                 for location in ['CH', 'RER']]
+        rules.append(CutRule((ix.startswith('reference product', 'methane,'),), output_contains_any=outputs))
+        european_locations = list(consts.LOCATION_EQUIVALENCE.values()) + ['RER', 'RoE', 'Europe without Switzerland']
+        rules += [CutRule((ix.startswith('reference product', 'natural gas,'),
+                           ix.contains('reference product', 'pressure'), ix.equals('location', location)),
+                          output_contains_any=outputs)
+                  for location in european_locations]
+        return rules
+    if carrier == 'methanol':
+        return [CutRule((ix.startswith('reference product', 'methanol,'), ix.equals('location', location)),
+                        output_not_containing='methanol')
+                for location in ['CH', 'RER']]
+    if carrier in ['kerosene', 'diesel']:
+        outputs = [o for o in FUEL_OUTPUTS if o != f'{carrier},']
+        return [CutRule((ix.startswith('reference product', carrier), ix.equals('location', location)),
+                        output_contains_any=outputs)
+                for location in ['RER', 'Europe without Switzerland', 'CH']]
+    raise ValueError(f'Unknown energy carrier: {carrier}')
+
+
+##### matrix #####
+def load_activities() -> pd.DataFrame:
+    """
+    Name, location, reference product, database and code of all the activities of the project (one row per activity,
+    the row number is the activity index in the exchange arrays).
+    """
+    rows = ActivityDataset.select(ActivityDataset.database, ActivityDataset.code, ActivityDataset.name,
+                                  ActivityDataset.location, ActivityDataset.product).tuples()
+    acts = pd.DataFrame(list(rows), columns=['database', 'code', 'name', 'location', 'product'])
+    for column in ['name', 'location', 'product']:
+        acts[column] = acts[column].fillna('')
+    return acts
+
+
+def load_exchanges(acts: pd.DataFrame, kinds: Tuple[str, ...] = ('technosphere',)) -> Dict[str, np.ndarray]:
+    """
+    Exchanges of ´´kinds´´ of all the databases of the project as sparse (coordinate) arrays: exchange id, type, input
+    activity index (row) and output activity index (column). Inputs that are not activities (e.g., biosphere flows)
+    have index -1.
+    """
+    rows = ExchangeDataset.select(ExchangeDataset.id, ExchangeDataset.type,
+                                  ExchangeDataset.input_database, ExchangeDataset.input_code,
+                                  ExchangeDataset.output_database, ExchangeDataset.output_code
+                                  ).where(ExchangeDataset.type.in_(list(kinds))).tuples()
+    exchanges = pd.DataFrame(list(rows), columns=['id', 'type', 'input_database', 'input_code',
+                                                  'output_database', 'output_code'])
+    act_keys = pd.MultiIndex.from_arrays([acts['database'], acts['code']])
+    return {
+        'id': exchanges['id'].to_numpy(),
+        'type': exchanges['type'].to_numpy(),
+        'input': act_keys.get_indexer(pd.MultiIndex.from_arrays([exchanges['input_database'],
+                                                                 exchanges['input_code']])),
+        'output': act_keys.get_indexer(pd.MultiIndex.from_arrays([exchanges['output_database'],
+                                                                  exchanges['output_code']])),
+    }
+
+
+def filter_mask(acts: pd.DataFrame, f: ix.Filter) -> np.ndarray:
+    """
+    Vectorized evaluation of an activity_index filter over all the activities.
+    """
+    if f.kind == 'exclude':
+        return ~filter_mask(acts, f.inner)
+    column = acts[_COLUMNS[f.field]]
+    if f.kind == 'equals':
+        return (column == f.value).to_numpy()
+    if f.kind == 'contains':
+        return column.str.contains(f.value, regex=False).to_numpy()
+    if f.kind == 'startswith':
+        return column.str.startswith(f.value).to_numpy()
+    raise ValueError(f'Unknown filter type: {f.kind}')
+
+
+def _contains_any(acts: pd.DataFrame, strings: List[str]) -> np.ndarray:
+    mask = np.zeros(len(acts), dtype=bool)
+    for string in strings:
+        mask |= acts['product'].str.contains(string, regex=False).to_numpy()
+    return mask
+
+
+def rule_cut_mask(rule: CutRule, db_name: str, acts: pd.DataFrame,
+                  exchanges: Dict[str, np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Mask over ´´exchanges´´ of the exchanges cut by ´´rule´´ applied to ´´db_name´´. None if the rule is required
+    and no activity matches.
+    """
+    targets = (acts['database'] == db_name).to_numpy()
+    for f in rule.filters:
+        targets &= filter_mask(acts, f)
+    if rule.required and not targets.any():
+        return None
+    inputs, outputs = exchanges['input'], exchanges['output']
+    is_technosphere = exchanges['type'] == 'technosphere'
+    if rule.with_inputs:
+        # technosphere inputs of the targets
+        from_targets = is_technosphere & (outputs >= 0) & (inputs >= 0)
+        from_targets[from_targets] = targets[outputs[from_targets]]
+        targets = targets.copy()
+        targets[inputs[from_targets]] = True
+
+    if rule.side == 'upstream':
+        cut = is_technosphere & (inputs >= 0) & (outputs >= 0)
+        cut[cut] = targets[inputs[cut]]
+        if rule.output_contains_any is not None:
+            allowed = _contains_any(acts, rule.output_contains_any)
+            cut[cut] = allowed[outputs[cut]]
+        if rule.output_not_containing is not None:
+            allowed = ~_contains_any(acts, [rule.output_not_containing])
+            cut[cut] = allowed[outputs[cut]]
+        return cut
+
+    cut = np.isin(exchanges['type'], rule.kinds) & (outputs >= 0)
+    cut[cut] = targets[outputs[cut]]
+    if rule.input_contains is not None:
+        cut &= inputs >= 0
+        cut[cut] = _contains_any(acts, [rule.input_contains])[inputs[cut]]
+    return cut
+
+
+def avoid_double_accounting_matrix(carriers: List[str], avoid_countries_list: Optional[List[str]] = None,
+                                   databases: Optional[List[str]] = None, process: bool = True) -> pd.DataFrame:
+    """
+    Same cuts as main.avoid_double_accounting(), but computed at once for all the ´´carriers´´ and ´´databases´´ over
+    the exchanges table loaded as arrays, instead of walking act.upstream() and deleting exchanges one by one.
+    All the cuts are decided on the original exchanges and deleted in one bulk write.
+    Returns a report with the number of cut exchanges per carrier and database (the database where the exchange is,
+    i.e., its consumer). An exchange cut by several carriers is counted for the first one, in the order of
+    ´´carriers´´.
+    """
+    if databases is None:
+        databases = DOUBLE_ACCOUNTING_DATABASES
+    print(f'Starting matrix-based double accounting protocol. Carriers: {carriers}')
+    acts = load_activities()
+    kinds = ('technosphere', 'biosphere') if 'electricity' in carriers and avoid_countries_list else ('technosphere',)
+    exchanges = load_exchanges(acts, kinds=kinds)
+    print(f'Loaded {len(acts)} activities and {len(exchanges["id"])} exchanges')
+
+    already_cut = np.zeros(len(exchanges['id']), dtype=bool)
+    report = []
+    for carrier in carriers:
+        rules = carrier_rules(carrier, avoid_countries_list)
+        for db_name in databases:
+            if db_name not in bd.databases:
+                continue
+            carrier_cut = np.zeros(len(exchanges['id']), dtype=bool)
+            for rule in rules:
+                cut = rule_cut_mask(rule, db_name, acts, exchanges)
+                if cut is None:
+                    print(f'{carrier} not available in {db_name}')
+                    break
+                carrier_cut |= cut
+            carrier_cut &= ~already_cut
+            already_cut |= carrier_cut
+            if carrier_cut.any():
+                consumers = acts['database'].to_numpy()[exchanges['output'][carrier_cut]]
+                for database, count in zip(*np.unique(consumers, return_counts=True)):
+                    report.append({'carrier': carrier, 'targets_database': db_name, 'database': database,
+                                   'exchanges_cut': int(count)})
+    report = pd.DataFrame(report, columns=['carrier', 'targets_database', 'database', 'exchanges_cut'])
+
+    cut_outputs = consumer_index.delete_exchange_ids(exchanges['id'][already_cut])
+    # the fleet members whose exchanges were cut are not reused as they are anymore (see fleet_members)
+    fleet_members.invalidate_members(cut_outputs)
+    touched = sorted({database for database, _ in cut_outputs})
+    print(f'Deleted {int(already_cut.sum())} exchanges in {touched}')
+    if not report.empty:
+        print(report.groupby(['carrier', 'database'])['exchanges_cut'].sum().to_string())
+    if process:
+        for name in touched:
+            print(f'Processing {name}')
+            bd.Database(name).process()
+    print('Double accounting protocol successfully completed')
+    return report
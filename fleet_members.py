@@ -0,0 +1,174 @@
+import copy
+import hashlib
+import json
+from typing import Iterable, List, Optional, Tuple
+
+import bw2data as bd
+from bw2data.backends import Activity, ActivityDataset, Exchange
+
+import bulk_write
+from country_expansion import copy_code
+
+# database where the fleets and their members are written
+FLEET_DATABASE = 'additional_acts'
+# field of the member activities with the hash of the parameters they were built from
+MEMBER_HASH_FIELD = 'fleet_member_hash'
+# increase it when the way members are built changes, so the members built before are not reused
+FLEET_MEMBER_VERSION = 1
+
+Key = Tuple[str, str]
+
+
+def member_hash(kind: str, **parameters) -> str:
+    """
+    Content hash of the parameters defining a fleet member (e.g., a turbine parameter dictionary and its location).
+    Members with the same hash are the same inventory, whatever fleet or share they are used with.
+    """
+    payload = json.dumps({'kind': kind, 'version': FLEET_MEMBER_VERSION, 'parameters': parameters}, sort_keys=True,
+                         default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:10]
+
+
+def _get(code: str) -> Optional[Activity]:
+    document = ActivityDataset.get_or_none((ActivityDataset.database == FLEET_DATABASE) &
+                                           (ActivityDataset.code == code))
+    return Activity(document) if document is not None else None
+
+
+def reusable_member(code: str, content_hash: str) -> Optional[Activity]:
+    """
+    The member activity with ´´code´´ if it was built from the same parameters (´´content_hash´´) and not modified
+    afterwards (invalidate_members()). Otherwise, the member with the same code is deleted, so it can be built again.
+    """
+    act = _get(code)
+    if act is None:
+        return None
+    if act.get(MEMBER_HASH_FIELD) == content_hash:
+        return act
+    print(f"Fleet member '{act['name']}' was built with other parameters. Building it again")
+    act.delete()
+    return None
+
+
+def mark_member(act: Activity, content_hash: str):
+    """
+    Marks ´´act´´ as a complete member built from the parameters of ´´content_hash´´. Call it once the member is
+    finished, so a member interrupted halfway is not reused.
+    """
+    act[MEMBER_HASH_FIELD] = content_hash
+    act.save()
+
+
+def _park_documents(park_name: str) -> List[ActivityDataset]:
+    return [document for document in ActivityDataset.select().where(
+        (ActivityDataset.database == FLEET_DATABASE) & ActivityDataset.code.startswith(park_name + '_'))
+            if document.code.startswith(park_name + '_')]
+
+
+def reusable_park(park_name: str, content_hash: str) -> bool:
+    """
+    Whether the wind park ´´park_name´´ (all the activities whose code starts with its name, see
+    park_inventory.write_inventories()) was built from the same parameters (´´content_hash´´) and none of its
+    activities was modified afterwards (invalidate_members()). Otherwise, all the activities of the park are deleted,
+    so it can be written again.
+    """
+    documents = _park_documents(park_name)
+    if documents and all(document.data.get(MEMBER_HASH_FIELD) == content_hash for document in documents):
+        return True
+    if documents:
+        print(f"Wind park '{park_name}' was built with other parameters or modified afterwards. Building it again")
+        for document in documents:
+            Activity(document).delete()
+    return False
+
+
+def mark_park(park_name: str, content_hash: str):
+    """
+    mark_member() for every activity of the wind park ´´park_name´´, once the park is finished.
+    """
+    for document in _park_documents(park_name):
+        mark_member(Activity(document), content_hash)
+
+
+def invalidate_members(keys: Iterable[Key]):
+    """
+    Removes the member hash of the activities ´´keys´´ (those of FLEET_DATABASE; the rest are ignored). Call it when a
+    later stage modifies members (e.g., relinks or cuts their exchanges), so the next run builds them again instead of
+    reusing the modified inventories and modifying them twice.
+    """
+    codes = sorted({code for database, code in keys if database == FLEET_DATABASE})
+    invalidated = 0
+    for start in range(0, len(codes), bulk_write.CHUNK):
+        chunk = codes[start:start + bulk_write.CHUNK]
+        for document in ActivityDataset.select().where((ActivityDataset.database == FLEET_DATABASE) &
+                                                       (ActivityDataset.code.in_(chunk))):
+            if MEMBER_HASH_FIELD in document.data:
+                act = Activity(document)
+                del act[MEMBER_HASH_FIELD]
+                act.save()
+                invalidated += 1
+    if invalidated:
+        print(f'{invalidated} fleet member activities modified: they will be built again in the next run')
+
+
+def member_copy(source: Activity, content_hash: str) -> Tuple[Activity, bool]:
+    """
+    Copy of ´´source´´ in FLEET_DATABASE (with a code derived from the source), and whether it was reused. A copy that
+    is not reused must be marked with mark_member() after adapting it.
+    """
+    code = copy_code(source.key, FLEET_DATABASE)
+    act = reusable_member(code, content_hash)
+    if act is not None:
+        return act, True
+    return source.copy(database=FLEET_DATABASE, code=code), False
+
+
+def aggregation_activity(code: str, name: str, location: str, unit: str, reference_product: str,
+                         comment: Optional[str] = None) -> Activity:
+    """
+    Fleet-level activity, with its production exchange. It is created the first time; in later runs its metadata is
+    updated and all its other exchanges are deleted, so the caller only writes the exchanges of the current shares.
+    """
+    act = _get(code)
+    if act is None:
+        act = bd.Database(FLEET_DATABASE).new_activity(name=name, code=code, location=location, unit=unit)
+        if comment is not None:
+            act['comment'] = comment
+        act['reference product'] = reference_product
+        act.save()
+        production_exchange = act.new_exchange(input=act.key, type='production', amount=1)
+        production_exchange.save()
+        return act
+    act['name'], act['location'], act['unit'], act['reference product'] = name, location, unit, reference_product
+    if comment is not None:
+        act['comment'] = comment
+    act.save()
+    act.technosphere().delete()
+    act.biosphere().delete()
+    return act
+
+
+def aggregation_copy(source: Activity, code: str, **fields) -> Activity:
+    """
+    Fleet-level activity copied from ´´source´´ (e.g., a market whose shares are changed afterwards), with ´´fields´´
+    updated. A copy made in a previous run keeps its code (so its consumers stay linked) and gets the data and
+    exchanges of ´´source´´ again.
+    """
+    act = _get(code)
+    if act is None:
+        act = source.copy(database=FLEET_DATABASE, code=code)
+    else:
+        act._data.update({k: v for k, v in copy.deepcopy(source._data).items() if k not in ('code', 'database', 'id')})
+        act.technosphere().delete()
+        act.biosphere().delete()
+        for ex in source.exchanges():
+            if ex['type'] == 'production':
+                continue
+            data = dict(copy.deepcopy(ex._data), output=act.key)
+            if tuple(data['input']) == source.key:
+                data['input'] = act.key
+            Exchange(**data).save()
+    for field, value in fields.items():
+        act[field] = value
+    act.save()
+    return act
@@ -1,17 +1,25 @@
 from typing import Optional, Dict, Any, List, Union
-import pandas as pd
 from premise.geomap import Geomap
-import wurst.searching as ws
-import sys
 import bw2data as bd
 import wurst
-from collections import defaultdict
 
+import activity_index as ix
+import chain_collapse
+import consumer_index as ci
+import database_copy
+import fleet_members
 import config_parameters
 import consts
+import country_expansion
+import tech_mapping as tm
+import tier_aggregation
+from write_buffer import buffered_writes
+from instrumentation import log, span, traced
 from WindTrace import WindTrace_onshore, WindTrace_offshore
 
 
+@buffered_writes
+@traced
 def unlink_electricity(country_codes_list: Optional[List[str]] = None, db_name: str = 'premise_base'):
     """
     NOTE: markets for electricity won't make sense (they have recurrent inputs of themselves which are
@@ -21,58 +29,55 @@ def unlink_electricity(country_codes_list: Optional[List[str]] = None, db_name:
         market_group_locations = ['ENSTO-E', 'UCTE', 'Europe without Switzerland', 'RER']
         for location in market_group_locations:
             # get the market groups for electricity high voltage, medium voltage, low voltage.
-            market_groups = ws.get_many(
-                bd.Database(db_name),
-                ws.contains('name', 'market group for electricity'),
-                ws.equals('location', location)
+            market_groups = ix.get_many(
+                db_name,
+                ix.contains('name', 'market group for electricity'),
+                ix.equals('location', location)
             )
             for market_group_act in market_groups:
                 # in the technosphere we have the local markets (per country)
-                technosphere = [e for e in market_group_act.technosphere()]
-                for ex in technosphere:
-                    # delete upstream of the local market (country)
-                    for e in ex.input.upstream():
-                        e.delete()
-                # delete market group upstream also
-                for e in market_group_act.upstream():
-                    e.delete()
+                local_markets = [ex.input for ex in market_group_act.technosphere()]
+                # delete upstream of the local markets (country), and of the market group also
+                ci.delete_upstream(local_markets + [market_group_act])
     else:
         # for each country in the list, make the high, medium and low voltage markets an empty inventory.
         for country in country_codes_list:
             # high voltage market
-            high_voltage_market = ws.get_one(
-                bd.Database(db_name),
-                ws.equals('name', 'market for electricity, high voltage'),
-                ws.equals('location', country),
-                ws.equals('reference product', 'electricity, high voltage')
+            high_voltage_market = ix.get_one(
+                db_name,
+                ix.equals('name', 'market for electricity, high voltage'),
+                ix.equals('location', country),
+                ix.equals('reference product', 'electricity, high voltage')
             )
             # delete biosphere and technosphere
             high_voltage_market.biosphere().delete()
             high_voltage_market.technosphere().delete()
 
             # low voltage market
-            low_voltage_market = ws.get_one(
-                bd.Database(db_name),
-                ws.equals('name', 'market for electricity, low voltage'),
-                ws.equals('location', country),
-                ws.equals('reference product', 'electricity, low voltage')
+            low_voltage_market = ix.get_one(
+                db_name,
+                ix.equals('name', 'market for electricity, low voltage'),
+                ix.equals('location', country),
+                ix.equals('reference product', 'electricity, low voltage')
             )
             # delete biosphere and technosphere
             low_voltage_market.biosphere().delete()
             low_voltage_market.technosphere().delete()
 
             # medium voltage market
-            medium_voltage_market = ws.get_one(
-                bd.Database(db_name),
-                ws.equals('name', 'market for electricity, medium voltage'),
-                ws.equals('location', country),
-                ws.equals('reference product', 'electricity, medium voltage')
+            medium_voltage_market = ix.get_one(
+                db_name,
+                ix.equals('name', 'market for electricity, medium voltage'),
+                ix.equals('location', country),
+                ix.equals('reference product', 'electricity, medium voltage')
             )
             # delete biosphere and technosphere
             medium_voltage_market.biosphere().delete()
             medium_voltage_market.technosphere().delete()
 
 
+@buffered_writes
+@traced
 def unlink_heat(db_name: str = 'premise_base'):
     """
     It gets the market groups for heat ('central or small-scale, biomethane', 'central or small-scale, natural gas',
@@ -81,81 +86,75 @@ def unlink_heat(db_name: str = 'premise_base'):
     Europe without Switzerland) and deletes upstream.
     """
 
-    market_groups = ws.get_many(
-        bd.Database(db_name),
-        ws.contains('name', 'market group for heat'),
-        ws.equals('location', 'RER')
+    market_groups = ix.get_many(
+        db_name,
+        ix.contains('name', 'market group for heat'),
+        ix.equals('location', 'RER')
     )
     for market_group_act in market_groups:
         # Each market group has CH and Europe without Switzerland
-        technosphere = [e for e in market_group_act.technosphere()]
-        for ex in technosphere:
-            # delete upstream of the local market (country)
-            for e in ex.input.upstream():
-                e.delete()
-        for e in market_group_act.upstream():
-            e.delete()
+        local_markets = [ex.input for ex in market_group_act.technosphere()]
+        # delete upstream of the local markets (country), and of the market group also
+        ci.delete_upstream(local_markets + [market_group_act])
 
     # heat production activities and market for heat activities
     locations = ['RER', 'Europe without Switzerland', 'CH']
     for location in locations:
-        heat_production_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.contains('name', 'heat production,'),
-            ws.equals('location', location),
-            ws.exclude(ws.contains('name', 'wheat'))
+        heat_production_acts = ix.get_many(
+            db_name,
+            ix.contains('name', 'heat production,'),
+            ix.equals('location', location),
+            ix.exclude(ix.contains('name', 'wheat'))
         )
-        for act in heat_production_acts:
-            for e in act.upstream():
-                e.delete()
-        market_for_heat_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.contains('name', 'market for heat,'),
-            ws.equals('location', location)
+        ci.delete_upstream(heat_production_acts)
+        market_for_heat_acts = ix.get_many(
+            db_name,
+            ix.contains('name', 'market for heat,'),
+            ix.equals('location', location)
         )
-        for act in market_for_heat_acts:
-            for e in act.upstream():
-                e.delete()
+        ci.delete_upstream(market_for_heat_acts)
 
     # steam (remove GLO heat inputs to leave only water and direct emissions)
-    steam_act = ws.get_one(bd.Database(db_name),
-                           ws.equals('name', 'steam production, as energy carrier, in chemical industry'),
-                           ws.equals('location', 'RER'))
+    steam_act = ix.get_one(db_name,
+                           ix.equals('name', 'steam production, as energy carrier, in chemical industry'),
+                           ix.equals('location', 'RER'))
     for ex in steam_act.technosphere():
         if 'heat' in ex.input['reference product']:
             ex.delete()
 
 
+@buffered_writes
+@traced
 def unlink_co2(db_name: str = 'premise_base'):
     """
      It deletes CO2 inputs for methane production, methanol production and syngas production.
     """
-    co2_from_dac_acts = ws.get_many(
-        bd.Database(db_name),
-        ws.equals('reference product', 'carbon dioxide, captured from atmosphere'),
-        ws.equals('location', 'RER')
+    co2_from_dac_acts = ix.get_many(
+        db_name,
+        ix.equals('reference product', 'carbon dioxide, captured from atmosphere'),
+        ix.equals('location', 'RER')
     )
-    for act in co2_from_dac_acts:
-        for e in act.upstream():
-            e.delete()
+    ci.delete_upstream(co2_from_dac_acts)
 
 
+@buffered_writes
+@traced
 def unlink_hydrogen(db_name: str = 'premise_base'):
     """
     It deletes hydrogen outputs for syngas, carbon monoxide production, methanol production, kerosene, diesel, gasoline,
     and ammonia production
     """
     for source in ['electrolysis', 'woody biomass']:
-        hydrogen_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.contains('name', 'hydrogen production, gaseous'),
-            ws.contains('name', source)
+        hydrogen_acts = ix.get_many(
+            db_name,
+            ix.contains('name', 'hydrogen production, gaseous'),
+            ix.contains('name', source)
         )
-        for act in hydrogen_acts:
-            for e in act.upstream():
-                e.delete()
+        ci.delete_upstream(hydrogen_acts)
 
 
+@buffered_writes
+@traced
 def unlink_biomass(db_name: str = 'premise_base'):
     """
     To avoid double accounting, we want to delete the upstream of those biomass activities that are used as
@@ -165,47 +164,44 @@ def unlink_biomass(db_name: str = 'premise_base'):
     This function finds European markets for wood pellet, wood chips and bark chips, and deletes their upstream exchanges
     that give service to the above-mentioned activities.
     """
-    pellet_act = ws.get_one(
-        bd.Database(db_name),
-        ws.equals('name', 'market for wood pellet, measured as dry mass'),
-        ws.equals('location', 'RER')
+    pellet_act = ix.get_one(
+        db_name,
+        ix.equals('name', 'market for wood pellet, measured as dry mass'),
+        ix.equals('location', 'RER')
     )
-    for e in pellet_act.upstream():
-        if any(ref_prod in e.output['reference product'] for ref_prod in
-               ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,']):
-            e.delete()
+    ci.delete_exchanges([e for e in ci.upstream(pellet_act)
+                         if any(ref_prod in e.output['reference product'] for ref_prod in
+                                ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,'])])
     # market for biomass, used as fuel
-    biomass_as_fuel_act = ws.get_one(
-        bd.Database(db_name),
-        ws.equals('name', 'market for biomass, used as fuel'),
-        ws.equals('location', 'RER')
+    biomass_as_fuel_act = ix.get_one(
+        db_name,
+        ix.equals('name', 'market for biomass, used as fuel'),
+        ix.equals('location', 'RER')
     )
-    for e in biomass_as_fuel_act.upstream():
-        e.delete()
+    ci.delete_upstream([biomass_as_fuel_act])
     for location in ['Europe without Switzerland', 'CH', 'RER']:
         # wood chips, dry; wood chips, wet; wood chips, post-consumer
-        chips_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.contains('name', 'market for wood chips,'),
-            ws.equals('location', location)
+        chips_acts = ix.get_many(
+            db_name,
+            ix.contains('name', 'market for wood chips,'),
+            ix.equals('location', location)
         )
-        for act in chips_acts:
-            for e in act.upstream():
-                if any(ref_prod in e.output['reference product'] for ref_prod in
-                       ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,']):
-                    e.delete()
+        ci.delete_exchanges([e for e in ci.upstream_of(chips_acts)
+                             if any(ref_prod in e.output['reference product'] for ref_prod in
+                                    ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,'])])
         if location != 'RER':
-            bark_chips_act = ws.get_one(
-                bd.Database(db_name),
-                ws.contains('name', 'market for bark chips,'),
-                ws.equals('location', location)
+            bark_chips_act = ix.get_one(
+                db_name,
+                ix.contains('name', 'market for bark chips,'),
+                ix.equals('location', location)
             )
-            for e in bark_chips_act.upstream():
-                if any(ref_prod in e.output['reference product'] for ref_prod in
-                       ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,']):
-                    e.delete()
+            ci.delete_exchanges([e for e in ci.upstream(bark_chips_act)
+                                 if any(ref_prod in e.output['reference product'] for ref_prod in
+                                        ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,', 'diesel,'])])
 
 
+@buffered_writes
+@traced
 def unlink_methane(db_name: str = 'premise_base'):
     """
         To avoid double accounting, we want to delete the upstream of those biomass activities that are used as
@@ -215,85 +211,79 @@ def unlink_methane(db_name: str = 'premise_base'):
         that give service to the above-mentioned activities.
         """
     for location in ['CH', 'RER']:
-        biomethane_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.startswith('reference product', 'biomethane'),
-            ws.exclude(ws.contains('reference product', 'mixed')),
-            ws.equals('location', location)
+        biomethane_acts = ix.get_many(
+            db_name,
+            ix.startswith('reference product', 'biomethane'),
+            ix.exclude(ix.contains('reference product', 'mixed')),
+            ix.equals('location', location)
         )
-        for act in biomethane_acts:
-            for e in act.upstream():
-                if any(ref_prod in e.output['reference product'] for ref_prod in
-                       ['heat,', 'electricity,', 'methanol,', 'kerosene,', 'diesel,']):
-                    e.delete()
+        ci.delete_exchanges([e for e in ci.upstream_of(biomethane_acts)
+                             if any(ref_prod in e.output['reference product'] for ref_prod in
+                                    ['heat,', 'electricity,', 'methanol,', 'kerosene,', 'diesel,'])])
 
-    methane_acts = ws.get_many(
-        bd.Database(db_name),
-        ws.startswith('reference product', 'methane,'),
+    methane_acts = ix.get_many(
+        db_name,
+        ix.startswith('reference product', 'methane,'),
     )  # all in RER
-    for act in methane_acts:
-        for e in act.upstream():
-            if any(ref_prod in e.output['reference product'] for ref_prod in
-                   ['heat,', 'electricity,', 'methanol,', 'kerosene,', 'diesel,']):
-                e.delete()
+    ci.delete_exchanges([e for e in ci.upstream_of(methane_acts)
+                         if any(ref_prod in e.output['reference product'] for ref_prod in
+                                ['heat,', 'electricity,', 'methanol,', 'kerosene,', 'diesel,'])])
     european_locations = list(consts.LOCATION_EQUIVALENCE.values()) + ['RER', 'RoE', 'Europe without Switzerland']
     for location in european_locations:
-        nat_gas_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.startswith('reference product', 'natural gas,'),
-            ws.contains('reference product', 'pressure'),
-            ws.equals('location', location)
+        nat_gas_acts = ix.get_many(
+            db_name,
+            ix.startswith('reference product', 'natural gas,'),
+            ix.contains('reference product', 'pressure'),
+            ix.equals('location', location)
         )
-        for act in nat_gas_acts:
-            for e in act.upstream():
-                if any(ref_prod in e.output['reference product'] for ref_prod in
-                       ['heat,', 'electricity,', 'methanol,', 'kerosene,', 'diesel,']):
-                    e.delete()
+        ci.delete_exchanges([e for e in ci.upstream_of(nat_gas_acts)
+                             if any(ref_prod in e.output['reference product'] for ref_prod in
+                                    ['heat,', 'electricity,', 'methanol,', 'kerosene,', 'diesel,'])])
 
 
+@buffered_writes
+@traced
 def unlink_methanol(db_name: str = 'premise_base'):
     """
     Because methanol can be used as a feedstock, we want to delete the entire upstream (unless in gives service to
     another methanol production activity).
     """
     for location in ['CH', 'RER']:
-        methanol_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.startswith('reference product', 'methanol,'),
-            ws.equals('location', location)
+        methanol_acts = ix.get_many(
+            db_name,
+            ix.startswith('reference product', 'methanol,'),
+            ix.equals('location', location)
         )
-        for act in methanol_acts:
-            for e in act.upstream():
-                if 'methanol' not in e.output['reference product']:
-                    e.delete()
+        ci.delete_exchanges([e for e in ci.upstream_of(methanol_acts)
+                             if 'methanol' not in e.output['reference product']])
 
 
+@buffered_writes
+@traced
 def unlink_kerosene(db_name: str = 'premise_base'):
     for location in ['RER', 'Europe without Switzerland', 'CH']:
-        kerosene_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.startswith('reference product', 'kerosene'),
-            ws.equals('location', location)
+        kerosene_acts = ix.get_many(
+            db_name,
+            ix.startswith('reference product', 'kerosene'),
+            ix.equals('location', location)
         )
-        for act in kerosene_acts:
-            for e in act.upstream():
-                if any(ref_prod in e.output['reference product'] for ref_prod in
-                       ['heat,', 'electricity,', 'methanol,', 'methane,', 'diesel,']):
-                    e.delete()
+        ci.delete_exchanges([e for e in ci.upstream_of(kerosene_acts)
+                             if any(ref_prod in e.output['reference product'] for ref_prod in
+                                    ['heat,', 'electricity,', 'methanol,', 'methane,', 'diesel,'])])
 
 
+@buffered_writes
+@traced
 def unlink_diesel(db_name: str = 'premise_base'):
     for location in ['RER', 'Europe without Switzerland', 'CH']:
-        diesel_acts = ws.get_many(
-            bd.Database(db_name),
-            ws.startswith('reference product', 'diesel'),
-            ws.equals('location', location)
+        diesel_acts = ix.get_many(
+            db_name,
+            ix.startswith('reference product', 'diesel'),
+            ix.equals('location', location)
         )
-        for act in diesel_acts:
-            for e in act.upstream():
-                if any(ref_prod in e.output['reference product'] for ref_prod in
-                       ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,']):
-                    e.delete()
+        ci.delete_exchanges([e for e in ci.upstream_of(diesel_acts)
+                             if any(ref_prod in e.output['reference product'] for ref_prod in
+                                    ['heat,', 'electricity,', 'methanol,', 'methane,', 'kerosene,'])])
 
 
 # 1.2.1 Cement update
@@ -304,10 +294,10 @@ def cement_update():
     3. It substitutes clinker production (without CCS) upstream for clinker production with CCS in European regions
     NOTE: premise_cement database is a premise database (image_rcp19, 2050) with ndb.update('cement')
     """
-    cement_ccs_original = ws.get_one(
-        bd.Database('premise_cement'),
-        ws.equals('name', 'clinker production, efficient, with on-site CCS'),
-        ws.equals('location', 'WEU')
+    cement_ccs_original = ix.get_one(
+        'premise_cement',
+        ix.equals('name', 'clinker production, efficient, with on-site CCS'),
+        ix.equals('location', 'WEU')
     )
     # create a copy of the clinker production with CCS
     cement_ccs = cement_ccs_original.copy(database='premise_base')
@@ -319,20 +309,20 @@ def cement_update():
             location = 'RER'
         else:
             location = ex.input['location']
-        ex.input = ws.get_one(bd.Database('premise_base'),
-                              ws.equals('name', ex.input['name']),
-                              ws.equals('location', location),
-                              ws.equals('reference product', ex.input['reference product']))
+        ex.input = ix.get_one('premise_base',
+                              ix.equals('name', ex.input['name']),
+                              ix.equals('location', location),
+                              ix.equals('reference product', ex.input['reference product']))
         ex.save()
     # substitute upstream of clinker production in Europe for clinker production with CCS
     for location in ['Europe without Switzerland', 'CH']:
-        cement_original = ws.get_one(
-            bd.Database('premise_base'),
-            ws.equals('name', 'clinker production'),
-            ws.equals('location', location),
-            ws.equals('reference product', 'clinker')
+        cement_original = ix.get_one(
+            'premise_base',
+            ix.equals('name', 'clinker production'),
+            ix.equals('location', location),
+            ix.equals('reference product', 'clinker')
         )
-        for ex in cement_original.upstream():
+        for ex in ci.upstream(cement_original):
             ex.input = cement_ccs
             ex.save()
 
@@ -347,15 +337,15 @@ def train_update(db_name: str = 'premise_base'):
     The second one has as inputs the first one for both Europe without Switzerland and CH. These two,
     have electric and diesel inputs. The function deletes the diesel input and changes the amount of electric to 1.
     """
-    market_europe = ws.get_one(
-        bd.Database(db_name),
-        ws.equals('name', 'market for transport, freight train'),
-        ws.equals('location', 'Europe without Switzerland')
+    market_europe = ix.get_one(
+        db_name,
+        ix.equals('name', 'market for transport, freight train'),
+        ix.equals('location', 'Europe without Switzerland')
     )
-    market_ch = ws.get_one(
-        bd.Database(db_name),
-        ws.equals('name', 'market for transport, freight train'),
-        ws.equals('location', 'CH'))
+    market_ch = ix.get_one(
+        db_name,
+        ix.equals('name', 'market for transport, freight train'),
+        ix.equals('location', 'CH'))
     for act in [market_europe, market_ch]:
         ex_diesel = [e for e in act.technosphere() if 'diesel' in e.input['name']][0]
         ex_electric = [e for e in act.technosphere() if 'electricity' in e.input['name']][0]
@@ -370,10 +360,10 @@ def biomass_update(residues_share: float = 1.0):
     https://www.sciencedirect.com/science/article/pii/S2542435120303366#sectitle0125).
     """
     create_additional_acts_db()
-    market_biomass = ws.get_one(
-        bd.Database('premise_cement'),
-        ws.equals('name', 'market for biomass, used as fuel'),
-        ws.equals('location', 'WEU')
+    market_biomass = ix.get_one(
+        'premise_cement',
+        ix.equals('name', 'market for biomass, used as fuel'),
+        ix.equals('location', 'WEU')
     )
     biomass_act = market_biomass.copy(database='additional_acts')
     # change amounts AND relink inputs
@@ -384,25 +374,25 @@ def biomass_update(residues_share: float = 1.0):
             ex_input.input = new_input
             ex_input.save()
             for ex in new_input.technosphere():
-                ex.input = ws.get_one(bd.Database('premise_base'), ws.equals('name', ex.input['name']),
-                                      ws.equals('location', ex.input['location']),
-                                      ws.equals('reference product', ex.input['reference product']))
+                ex.input = ix.get_one('premise_base', ix.equals('name', ex.input['name']),
+                                      ix.equals('location', ex.input['location']),
+                                      ix.equals('reference product', ex.input['reference product']))
                 ex.save()
         else:
             ex_input['amount'] = 1 - residues_share
-            ex_input.input = ws.get_one(bd.Database('premise_base'), ws.equals('name', ex_input.input['name']),
-                                        ws.equals('location', ex_input.input['location']),
-                                        ws.equals('reference product', ex_input.input['reference product']))
+            ex_input.input = ix.get_one('premise_base', ix.equals('name', ex_input.input['name']),
+                                        ix.equals('location', ex_input.input['location']),
+                                        ix.equals('reference product', ex_input.input['reference product']))
             ex_input.save()
 
     upstream_activity_amount_dict = {}
     # change upstream
-    for ex in market_biomass.upstream():
+    for ex in ci.upstream(market_biomass):
         ex.input = biomass_act
         upstream_activity_amount_dict[ex.output] = ex['amount']
-        ex.output = ws.get_one(bd.Database('premise_base'), ws.equals('name', ex.output['name']),
-                               ws.equals('location', ex.output['location']),
-                               ws.equals('reference product', ex.output['reference product']))
+        ex.output = ix.get_one('premise_base', ix.equals('name', ex.output['name']),
+                               ix.equals('location', ex.output['location']),
+                               ix.equals('reference product', ex.output['reference product']))
         ex.save()
     biomass_act['location'] = 'RER'
     biomass_act.save()
@@ -444,205 +434,205 @@ def iron_steel_h2_dri_eaf():
     new_ex = new_act.new_exchange(input=new_act.key, amount=1, type='production')
     new_ex.save()
     # inputs from technosphere
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'aluminium oxide factory '
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'aluminium oxide factory '
                                                                      'construction'),
-                                                   ws.equals('location', 'RER')),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.000000000025, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'iron ore beneficiation'),
-                                                   ws.equals('location', 'RoW')),
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'iron ore beneficiation'),
+                                                   ix.equals('location', 'RoW')),
                                   amount=0.9499, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'market for hard coal'),
-                                                   ws.equals('location', 'Europe, without Russia and Turkey')),
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'market for hard coal'),
+                                                   ix.equals('location', 'Europe, without Russia and Turkey')),
                                   amount=0.0077, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'bentonite quarry operation'),
-                                                   ws.equals('location', 'DE')
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'bentonite quarry operation'),
+                                                   ix.equals('location', 'DE')
                                                    ),
                                   amount=0.0053, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'market for dolomite'),
-                                                   ws.equals('location', 'RER')),
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'market for dolomite'),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.0068, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'market for lime'),
-                                                   ws.equals('location', 'RER')),
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'market for lime'),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.0025, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'compressed air production, '
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'compressed air production, '
                                                                      '1000 kPa gauge, <30kW, optimised generation'),
-                                                   ws.equals('location', 'RER')),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.0089, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'market group for light fuel oil'),
-                                                   ws.equals('location', 'RER')),
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'market group for light fuel oil'),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.0020, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'market group for electricity, '
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'market group for electricity, '
                                                                      'medium voltage'),
-                                                   ws.equals('location', 'Europe without Switzerland')),
+                                                   ix.equals('location', 'Europe without Switzerland')),
                                   amount=0.0203, type='technosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name', 'market group for tap water'),
-                                                   ws.equals('location', 'RER')),
+    new_ex = new_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name', 'market group for tap water'),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.0004, type='technosphere')
     new_ex.save()
     # biosphere
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Cadmium II'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Cadmium II'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(0.02 * 2.2 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Chromium III'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Chromium III'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(5.1 * 22.4 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Copper ion'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Copper ion'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(1.6 * 6.7 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Mercury II'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Mercury II'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(0.4 * 24.2 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Manganese II'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Manganese II'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(5.1 * 64.3 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Nickel II'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Nickel II'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(6.5 * 12.7 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Lead II'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Lead II'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(15.6 * 70.8 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Tellurium'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Tellurium'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(0.6 * 3.0 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Vanadium V'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Vanadium V'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(13.4 * 15.1 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Zinc II'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Zinc II'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(3 * 1300 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Particulate Matter, < 2.5 um'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Particulate Matter, < 2.5 um'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(14 * 150 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Particulate Matter, < 2.5 um'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Particulate Matter, < 2.5 um'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(14 * 150 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Hydrogen fluoride'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Hydrogen fluoride'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(1.8 * 5.8 / 1000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Hydrochloric acid'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Hydrochloric acid'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(2.4 * 41.0 / 1000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Sulfur oxides'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Sulfur oxides'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(11 * 213 / 1000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Nitrogen oxides'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Nitrogen oxides'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(150 * 550 / 1000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Carbon monoxide, fossil'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Carbon monoxide, fossil'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(10 * 410 / 1000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.equals('name', 'Carbon dioxide, fossil'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.equals('name', 'Carbon dioxide, fossil'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=0.01, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.startswith('name', 'NMVOC,'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.startswith('name', 'NMVOC,'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(5 * 40 / 1000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.startswith('name', 'PAH,'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.startswith('name', 'PAH,'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(0.7 * 1.1 / 1000000000000) ** 0.5, type='biosphere')
     new_ex.save()
-    new_ex = new_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.startswith('name', 'Dioxins,'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = new_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.startswith('name', 'Dioxins,'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=(0.7 * 1.1 / 1000000000000000) ** 0.5, type='biosphere')
     new_ex.save()
@@ -664,21 +654,21 @@ def iron_steel_h2_dri_eaf():
     new_ex = market_act.new_exchange(input=new_act,
                                      amount=1, type='technosphere')
     new_ex.save()
-    new_ex = market_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                      ws.equals('name', 'transport, freight train, electricity'),
-                                                      ws.equals('location', 'Europe without Switzerland')),
+    new_ex = market_act.new_exchange(input=ix.get_one('premise_base',
+                                                      ix.equals('name', 'transport, freight train, electricity'),
+                                                      ix.equals('location', 'Europe without Switzerland')),
                                      amount=220 * 0.001, type='technosphere')
     new_ex.save()
-    new_ex = market_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                      ws.equals('name',
+    new_ex = market_act.new_exchange(input=ix.get_one('premise_base',
+                                                      ix.equals('name',
                                                                 'transport, freight, sea, bulk carrier for dry goods'),
-                                                      ws.equals('location', 'GLO')),
+                                                      ix.equals('location', 'GLO')),
                                      amount=776 * 0.001, type='technosphere')
     new_ex.save()
-    new_ex = market_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                      ws.equals('name',
+    new_ex = market_act.new_exchange(input=ix.get_one('premise_base',
+                                                      ix.equals('name',
                                                                 'transport, freight, lorry >32 metric ton, EURO6'),
-                                                      ws.equals('location', 'RER')),
+                                                      ix.equals('location', 'RER')),
                                      amount=64 * 0.001, type='technosphere')
     new_ex.save()
 
@@ -699,38 +689,38 @@ def iron_steel_h2_dri_eaf():
     new_ex = dri_act.new_exchange(input=market_act,
                                   amount=1.391, type='technosphere')
     new_ex.save()
-    new_ex = dri_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name',
+    new_ex = dri_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name',
                                                              'hydrogen production, gaseous, 30 bar, from PEM electrolysis, from grid electricity'),
-                                                   ws.equals('location', 'RER')),
+                                                   ix.equals('location', 'RER')),
                                   amount=0.054,
                                   type='technosphere')  # stochiometric recalculation based on Nurdiawati et al., 2023
     new_ex.save()
-    new_ex = dri_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name',
+    new_ex = dri_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name',
                                                              'market group for heat, district or industrial, natural gas'),
-                                                   ws.equals('location', 'RER')),
+                                                   ix.equals('location', 'RER')),
                                   amount=2.5, type='technosphere')  # stochiometric calculation
     new_ex.save()
-    new_ex = dri_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                   ws.equals('name',
+    new_ex = dri_act.new_exchange(input=ix.get_one('premise_base',
+                                                   ix.equals('name',
                                                              'water production, decarbonised'),
-                                                   ws.equals('location', 'DE')),
+                                                   ix.equals('location', 'DE')),
                                   amount=1.5, type='technosphere')
     new_ex.save()
     # biosphere
-    new_ex = dri_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                   ws.startswith('name', 'Carbon dioxide, fossil'),
-                                                   ws.equals('type', 'emission'),
-                                                   ws.equals('categories', ('air',))
+    new_ex = dri_act.new_exchange(input=ix.get_one('biosphere3',
+                                                   ix.startswith('name', 'Carbon dioxide, fossil'),
+                                                   ix.equals('type', 'emission'),
+                                                   ix.equals('categories', ('air',))
                                                    ),
                                   amount=0.04, type='biosphere')
     new_ex.save()
 
     # steel-EAF process: 50% scrap iron, 50% iron from H2-DRI. For both steel and chromium steel
-    steel_acts_original = ws.get_many(bd.Database('premise_base'),
-                                      ws.startswith('name', 'steel production, electric,'),
-                                      ws.contains('reference product', 'steel')
+    steel_acts_original = ix.get_many('premise_base',
+                                      ix.startswith('name', 'steel production, electric,'),
+                                      ix.contains('reference product', 'steel')
                                       )
     steel_act_to_return = []
     chromium_steel_act_to_return = []
@@ -763,12 +753,12 @@ def steel_update():
     """
     chromium_act, steel_act, iron_act = iron_steel_h2_dri_eaf()
     # substitute steel
-    steel_market_acts = ws.get_many(bd.Database('premise_base'),
-                                    ws.startswith('name', 'market for steel,'),
+    steel_market_acts = ix.get_many('premise_base',
+                                    ix.startswith('name', 'market for steel,'),
                                     )
     locations = list(consts.LOCATION_EQUIVALENCE.values()) + ['RER', 'Europe']
     for act in steel_market_acts:
-        for ex in act.upstream():
+        for ex in ci.upstream(act):
             if any(loc in ex.output._data['location'] for loc in locations) or 'market for steel' in ex.output['name']:
                 if 'chromium' in ex.input['name']:
                     ex.input = chromium_act
@@ -777,9 +767,9 @@ def steel_update():
                     ex.input = steel_act
                     ex.save()
     # substitute iron
-    cast_iron_act = ws.get_one(bd.Database('premise_base'),
-                               ws.equals('name', 'market for cast iron'))
-    for ex in cast_iron_act.upstream():
+    cast_iron_act = ix.get_one('premise_base',
+                               ix.equals('name', 'market for cast iron'))
+    for ex in ci.upstream(cast_iron_act):
         if any(loc in ex.output._data['location'] for loc in locations):
             if 'chromium' in ex.input['name']:
                 ex.input = chromium_act
@@ -795,12 +785,11 @@ def delete_methanol_facility_duplicate():
     of methanol. However, premise adds it and it represents 99% of impacts of methanol production because it is
     over-dimensioned. This function deletes it.
     """
-    methanol_facility_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'methanol production facility, construction'))
-    for ex in methanol_facility_act.upstream():
-        if ', purified' in ex.output._data['reference product']:
-            ex.delete()
+    methanol_facility_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'methanol production facility, construction'))
+    ci.delete_exchanges([ex for ex in ci.upstream(methanol_facility_act)
+                         if ', purified' in ex.output._data['reference product']])
 
 
 # plastics
@@ -829,52 +818,52 @@ def methanol_to_olefins():
             allocation_factor = (0.85 * 47.2) / (1 * 46.4 + 0.85 * 47.2 + 0.3 * 45.7)
         else:
             allocation_factor = (0.3 * 45.7) / (1 * 46.4 + 0.85 * 47.2 + 0.3 * 45.7)
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                          ws.equals('name',
+        new_ex = output_act.new_exchange(input=ix.get_one('premise_base',
+                                                          ix.equals('name',
                                                                     'methanol distillation, hydrogen from electrolysis, CO2 from DAC')
                                                           ),
                                          amount=5.93 * allocation_factor, type='technosphere')
         new_ex.save()
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                          ws.equals('name',
+        new_ex = output_act.new_exchange(input=ix.get_one('premise_base',
+                                                          ix.equals('name',
                                                                     'market group for electricity, medium voltage'),
-                                                          ws.equals('location', 'RER')
+                                                          ix.equals('location', 'RER')
                                                           ),
                                          amount=0.98973 * allocation_factor, type='technosphere')
         new_ex.save()
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                          ws.equals('name',
+        new_ex = output_act.new_exchange(input=ix.get_one('premise_base',
+                                                          ix.equals('name',
                                                                     'steam production, in chemical industry'),
-                                                          ws.equals('location', 'RER')
+                                                          ix.equals('location', 'RER')
                                                           ),
                                          amount=10.75 * allocation_factor, type='technosphere')
         new_ex.save()
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('premise_base'),
-                                                          ws.equals('name',
+        new_ex = output_act.new_exchange(input=ix.get_one('premise_base',
+                                                          ix.equals('name',
                                                                     'water production, deionised'),
-                                                          ws.equals('location', 'Europe without Switzerland')
+                                                          ix.equals('location', 'Europe without Switzerland')
                                                           ),
                                          amount=23.70 * allocation_factor, type='technosphere')
         new_ex.save()
         # biosphere
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                          ws.startswith('name', 'Carbon dioxide, fossil'),
-                                                          ws.equals('type', 'emission'),
-                                                          ws.equals('categories', ('air',))
+        new_ex = output_act.new_exchange(input=ix.get_one('biosphere3',
+                                                          ix.startswith('name', 'Carbon dioxide, fossil'),
+                                                          ix.equals('type', 'emission'),
+                                                          ix.equals('categories', ('air',))
                                                           ),
                                          amount=0.36 * allocation_factor, type='biosphere')
         new_ex.save()
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                          ws.startswith('name', 'Carbon monoxide, fossil'),
-                                                          ws.equals('type', 'emission'),
-                                                          ws.equals('categories', ('air',))
+        new_ex = output_act.new_exchange(input=ix.get_one('biosphere3',
+                                                          ix.startswith('name', 'Carbon monoxide, fossil'),
+                                                          ix.equals('type', 'emission'),
+                                                          ix.equals('categories', ('air',))
                                                           ),
                                          amount=0.00003365 * allocation_factor, type='biosphere')
         new_ex.save()
-        new_ex = output_act.new_exchange(input=ws.get_one(bd.Database('biosphere3'),
-                                                          ws.startswith('name', 'Nitrogen oxides'),
-                                                          ws.equals('type', 'emission'),
-                                                          ws.equals('categories', ('air',))
+        new_ex = output_act.new_exchange(input=ix.get_one('biosphere3',
+                                                          ix.startswith('name', 'Nitrogen oxides'),
+                                                          ix.equals('type', 'emission'),
+                                                          ix.equals('categories', ('air',))
                                                           ),
                                          amount=0.00017516 * allocation_factor, type='biosphere')
         new_ex.save()
@@ -882,13 +871,13 @@ def methanol_to_olefins():
 
 def relink_olefins():
     for chemical in ['propylene', 'ethylene']:  # butene does not have European market
-        act = ws.get_one(bd.Database('premise_base'),
-                         ws.equals('name', f'market for {chemical}'),
-                         ws.equals('location', 'RER')
+        act = ix.get_one('premise_base',
+                         ix.equals('name', f'market for {chemical}'),
+                         ix.equals('location', 'RER')
                          )
-        for ex in act.upstream():
-            ex.input = ws.get_one(bd.Database('premise_base'),
-                                  ws.startswith('name', f'{chemical} production, from methanol'))
+        for ex in ci.upstream(act):
+            ex.input = ix.get_one('premise_base',
+                                  ix.startswith('name', f'{chemical} production, from methanol'))
             ex.save()
 
 
@@ -901,13 +890,13 @@ def methanol_update():
     """
     Substitutes all methanol exchanges in Europe (where methanol is used as feedstock) for methanol from electrolysis.
     """
-    methanol_act = ws.get_one(bd.Database('premise_base'), ws.equals('name', 'market for methanol'))
+    methanol_act = ix.get_one('premise_base', ix.equals('name', 'market for methanol'))
     european_locations = list(consts.LOCATION_EQUIVALENCE.values()) + ['RER', 'RoE', 'Europe']
-    for ex in methanol_act.upstream():
+    for ex in ci.upstream(methanol_act):
         if any(loc in ex.output['location'] for loc in european_locations):
-            ex.input = ws.get_one(
-                bd.Database('premise_base'),
-                ws.equals('name', 'methanol distillation, hydrogen from electrolysis, CO2 from DAC'))
+            ex.input = ix.get_one(
+                'premise_base',
+                ix.equals('name', 'methanol distillation, hydrogen from electrolysis, CO2 from DAC'))
             ex.save()
 
 
@@ -916,12 +905,12 @@ def ammonia_update():
     Substitutes all ammonia exchanges in Europe for ammonia from hydrogen.
     NOTE: takes around 25 min.
     """
-    ammonia_act = ws.get_one(bd.Database('premise_base'),
-                             ws.equals('name', 'market for ammonia, anhydrous, liquid'),
-                             ws.equals('location', 'RER'))
-    for ex in ammonia_act.upstream():
-        ex.input = ws.get_one(bd.Database('premise_base'),
-                              ws.equals('name', 'ammonia production, hydrogen from electrolysis'))
+    ammonia_act = ix.get_one('premise_base',
+                             ix.equals('name', 'market for ammonia, anhydrous, liquid'),
+                             ix.equals('location', 'RER'))
+    for ex in ci.upstream(ammonia_act):
+        ex.input = ix.get_one('premise_base',
+                              ix.equals('name', 'ammonia production, hydrogen from electrolysis'))
         ex.save()
 
 
@@ -936,11 +925,11 @@ def trucks_update(fleet_electrification_share: float = 0.5):
     if 0.0 > fleet_electrification_share > 1.0:
         print(f'An electrification share of {fleet_electrification_share * 100:.1f}% is not possible. Changing to 50%')
         fleet_electrification_share = 0.5
-    freight_lorry_acts = ws.get_many(bd.Database('premise_base'),
-                                     ws.startswith('name', 'market for transport, freight, lorry'),
-                                     ws.equals('location', 'RER'))
+    freight_lorry_acts = ix.get_many('premise_base',
+                                     ix.startswith('name', 'market for transport, freight, lorry'),
+                                     ix.equals('location', 'RER'))
     for act in freight_lorry_acts:
-        print(act['name'])
+        log(act['name'])
         if '16-32' in act['name']:
             electric_mass = '26'
         elif '3.5-7.5' in act['name']:
@@ -951,13 +940,13 @@ def trucks_update(fleet_electrification_share: float = 0.5):
             electric_mass = '40'
 
         if 'unspecified' in act['name']:
-            print('unspecified. Substituting technosphere for EURO6')
+            log('unspecified. Substituting technosphere for EURO6')
             act.technosphere().delete()
             new_ex = act.new_exchange(
-                input=ws.get_one(bd.Database('premise_base'),
-                                 ws.equals('name', 'transport, freight, lorry, all sizes, EURO6 to '
+                input=ix.get_one('premise_base',
+                                 ix.equals('name', 'transport, freight, lorry, all sizes, EURO6 to '
                                                    'generic market for transport, freight, lorry, unspecified'),
-                                 ws.equals('location', 'RER')
+                                 ix.equals('location', 'RER')
                                  ),
                 amount=1, type='technosphere'
             )
@@ -965,13 +954,13 @@ def trucks_update(fleet_electrification_share: float = 0.5):
             # divide the service: shares according to fleet_electrification_share
             print(f'Dividing service: {fleet_electrification_share*100}% electric, '
                   f'{(1-fleet_electrification_share)*100}% synthetic diesel')
-            for ex in act.upstream():
-                print(f'changing {ex}')
+            for ex in ci.upstream(act):
+                log('changing %s', ex)
                 amount = ex['amount']
                 new_ex = ex.output.new_exchange(
-                    input=ws.get_one(
-                        bd.Database('premise_base'),
-                        ws.equals('name', 'transport, freight, lorry, battery electric, 18t gross weight, long haul')
+                    input=ix.get_one(
+                        'premise_base',
+                        ix.equals('name', 'transport, freight, lorry, battery electric, 18t gross weight, long haul')
                     ), amount=amount * fleet_electrification_share, type='technosphere'
                 )
                 new_ex.save()
@@ -980,21 +969,21 @@ def trucks_update(fleet_electrification_share: float = 0.5):
         elif 'EURO6' not in act['name']:
             print(f'Dividing service: {fleet_electrification_share*100}% electric, '
                   f'{(1-fleet_electrification_share)*100}% synthetic diesel')
-            for ex in act.upstream():
-                print('updating efficiency to EURO6')
+            for ex in ci.upstream(act):
+                log('updating efficiency to EURO6')
                 # update efficiency to EURO6
-                ex.input = ws.get_one(bd.Database('premise_base'),
-                                      ws.equals('name', ex.input['name'][:-1] + '6'),
-                                      ws.equals('location', 'RER')
+                ex.input = ix.get_one('premise_base',
+                                      ix.equals('name', ex.input['name'][:-1] + '6'),
+                                      ix.equals('location', 'RER')
                                       )
                 ex.save()
-                print(f'changing {ex}')
+                log('changing %s', ex)
                 # divide the service: shares according to fleet_electrification_share
                 amount = ex['amount']
                 new_ex = ex.output.new_exchange(
-                    input=ws.get_one(
-                        bd.Database('premise_base'),
-                        ws.equals('name',
+                    input=ix.get_one(
+                        'premise_base',
+                        ix.equals('name',
                                   f'transport, freight, lorry, battery electric, {electric_mass}t gross weight, long haul')
                     ), amount=amount * fleet_electrification_share, type='technosphere'
                 )
@@ -1002,25 +991,25 @@ def trucks_update(fleet_electrification_share: float = 0.5):
                 ex['amount'] = amount * (1 - fleet_electrification_share)
                 ex.save()
         else:
-            print('EURO6 vehicle. Adding synthetic diesel')
+            log('EURO6 vehicle. Adding synthetic diesel')
             # For EURO6 vehicles, synthetic diesel as input
             transpot_act = list(act.technosphere())[0].input
             for ex in transpot_act.technosphere():
                 if 'diesel' in ex.input['reference product']:
-                    ex.input = ws.get_one(
-                        bd.Database('premise_base'),
-                        ws.equals('name', 'diesel production, synthetic, Fischer Tropsch process, '
+                    ex.input = ix.get_one(
+                        'premise_base',
+                        ix.equals('name', 'diesel production, synthetic, Fischer Tropsch process, '
                                           'hydrogen from wood gasification, energy allocation'))
                     ex.save()
             print(f'Dividing service: {fleet_electrification_share * 100}% electric, '
                   f'{(1 - fleet_electrification_share) * 100}% synthetic diesel')
-            for ex in act.upstream():
+            for ex in ci.upstream(act):
                 # divide the service: shares according to fleet_electrification_share
                 amount = ex['amount']
                 new_ex = ex.output.new_exchange(
-                    input=ws.get_one(
-                        bd.Database('premise_base'),
-                        ws.equals('name',
+                    input=ix.get_one(
+                        'premise_base',
+                        ix.equals('name',
                                   f'transport, freight, lorry, battery electric, {electric_mass}t gross weight, long haul')
                     ), amount=amount * fleet_electrification_share, type='technosphere'
                 )
@@ -1041,11 +1030,11 @@ def sea_transport_update():
     5. Re-links all exchanges where GLO market act was giving a service to any European location. Now the service is
     provided by the RER act.
     """
-    sea_transport_acts = ws.get_many(bd.Database('premise_base'),
-                                     ws.startswith('name', 'transport, freight, sea,')
+    sea_transport_acts = ix.get_many('premise_base',
+                                     ix.startswith('name', 'transport, freight, sea,')
                                      )
-    sea_transport_market_acts = ws.get_many(bd.Database('premise_base'),
-                                            ws.startswith('name', 'market for transport, freight, sea')
+    sea_transport_market_acts = ix.get_many('premise_base',
+                                            ix.startswith('name', 'market for transport, freight, sea')
                                             )
     european_locations = list(consts.LOCATION_EQUIVALENCE.values()) + ['RER', 'RoE', 'Europe']
     for act in sea_transport_acts:
@@ -1063,16 +1052,16 @@ def sea_transport_update():
                 oil = True
         if oil:
             diesel_ex = european_act.new_exchange(
-                input=ws.get_one(
-                    bd.Database('premise_base'),
-                    ws.equals('name',
+                input=ix.get_one(
+                    'premise_base',
+                    ix.equals('name',
                               f'diesel production, synthetic, Fischer Tropsch process, '
                               'hydrogen from wood gasification, energy allocation')
                 ), amount=sum(heavy_fuel_oil_amounts), type='technosphere'
             )
             diesel_ex.save()
         # change the provider of all those activities that have sea transport as an input to the new RER location
-        for ex in act.upstream():
+        for ex in ci.upstream(act):
             if any(loc in ex.output['location'] for loc in european_locations):
                 ex.input = european_act
                 ex.save()
@@ -1083,15 +1072,15 @@ def sea_transport_update():
         # delete technosphere and make it only RER
         european_market.technosphere().delete()
         european_ex = european_market.new_exchange(
-            input=ws.get_one(bd.Database('premise_base'),
-                             ws.equals('name', european_market['name'][11:]),
-                             ws.equals('location', 'RER')
+            input=ix.get_one('premise_base',
+                             ix.equals('name', european_market['name'][11:]),
+                             ix.equals('location', 'RER')
                              ),
             type='technosphere', amount=1
         )
         european_ex.save()
         # change the provider of all those activities that have sea transport as an input to the new RER location
-        for ex in market.upstream():
+        for ex in ci.upstream(market):
             if any(loc in ex.output['location'] for loc in european_locations):
                 ex.input = european_market
                 ex.save()
@@ -1123,7 +1112,7 @@ def premise_base_auxiliary():
     'premise_auxiliary_for_infrastructure' will be the base for 'infrastructure (with European steel and concrete)'
     """
     if 'premise_auxiliary_for_infrastructure' not in bd.databases:
-        bd.Database('premise_base').copy('premise_auxiliary_for_infrastructure')
+        database_copy.copy_database('premise_base', 'premise_auxiliary_for_infrastructure')
 
 
 def update_cement_iron_foreground(
@@ -1151,18 +1140,22 @@ def update_cement_iron_foreground(
         new_db = bd.Database('infrastructure (with European steel and concrete)')
         new_db.register()
 
-    df = pd.read_excel(file_path, sheet_name='infrastructure')
+    mapping = tm.load_mapping(file_path)
+    resolution = tm.resolve(mapping, 'infrastructure', mapping.infrastructure, ['premise_auxiliary_for_infrastructure'],
+                            lambda row, loc: [ix.equals('name', row.name), ix.equals('location', loc)])
     solved, failed = [], []
+    wind_updated = False
 
-    for index, row in df.iterrows():
-        print(row['technology_name_calliope'])
-        if row['life_cycle_inventory_name'] in solved:
+    for row in mapping.infrastructure:
+        log(row.technology)
+        if row.name in solved:
             continue
 
-        # address wind fleets
-        if 'wind_' in row['technology_name_calliope']:
-            wind_materials_acts = ws.get_many(bd.Database('additional_acts'),
-                                              ws.contains('name', '_materials')
+        # address wind fleets (all wind materials acts are updated at once, so only for the first wind row)
+        if 'wind_' in row.technology and not wind_updated:
+            wind_updated = True
+            wind_materials_acts = ix.get_many('additional_acts',
+                                              ix.contains('name', '_materials')
                                               )
             for act in wind_materials_acts:
                 if '_offshore_materials' in act['name']:
@@ -1172,8 +1165,8 @@ def update_cement_iron_foreground(
                         # steel in WindTrace is different. Let's substitute it
                         for ex in e.input.technosphere():
                             if 'steel, low-alloyed' in ex.input['name']:
-                                ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                                      ws.equals('name',
+                                ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                                      ix.equals('name',
                                                                 'steel production, electric, low-alloyed, from DRI-EAF'))
                                 ex.save()
                 else:
@@ -1181,16 +1174,18 @@ def update_cement_iron_foreground(
                     # steel in WindTrace is different. Let's substitute it
                     for ex in act.technosphere():
                         if 'steel, low-alloyed' in ex.input['name']:
-                            ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                                  ws.equals('name',
+                            ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                                  ix.equals('name',
                                                             'steel production, electric, low-alloyed, from DRI-EAF'), )
                             ex.save()
+            # the wind parks are not reused as they are anymore (see fleet_members.reusable_park())
+            fleet_members.invalidate_members(act.key for act in wind_materials_acts)
 
         try:
-            org_act = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                 ws.equals('name', row['life_cycle_inventory_name']),
-                                 ws.equals('location', row['prod_location'])
-                                 )
+            match = resolution.match(row)
+            if match is None:
+                raise ValueError(f"No unique activity for '{row.name}' in {row.location}")
+            org_act = bd.get_activity(match[1])
             act = org_act.copy(database='infrastructure (with European steel and concrete)')
             # 'if' statements to deal with EXCEPTIONS
             if 'market' in act['name'] or 'fuel cell system' in act['name']:
@@ -1207,9 +1202,9 @@ def update_cement_iron_foreground(
             elif 'biomethane factory' in act['name']:
                 for ex in act.technosphere():
                     if 'industrial furnace' in ex.input['name']:
-                        furnace_act = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                                 ws.equals('name', 'industrial furnace production, 1MW, oil'),
-                                                 ws.equals('location', 'CH'))
+                        furnace_act = ix.get_one('premise_auxiliary_for_infrastructure',
+                                                 ix.equals('name', 'industrial furnace production, 1MW, oil'),
+                                                 ix.equals('location', 'CH'))
                         new_act = furnace_act.copy(database='additional_acts')
                         new_ex = act.new_exchange(input=new_act, type='technosphere', amount=ex['amount'])
                         new_ex.save()
@@ -1220,8 +1215,8 @@ def update_cement_iron_foreground(
                 input_acts = []
                 for ex in act.technosphere():
                     ex.input.copy(database='additional_acts')
-                    new_act = ws.get_one(bd.Database('additional_acts'), ws.equals('name', ex.input['name']),
-                                         ws.equals('location', ex.input['location']))
+                    new_act = ix.get_one('additional_acts', ix.equals('name', ex.input['name']),
+                                         ix.equals('location', ex.input['location']))
                     cement_iron_steel_subs(new_act)
                     input_acts.append(new_act)
                 act.technosphere().delete()
@@ -1230,10 +1225,10 @@ def update_cement_iron_foreground(
                     new_ex.save()
             else:
                 cement_iron_steel_subs(act=act)
-            solved.append(row['life_cycle_inventory_name'])
+            solved.append(row.name)
 
         except Exception:
-            failed.append(row['life_cycle_inventory_name'])
+            failed.append(row.name)
 
     print('Cement and iron for European infrastructure updated successfully')
     return failed
@@ -1253,47 +1248,47 @@ def cement_iron_steel_subs(act):
     for ex in act.technosphere():
         # substitute iron
         if ex.input['name'] == 'market for cast iron' or ex.input['name'] == 'cast iron production':
-            ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                  ws.equals('name', 'iron production, from DRI'))
+            ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                  ix.equals('name', 'iron production, from DRI'))
             ex.save()
         # substitute steel
         elif any(name == ex.input['name'] for name in steel_list.keys()):
             try:
-                ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                      ws.equals('name', steel_list[ex.input['name']]),
-                                      ws.equals('location', 'RER'))
+                ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                      ix.equals('name', steel_list[ex.input['name']]),
+                                      ix.equals('location', 'RER'))
                 ex.save()
             except Exception:
                 pass
             try:
-                ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                      ws.equals('name', steel_list[ex.input['name']]),
-                                      ws.equals('location', 'Europe without Switzerland and Austria'))
+                ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                      ix.equals('name', steel_list[ex.input['name']]),
+                                      ix.equals('location', 'Europe without Switzerland and Austria'))
                 ex.save()
             except Exception:
                 pass
         # substitute steel, hot rolled
         elif any(name == ex.input['name'] for name in steel_hot_rolled_list.keys()):
             try:
-                ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                      ws.equals('name', steel_hot_rolled_list[ex.input['name']]),
-                                      ws.equals('location', 'RER'))
+                ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                      ix.equals('name', steel_hot_rolled_list[ex.input['name']]),
+                                      ix.equals('location', 'RER'))
                 ex.save()
-                hot_rolling_act = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                             ws.equals('name', 'hot rolling, steel'),
-                                             ws.equals('location', 'Europe without Austria'))
+                hot_rolling_act = ix.get_one('premise_auxiliary_for_infrastructure',
+                                             ix.equals('name', 'hot rolling, steel'),
+                                             ix.equals('location', 'Europe without Austria'))
                 new_ex = act.new_exchange(input=hot_rolling_act, type='technosphere', amount=ex['amount'])
                 new_ex.save()
             except Exception:
                 pass
             try:
-                ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                      ws.equals('name', steel_hot_rolled_list[ex.input['name']]),
-                                      ws.equals('location', 'Europe without Switzerland and Austria'))
+                ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                      ix.equals('name', steel_hot_rolled_list[ex.input['name']]),
+                                      ix.equals('location', 'Europe without Switzerland and Austria'))
                 ex.save()
-                hot_rolling_act = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                             ws.equals('name', 'hot rolling, steel'),
-                                             ws.equals('location', 'Europe without Austria'))
+                hot_rolling_act = ix.get_one('premise_auxiliary_for_infrastructure',
+                                             ix.equals('name', 'hot rolling, steel'),
+                                             ix.equals('location', 'Europe without Austria'))
                 new_ex = act.new_exchange(input=hot_rolling_act, type='technosphere', amount=ex['amount'])
                 new_ex.save()
             except Exception:
@@ -1302,9 +1297,9 @@ def cement_iron_steel_subs(act):
         # substitute concrete
         elif 'concrete' in act['name']:
             try:
-                ex.input = ws.get_one(bd.Database('premise_auxiliary_for_infrastructure'),
-                                      ws.equals('name', 'market for concrete, normal strength'),
-                                      ws.equals('location', 'CH'))
+                ex.input = ix.get_one('premise_auxiliary_for_infrastructure',
+                                      ix.equals('name', 'market for concrete, normal strength'),
+                                      ix.equals('location', 'CH'))
                 ex.save()
             except Exception:
                 pass
@@ -1328,6 +1323,39 @@ def iam_location_equivalence():
     return regions_codes
 
 
+def _om_filters(row: tm.MappingRow, location: str) -> Optional[List[ix.Filter]]:
+    """
+    Search of the activity of an o&m row of the mapping file in delete_infrastructure_main(). Hydrogen production is
+    not searched (it is always the electrolyser fleet of 'additional_acts'), nor the rows located in 'country' (they
+    are expanded by country_expansion.expand_countries()).
+    """
+    if 'wind' in row.name:
+        return [ix.contains('name', row.name), ix.exclude(ix.contains('name', 'renewable energy products')),
+                ix.equals('location', location)]
+    if 'hydrogen production' in row.name or row.location == tm.COUNTRY_LOCATION:
+        return None
+    return [ix.contains('name', row.name), ix.exclude(ix.contains('name', 'renewable energy products')),
+            ix.equals('location', location), ix.contains('reference product', row.reference_product)]
+
+
+def _mapped_activity(resolution: tm.Resolution, row: tm.MappingRow, location: str, copies: Dict):
+    """
+    Activity of the o&m row in 'additional_acts'. Activities found only in 'premise_base' are copied to
+    'additional_acts' (once). Wind activities are only taken from 'additional_acts'.
+    """
+    match = resolution.match(row, location)
+    if match is None:
+        return None
+    database, key = match
+    if database == 'additional_acts':
+        return bd.get_activity(key)
+    if 'wind' in row.name:
+        return None
+    if key not in copies:
+        copies[key] = bd.get_activity(key).copy(database='additional_acts')
+    return copies[key]
+
+
 def delete_infrastructure_main(
         file_path: str = r'C:\Users\1361185\OneDrive - UAB\Documentos\GitHub\calliope_enbios_int\data\input\tech_mapping_in.xlsx',
         om_spheres_separation: bool = True
@@ -1342,84 +1370,63 @@ def delete_infrastructure_main(
     Moreover, it creates another copy of the activity in additional_acts
     (adding ', technosphere' at the end of the name), and it removes the biosphere.
     Exceptions: it deletes the infrastructure not in tier 1 by removing the upstream of the infrastructure itself.
+    Rows located in 'country' are expanded to all the countries at once (see country_expansion.py).
+    Returns the availability matrix of those rows: one row per mapping row and one column per country, with the status
+    of the country ('expanded', 'already expanded', 'missing' or 'ambiguous').
     """
     print('Starting delete infrastructure protocol')
     # add carbon capture
-    dac = ws.get_one(bd.Database('premise_base'),
-                     ws.equals('name',
+    dac = ix.get_one('premise_base',
+                     ix.equals('name',
                                'carbon dioxide, captured from atmosphere and stored, with a sorbent-based direct air capture system, 100ktCO2'),
-                     ws.equals('location', 'RER'))
+                     ix.equals('location', 'RER'))
     dac.copy(database='additional_acts')
 
     # delete infrastructure
-    df = pd.read_excel(file_path, sheet_name='o&m')
-    for name, location, database, reference_product in (
-            zip(df['life_cycle_inventory_name'], df['prod_location'], df['prod_database'],
-                df['prod_reference_product'])):
-        print('NEXT ACTIVITY')
-        print(f'Name: {name}')
-        print(f'Location: {location}')
-        print(f'Reference product: {reference_product}')
-
-        # If the location is 'country', start checking for activities
-        if location == 'country':
-            for loc in consts.LOCATION_EQUIVALENCE.values():
-                try:
-                    try:
-                        act = ws.get_one(bd.Database('additional_acts'), ws.contains('name', name),
-                                         ws.exclude(ws.contains('name', 'renewable energy products')),
-                                         ws.equals('location', loc),
-                                         ws.contains('reference product', reference_product))
-                    except Exception:
-                        org_act = ws.get_one(bd.Database('premise_base'), ws.contains('name', name),
-                                         ws.exclude(ws.contains('name', 'renewable energy products')),
-                                         ws.equals('location', loc),
-                                         ws.contains('reference product', reference_product))
-                        act = org_act.copy(database='additional_acts')
-                    infrastructure = [e for e in act.technosphere() if e.input._data['unit'] == 'unit']
-                    for e in infrastructure:
-                        e.delete()
-                    if om_spheres_separation:
-                        om_biosphere(act)
-                        om_technosphere(act)
-                    print(f'Activity: {name}. Location: {loc}. Ref product: {reference_product}')
-                    continue
-                except Exception:
-                    print(f'No activity ({name}) in ({loc})')
-                    # there is no need to create copy after copy
-                    continue
+    mapping = tm.load_mapping(file_path)
+    resolution = tm.resolve(mapping, 'o&m', mapping.om, ['additional_acts', 'premise_base'], _om_filters)
+    # activities of premise_base already copied to additional_acts, and activities already processed (rows sharing
+    # the same activity are processed once)
+    copies, done = {}, set()
+    # availability of the rows located in 'country', per country
+    availabilities = {}
+    for row in mapping.om:
+        name, location, reference_product = row.name, row.location, row.reference_product
+        log('NEXT ACTIVITY')
+        log(f'Name: {name}')
+        log(f'Location: {location}')
+        log(f'Reference product: {reference_product}')
+
+        # If the location is 'country', expand the activity to all the countries at once
+        if location == tm.COUNTRY_LOCATION:
+            availabilities[f'{row.id}: {name}'] = country_expansion.expand_countries(
+                name, reference_product=reference_product, countries=row.locations(),
+                databases=['additional_acts', 'premise_base'], target='additional_acts',
+                strip_infrastructure=True, split_spheres=om_spheres_separation)
 
         else:
             # If location is not 'country', proceed with regular activity lookup
             try:
-                if 'wind' in name:
-                    act = ws.get_one(bd.Database('additional_acts'), ws.contains('name', name),
-                                     ws.exclude(ws.contains('name', 'renewable energy products')),
-                                     ws.equals('location', location)
-                                     )
                 # infrastructure activities in hydrogen in tier 1 (not tier 0)
-                elif 'hydrogen production' in name:
-                    act = ws.get_one(bd.Database('additional_acts'),
-                                     ws.equals('name', 'hydrogen production, from electrolyser fleet, for enbios'),
-                                         ws.equals('location', 'RER'),
-                                         ws.contains('reference product', 'hydrogen, gaseous'))
+                if 'hydrogen production' in name and 'wind' not in name:
+                    act = ix.get_one('additional_acts',
+                                     ix.equals('name', 'hydrogen production, from electrolyser fleet, for enbios'),
+                                     ix.equals('location', 'RER'),
+                                     ix.contains('reference product', 'hydrogen, gaseous'))
+                    if act.key in done:
+                        continue
                     hydrogen_inputs = [ex.input for ex in act.technosphere()]
                     for a in hydrogen_inputs:
                         infrastructure = [e for e in a.technosphere() if e.input._data['unit'] == 'unit']
                         for e in infrastructure:
                             e.delete()
                 else:
-                    try:
-                        act = ws.get_one(bd.Database('additional_acts'), ws.contains('name', name),
-                                         ws.exclude(ws.contains('name', 'renewable energy products')),
-                                         ws.equals('location', location),
-                                         ws.contains('reference product', reference_product))
-                    except Exception:
-                        org_act = ws.get_one(bd.Database('premise_base'), ws.contains('name', name),
-                                         ws.exclude(ws.contains('name', 'renewable energy products')),
-                                         ws.equals('location', location),
-                                         ws.contains('reference product', reference_product))
-                        act = org_act.copy(database='additional_acts')
+                    act = _mapped_activity(resolution, row, location, copies)
+                    if act is None:
+                        raise ValueError(f'No unique activity for {name} in {location}')
+                    if act.key in done:
+                        continue
+                done.add(act.key)
                 # we do not want to delete the maintenance of offshore and onshore wind (which have 'unit' as units),
                 # and that is why we add this conditional.
                 if not any(wind_name in act['name'] for wind_name in ['onshore', 'offshore']):
@@ -1429,49 +1436,47 @@ def delete_infrastructure_main(
                 if om_spheres_separation:
                     om_biosphere(act)
                     om_technosphere(act)
-                print(f'Activity found for {name} in location: {location}')
+                log(f'Activity found for {name} in location: {location}')
             except Exception:
-                print(f'No activity ({name}) in location: {location}.')
+                log(f'No activity ({name}) in location: {location}.')
     # Delete the infrastructure that is not in tier 1, by removing the upstream of the infrastructure itself
     # dac
-    dac_acts = ws.get_many(bd.Database('premise_base'),
-                           ws.startswith('name', 'direct air capture system'))
-    for act in dac_acts:
-        act.upstream().delete()
-    dac_acts_waste = ws.get_many(bd.Database('premise_base'),
-                                 ws.startswith('name', 'treatment of direct air capture system'))
-    for act in dac_acts_waste:
-        act.upstream().delete()
+    dac_acts = ix.get_many('premise_base',
+                           ix.startswith('name', 'direct air capture system'))
+    ci.delete_upstream(dac_acts)
+    dac_acts_waste = ix.get_many('premise_base',
+                                 ix.startswith('name', 'treatment of direct air capture system'))
+    ci.delete_upstream(dac_acts_waste)
     # RWGS tank
-    rwgs_act = ws.get_one(bd.Database('premise_base'),
-                          ws.startswith('name', 'RWGS tank'))
-    rwgs_act.upstream().delete()
+    rwgs_act = ix.get_one('premise_base',
+                          ix.startswith('name', 'RWGS tank'))
+    ci.delete_upstream([rwgs_act])
     # fixed bed reactor
-    bed_reactor_act = ws.get_one(bd.Database('premise_base'),
-                                 ws.contains('name', 'fixed bed reactor'))
-    bed_reactor_act.upstream().delete()
+    bed_reactor_act = ix.get_one('premise_base',
+                                 ix.contains('name', 'fixed bed reactor'))
+    ci.delete_upstream([bed_reactor_act])
     # syngas factory
-    syngas_factory_act = ws.get_one(bd.Database('premise_base'),
-                                    ws.equals('name', 'market for synthetic gas factory'))
-    syngas_factory_act.upstream().delete()
+    syngas_factory_act = ix.get_one('premise_base',
+                                    ix.equals('name', 'market for synthetic gas factory'))
+    ci.delete_upstream([syngas_factory_act])
     # methanol factory
-    methanol_factory_act = ws.get_one(bd.Database('premise_base'),
-                                      ws.equals('name', 'methanol production facility, construction'))
-    methanol_factory_act.upstream().delete()
+    methanol_factory_act = ix.get_one('premise_base',
+                                      ix.equals('name', 'methanol production facility, construction'))
+    ci.delete_upstream([methanol_factory_act])
     # electrolyser
-    electrolyzer_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.startswith('name', 'hydrogen production, gaseous, 30 bar, from PEM electrolysis, from grid electricity'))
+    electrolyzer_act = ix.get_one(
+        'premise_base',
+        ix.startswith('name', 'hydrogen production, gaseous, 30 bar, from PEM electrolysis, from grid electricity'))
     for ex in electrolyzer_act.technosphere():
         if ex.input._data['unit'] == 'unit':
             ex.delete()
     # liquid storage tank
-    liquid_storage_act = ws.get_one(bd.Database('premise_base'),
-                                    ws.equals('name', 'market for liquid storage tank, chemicals, organics'))
-    for ex in liquid_storage_act.upstream():
-        if any(fuel in ex.output['name'] for fuel in ['hydrogen', 'carbon dioxide', 'methanol']):
-            ex.delete()
+    liquid_storage_act = ix.get_one('premise_base',
+                                    ix.equals('name', 'market for liquid storage tank, chemicals, organics'))
+    ci.delete_exchanges([ex for ex in ci.upstream(liquid_storage_act)
+                         if any(fuel in ex.output['name'] for fuel in ['hydrogen', 'carbon dioxide', 'methanol'])])
     print('Delete infrastructure protocol completed successfully')
+    return country_expansion.availability_matrix(availabilities)
 
 def om_biosphere(act):
     """
@@ -1483,7 +1488,7 @@ def om_biosphere(act):
     biosphere_act.technosphere().delete()
     # handle special cases: hydrogen fleet
     if biosphere_act['name'] == 'hydrogen production, from electrolyser fleet, for enbios, biosphere':
-        bioflows, bioexchanges = collect_biosphere_flows(
+        bioflows_gruped = tier_aggregation.biosphere_flows(
             activity=act,
             tier_limit=1,
             specific_inputs=['hydrogen production, gaseous, 30 bar, from PEM electrolysis, from grid electricity',
@@ -1491,7 +1496,6 @@ def om_biosphere(act):
                              'hydrogen production, gaseous, 20 bar, from AEC electrolysis, from grid electricity'
                              ]
         )
-        bioflows_gruped = aggregate_flows(bioflows)
         biosphere_act.biosphere().delete()
         for flow in bioflows_gruped:
             new_ex = biosphere_act.new_exchange(input=flow[0], type='biosphere', amount=flow[1])
@@ -1529,17 +1533,17 @@ def chp_waste_update(db_waste_name: str, db_original_name: str, locations: list)
     create_additional_acts_db()
     for location in locations:
         try:
-            waste_electricity_original = ws.get_one(bd.Database(db_waste_name),
-                                                    ws.equals('name',
+            waste_electricity_original = ix.get_one(db_waste_name,
+                                                    ix.equals('name',
                                                               'treatment of municipal solid waste, incineration'),
-                                                    ws.equals('location', location),
-                                                    ws.contains('reference product', 'electricity')
+                                                    ix.equals('location', location),
+                                                    ix.contains('reference product', 'electricity')
                                                     )
-            print(f'original_location: {location}, assigned location: {location}')
+            log(f'original_location: {location}, assigned location: {location}')
             waste_act = waste_electricity_original.copy(database='additional_acts')
-            print(f'creating copy of {waste_act._data["name"]}')
+            log(f'creating copy of {waste_act._data["name"]}')
             waste_act.technosphere().delete()
-            print(f'deleting technosphere')
+            log(f'deleting technosphere')
             # delete land use (it is during installation)
             waste_land_use = [e for e in waste_act.biosphere() if
                                'Transformation' in e.input['name'] or 'Occupation' in e.input['name']]
@@ -1550,11 +1554,11 @@ def chp_waste_update(db_waste_name: str, db_original_name: str, locations: list)
                                              e.input['type'] == 'natural resource']
             for e in waste_resource_extraction:
                 e.delete()
-            waste_original_heat = ws.get_one(bd.Database(db_waste_name),
-                                             ws.equals('name',
+            waste_original_heat = ix.get_one(db_waste_name,
+                                             ix.equals('name',
                                                        'treatment of municipal solid waste, incineration'),
-                                             ws.equals('location', location),
-                                             ws.contains('reference product', 'heat')
+                                             ix.equals('location', location),
+                                             ix.contains('reference product', 'heat')
                                              )
             waste_heat_act = waste_original_heat.copy(database='additional_acts')
             # delete land use (it is during installation)
@@ -1567,21 +1571,21 @@ def chp_waste_update(db_waste_name: str, db_original_name: str, locations: list)
                                              e.input['type'] == 'natural resource']
             for e in waste_resource_extraction:
                 e.delete()
-            print(f'creating copy of {waste_heat_act._data["name"]}')
+            log(f'creating copy of {waste_heat_act._data["name"]}')
             waste_heat_act.technosphere().delete()
-            print(f'deleting technosphere')
+            log(f'deleting technosphere')
         # if we do not find the location, CH is chosen by default.
         except wurst.errors.NoResults:
-            waste_electricity_original = ws.get_one(bd.Database(db_waste_name),
-                                                    ws.equals('name',
+            waste_electricity_original = ix.get_one(db_waste_name,
+                                                    ix.equals('name',
                                                               'treatment of municipal solid waste, incineration'),
-                                                    ws.equals('location', 'CH'),
-                                                    ws.contains('reference product', 'electricity')
+                                                    ix.equals('location', 'CH'),
+                                                    ix.contains('reference product', 'electricity')
                                                     )
-            print(f'original_location: {location}, assigned location: CH')
+            log(f'original_location: {location}, assigned location: CH')
             waste_act = waste_electricity_original.copy(database='additional_acts')
-            print(f'copy of {waste_act._data["name"]} created in "additional_acts"')
-            print('changing location')
+            log(f'copy of {waste_act._data["name"]} created in "additional_acts"')
+            log('changing location')
             waste_act['location'] = location
             waste_act['comment'] = waste_act['comment'] + '\n' + 'Taken dataset from CH'
             waste_act.save()
@@ -1596,11 +1600,11 @@ def chp_waste_update(db_waste_name: str, db_original_name: str, locations: list)
                 e.delete()
             #waste_act.technosphere().delete()
             #print(f'deleting technosphere')
-            waste_heat_original = ws.get_one(bd.Database(db_waste_name),
-                                             ws.equals('name',
+            waste_heat_original = ix.get_one(db_waste_name,
+                                             ix.equals('name',
                                                        'treatment of municipal solid waste, incineration'),
-                                             ws.equals('location', 'CH'),
-                                             ws.contains('reference product', 'electricity')
+                                             ix.equals('location', 'CH'),
+                                             ix.contains('reference product', 'electricity')
                                              )
             waste_heat_act = waste_heat_original.copy(database='additional_acts')
             waste_heat_act['location'] = location
@@ -1632,14 +1636,14 @@ def chp_waste_update(db_waste_name: str, db_original_name: str, locations: list)
     production_ex = new_act.new_exchange(input=new_act.key, type='production', amount=1)
     production_ex.save()
     for part in incinerator_parts:
-        acts = ws.get_many(bd.Database(db_original_name), ws.contains('name', part),
-                           ws.exclude(ws.contains('name', 'market')))
+        acts = ix.get_many(db_original_name, ix.contains('name', part),
+                           ix.exclude(ix.contains('name', 'market')))
         list_acts = list(acts)
         if len(list_acts) > 1:
             part_act = [a for a in list_acts if a._data['location'] == 'CH'][0]
         else:
             part_act = list_acts[0]
-        print(part_act._data['name'], part_act._data['location'])
+        log(f"{part_act._data['name']} {part_act._data['location']}")
         new_ex = new_act.new_exchange(input=part_act, type='technosphere', amount=1)
         new_ex.save()
 
@@ -1651,9 +1655,9 @@ def update_methanol_facility():
     reactor of 8 m3. LT assumed 20 years. Production rate will be 44900000 kg / 20 years / 8000 h = 280 kg/h
     """
     print('Updating methanol facility')
-    methanol_facility_act_original = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'methanol production facility, construction'))
+    methanol_facility_act_original = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'methanol production facility, construction'))
     methanol_facility_act = methanol_facility_act_original.copy(database='additional_acts')
 
     for ex in methanol_facility_act.technosphere():
@@ -1682,30 +1686,30 @@ def update_chp_hydrogen():
     Substitutes hydrogen supply from PEM instead of refinery! (wrong in premise)
     """
     print('Updating CHP hydrogen supply')
-    chp_elect_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'electricity, residential, by conversion of hydrogen using fuel cell, '
+    chp_elect_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'electricity, residential, by conversion of hydrogen using fuel cell, '
                           'PEM, allocated by exergy, distributed by pipeline, produced by Electrolysis, '
                           'PEM using electricity from grid')
     )
-    chp_heat_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'heat, residential, by conversion of hydrogen using fuel cell, '
+    chp_heat_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'heat, residential, by conversion of hydrogen using fuel cell, '
                           'PEM, allocated by exergy, distributed by pipeline, produced by Electrolysis, '
                           'PEM using electricity from grid')
     )
-    hydrogen_distributed_pipeline_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'hydrogen supply, distributed by pipeline')
+    hydrogen_distributed_pipeline_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'hydrogen supply, distributed by pipeline')
     )
     hydrogen_europe_act = hydrogen_distributed_pipeline_act.copy(database='additional_acts')
     hydrogen_europe_act['location'] = 'RER'
     hydrogen_europe_act.save()
     for ex in hydrogen_europe_act.technosphere():
         if ex.input['reference product'] == 'hydrogen, gaseous':
-            ex.input = ws.get_one(
-                bd.Database('premise_base'),
-                ws.equals('name', 'hydrogen production, gaseous, 30 bar, from PEM electrolysis, '
+            ex.input = ix.get_one(
+                'premise_base',
+                ix.equals('name', 'hydrogen production, gaseous, 30 bar, from PEM electrolysis, '
                                   'from grid electricity'))
             ex.save()
     for act in [chp_elect_act, chp_heat_act]:
@@ -1723,8 +1727,8 @@ def biofuel_to_methanol_update(db_methanol_name: str):
     """
     print('Removing CCS from H2 for biofuel to methanol')
     # Change name of the methanol distillation activity
-    methanol_distillation_original = ws.get_one(bd.Database(db_methanol_name),
-                                                ws.equals('name',
+    methanol_distillation_original = ix.get_one(db_methanol_name,
+                                                ix.equals('name',
                                                           'methanol distillation, from wood, with CCS'),
                                                 )
     create_additional_acts_db()
@@ -1747,11 +1751,11 @@ def biofuel_to_methanol_update(db_methanol_name: str):
                    ex.input._data[
                        'name'] == ('hydrogen production, gaseous, 25 bar, from gasification of woody biomass'
                                    ' in entrained flow gasifier, with CCS, at gasification plant')][0]
-    h2_new_act = ws.get_one(bd.Database(h2_exchange.input.key[0]),
-                            ws.equals('name',
+    h2_new_act = ix.get_one(h2_exchange.input.key[0],
+                            ix.equals('name',
                                       'hydrogen production, gaseous, 25 bar, from gasification of woody biomass '
                                       'in entrained flow gasifier, at gasification plant'),
-                            ws.equals('location', 'RER')
+                            ix.equals('location', 'RER')
                             )
     h2_exchange.input = h2_new_act.key
     h2_exchange.save()
@@ -1767,8 +1771,8 @@ def trucks_and_bus_update(db_truck_name: str):
     using an internal combustion engine.
     """
     # light truck
-    light_truck_original = ws.get_one(bd.Database(db_truck_name),
-                                      ws.equals('name',
+    light_truck_original = ix.get_one(db_truck_name,
+                                      ix.equals('name',
                                                 'light duty truck, battery electric, 3.5t gross weight, '
                                                 'long haul'),
                                       )
@@ -1782,8 +1786,8 @@ def trucks_and_bus_update(db_truck_name: str):
             ex.delete()
 
     # medium truck
-    medium_truck_original = ws.get_one(bd.Database(db_truck_name),
-                                       ws.equals('name',
+    medium_truck_original = ix.get_one(db_truck_name,
+                                       ix.equals('name',
                                                  'medium duty truck, battery electric, 26t gross weight, '
                                                  'long haul'),
                                        )
@@ -1795,8 +1799,8 @@ def trucks_and_bus_update(db_truck_name: str):
         if not any(input_name in ex.input['name'] for input_name in keep_inputs):
             ex.delete()
     # bus
-    bus_original = ws.get_one(bd.Database(db_truck_name),
-                              ws.equals('name',
+    bus_original = ix.get_one(db_truck_name,
+                              ix.equals('name',
                                         'passenger bus, battery electric - opportunity charging, LTO battery, '
                                         '13m single deck urban bus'),
                               )
@@ -1814,16 +1818,16 @@ def passenger_car_and_scooter_update(db_passenger_name: str):
     Creates a copy of 'passenger car, battery electric, Medium' in the database 'additional_acts_db' and
     deletes glider inputs.
     """
-    car_original = ws.get_one(bd.Database(db_passenger_name),
-                              ws.equals('name', 'passenger car, battery electric, Medium'),
+    car_original = ix.get_one(db_passenger_name,
+                              ix.equals('name', 'passenger car, battery electric, Medium'),
                               )
     create_additional_acts_db()
     car_act = car_original.copy(database='additional_acts')
     for ex in car_act.technosphere():
         if 'glider' in ex.input['name']:
             ex.delete()
-    scooter_original = ws.get_one(bd.Database(db_passenger_name),
-                                  ws.equals('name', 'scooter, battery electric, 4-11kW'),
+    scooter_original = ix.get_one(db_passenger_name,
+                                  ix.equals('name', 'scooter, battery electric, 4-11kW'),
                                   )
     scooter_act = scooter_original.copy(database='additional_acts')
     for ex in scooter_act.technosphere():
@@ -1837,13 +1841,13 @@ def gas_to_liquid_update(db_cobalt_name: str, db_gas_to_liquid_name: str):
     as input (catalyst).
     """
     print('Updating gas-to-liquid plant')
-    gas_to_liquid_original_act = ws.get_one(bd.Database(db_gas_to_liquid_name),
-                                            ws.equals('name', 'gas-to-liquid plant construction'),
+    gas_to_liquid_original_act = ix.get_one(db_gas_to_liquid_name,
+                                            ix.equals('name', 'gas-to-liquid plant construction'),
                                             )
     create_additional_acts_db()
     gas_to_liquid_act = gas_to_liquid_original_act.copy(database='additional_acts')
-    cobalt_act = list(ws.get_many(bd.Database(db_cobalt_name), ws.equals('name', 'market for cobalt'),
-                                  ws.equals('reference product', 'cobalt'),
+    cobalt_act = list(ix.get_many(db_cobalt_name, ix.equals('name', 'market for cobalt'),
+                                  ix.equals('reference product', 'cobalt'),
                                   ))[0]
     new_ex = gas_to_liquid_act.new_exchange(input=cobalt_act, type='technosphere', amount=1250000)
     new_ex.save()
@@ -1855,10 +1859,10 @@ def hydro_reservoir_update(location: str, db_hydro_name: str):
     reservoir power plants.
     """
     print(f'Updating hydro power plant')
-    electricity_reservoir = ws.get_one(
-        bd.Database(db_hydro_name),
-        ws.contains('name', 'electricity production, hydro, reservoir, non-alpine region'),
-        ws.equals('location', location)
+    electricity_reservoir = ix.get_one(
+        db_hydro_name,
+        ix.contains('name', 'electricity production, hydro, reservoir, non-alpine region'),
+        ix.equals('location', location)
     )
     create_additional_acts_db()
     new_elec_act = electricity_reservoir.copy(database='additional_acts')
@@ -1876,8 +1880,8 @@ def hydro_reservoir_update(location: str, db_hydro_name: str):
     # change land transformation, from unspecified. Use "Transformation, from unspecified, natural (non-use)"
     unspecified_land_ex = [e for e in new_infrastructure_act.biosphere()
                                if e.input['name'] == 'Transformation, from unspecified'][0]
-    unspecified_natural_land_ex = [a for a in bd.Database('biosphere3')
-                                       if a['name'] == 'Transformation, from unspecified, natural (non-use)'][0]
+    unspecified_natural_land_ex = ix.get_many('biosphere3',
+                                              ix.equals('name', 'Transformation, from unspecified, natural (non-use)'))[0]
     unspecified_land_ex.input = unspecified_natural_land_ex
     unspecified_land_ex.save()
 
@@ -1888,9 +1892,9 @@ def hydro_run_of_river_update(db_hydro_name: str):
     run-of-river power plants. Location always CA-QC, as it is the only one with clear info in MW of infrastructure.
     """
     print('Updating hydro run-of-river power plant')
-    electricity_run_of = ws.get_one(bd.Database(db_hydro_name),
-                                    ws.contains('name', 'electricity production, hydro, run-of-river'),
-                                    ws.equals('location', 'CA-QC'))
+    electricity_run_of = ix.get_one(db_hydro_name,
+                                    ix.contains('name', 'electricity production, hydro, run-of-river'),
+                                    ix.equals('location', 'CA-QC'))
     create_additional_acts_db()
     new_elec_act = electricity_run_of.copy(database='additional_acts')
     infrastructure_act = [e.input for e in new_elec_act.technosphere() if e.input._data['unit'] == 'unit'][0]
@@ -1912,9 +1916,9 @@ def pumped_hydro_update(db_pump_name: str, location: str):
      to infrastructure because we already ran hydro_reservoir_update(), which does the same.
     """
     print('Updating pumped hydro power plant')
-    electricity_pumped = ws.get_one(bd.Database(db_pump_name),
-                                    ws.contains('name', 'electricity production, hydro, pumped storage'),
-                                    ws.equals('location', location))
+    electricity_pumped = ix.get_one(db_pump_name,
+                                    ix.contains('name', 'electricity production, hydro, pumped storage'),
+                                    ix.equals('location', location))
     create_additional_acts_db()
     new_elec_act = electricity_pumped.copy(database='additional_acts')
     land = [e for e in new_elec_act.biosphere() if
@@ -1926,41 +1930,41 @@ def pumped_hydro_update(db_pump_name: str, location: str):
 def fuels_combustion():
     print('Updating fuels for combustion')
     # bus
-    bus_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'transport, passenger bus, diesel, 13m single deck coach bus, EURO-VI'))
+    bus_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'transport, passenger bus, diesel, 13m single deck coach bus, EURO-VI'))
     # heavy transport
-    heavy_transport_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'transport, freight, lorry, diesel, 26t gross weight, EURO-VI, long haul'))
+    heavy_transport_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'transport, freight, lorry, diesel, 26t gross weight, EURO-VI, long haul'))
     # light transport
-    light_transport_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'transport, freight, lorry, diesel, 3.5t gross weight, EURO-VI, long haul'))
+    light_transport_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'transport, freight, lorry, diesel, 3.5t gross weight, EURO-VI, long haul'))
     # passenger car
-    passenger_car_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'transport, passenger car, diesel, Medium, EURO-6'))
+    passenger_car_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'transport, passenger car, diesel, Medium, EURO-6'))
     # motorcycle
-    motorcycle_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'transport, Motorbike, gasoline, 4-11kW, EURO-5'))
+    motorcycle_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'transport, Motorbike, gasoline, 4-11kW, EURO-5'))
     # air transport
-    air_transport_act = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'transport, freight, aircraft, belly-freight, medium haul'))
+    air_transport_act = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'transport, freight, aircraft, belly-freight, medium haul'))
     # sea transport
     try:
-        sea_transport_act = ws.get_one(
-            bd.Database('premise_base'),
-            ws.equals('name', 'transport, freight, sea, container ship'),
-            ws.equals('location', 'RER')
+        sea_transport_act = ix.get_one(
+            'premise_base',
+            ix.equals('name', 'transport, freight, sea, container ship'),
+            ix.equals('location', 'RER')
         )
     except Exception:
-        sea_transport_act = ws.get_one(
-            bd.Database('premise_base'),
-            ws.equals('name', 'transport, freight, sea, container ship'),
-            ws.equals('location', 'GLO')
+        sea_transport_act = ix.get_one(
+            'premise_base',
+            ix.equals('name', 'transport, freight, sea, container ship'),
+            ix.equals('location', 'GLO')
         )
 
     for act in [bus_act, heavy_transport_act, light_transport_act, passenger_car_act,
@@ -1974,9 +1978,9 @@ def biogas_update(db_biogas_name: str):
     It creates a biogas infrastructure
     """
     print('Updating biogas infrastructure')
-    components = ws.get_many(bd.Database(db_biogas_name),
-                                 ws.startswith('name', 'heat and power co-generation unit construction, 160kW electrical,'),
-                                 ws.equals('location', 'RER'))
+    components = ix.get_many(db_biogas_name,
+                                 ix.startswith('name', 'heat and power co-generation unit construction, 160kW electrical,'),
+                                 ix.equals('location', 'RER'))
     create_additional_acts_db()
     new_act = bd.Database('additional_acts').new_activity(name='biogas infrastructure, 160kW',
                                                           code='biogas infrastructure, 160kW',
@@ -1995,12 +1999,12 @@ def biofuel_to_methane_infrastructure(db_syn_gas_name: str):
     It creates a biomethane factory that includes 1 synthetic gas factory and 7.11 industrial furnaces.
     """
     print('Updating biofuel infrastructure')
-    syn_gas_factory = ws.get_one(bd.Database(db_syn_gas_name),
-                                 ws.equals('name', 'synthetic gas factory construction'),
-                                 ws.equals('location', 'CH'))
-    furnace = ws.get_one(bd.Database(db_syn_gas_name),
-                         ws.equals('name', 'industrial furnace production, natural gas'),
-                         ws.equals('location', 'RER'))
+    syn_gas_factory = ix.get_one(db_syn_gas_name,
+                                 ix.equals('name', 'synthetic gas factory construction'),
+                                 ix.equals('location', 'CH'))
+    furnace = ix.get_one(db_syn_gas_name,
+                         ix.equals('name', 'industrial furnace production, natural gas'),
+                         ix.equals('location', 'RER'))
     create_additional_acts_db()
     new_act = bd.Database('additional_acts').new_activity(name='biomethane factory', code='biomethane factory',
                                                           location='RER', unit='unit')
@@ -2016,12 +2020,12 @@ def biofuel_to_methane_infrastructure(db_syn_gas_name: str):
 
 def hp_update(db_hp_name: str):
     print('Updating heat pumps')
-    heat_exchanger = ws.get_one(bd.Database(db_hp_name),
-                                ws.equals('name', 'market for borehole heat exchanger, 150m'),
-                                ws.equals('location', 'GLO'))
-    heat_pump = ws.get_one(bd.Database(db_hp_name),
-                           ws.equals('name', 'market for heat pump, brine-water, 10kW'),
-                           ws.equals('location', 'GLO'))
+    heat_exchanger = ix.get_one(db_hp_name,
+                                ix.equals('name', 'market for borehole heat exchanger, 150m'),
+                                ix.equals('location', 'GLO'))
+    heat_pump = ix.get_one(db_hp_name,
+                           ix.equals('name', 'market for heat pump, brine-water, 10kW'),
+                           ix.equals('location', 'GLO'))
     create_additional_acts_db()
     new_act = bd.Database('additional_acts').new_activity(name='heat pump with heat exchanger, brine-water, 10kW',
                                                           code='heat pump with heat exchanger, brine-water, 10kW',
@@ -2074,28 +2078,28 @@ def airborne_wind_lci(bd_airborne_name: str):
         input_amount = material_info[1]
         for act_name, location in material_act_name_location.items():
             if act_name == 'polyethylene production, low density, granulate':
-                act = ws.get_one(bd.Database(bd_airborne_name),
-                                 ws.equals('name', act_name),
-                                 ws.equals('location', location),
-                                 ws.contains('reference product', 'polyethylene'))
+                act = ix.get_one(bd_airborne_name,
+                                 ix.equals('name', act_name),
+                                 ix.equals('location', location),
+                                 ix.contains('reference product', 'polyethylene'))
             elif act_name == 'plywood production':
-                act = ws.get_one(bd.Database(bd_airborne_name),
-                                 ws.equals('name', act_name),
-                                 ws.equals('location', location),
-                                 ws.equals('reference product', 'plywood'))
+                act = ix.get_one(bd_airborne_name,
+                                 ix.equals('name', act_name),
+                                 ix.equals('location', location),
+                                 ix.equals('reference product', 'plywood'))
             else:
-                act = ws.get_one(bd.Database(bd_airborne_name),
-                                 ws.equals('name', act_name),
-                                 ws.equals('location', location))
+                act = ix.get_one(bd_airborne_name,
+                                 ix.equals('name', act_name),
+                                 ix.equals('location', location))
 
             new_ex = new_act.new_exchange(input=act, type='technosphere', amount=input_amount)
             new_ex.save()
 
     # add installation (0.48 m2 excavation for cabling)
-    excavation = ws.get_one(
-        bd.Database(bd_airborne_name),
-        ws.equals('name', 'excavation, hydraulic digger'),
-        ws.equals('location', 'RER'))
+    excavation = ix.get_one(
+        bd_airborne_name,
+        ix.equals('name', 'excavation, hydraulic digger'),
+        ix.equals('location', 'RER'))
     new_ex = new_act.new_exchange(input=excavation, type='technosphere', amount=182 * 400 * 0.48)
     new_ex.save()
 
@@ -2114,27 +2118,32 @@ def airborne_wind_lci(bd_airborne_name: str):
     new_ex = new_act.new_exchange(input=new_act.key, type='production', amount=1)
     new_ex.save()
 
-    car_transport = ws.get_one(
-        bd.Database(bd_airborne_name),
-        ws.equals('name', 'transport, passenger car'),
-        ws.equals('location', 'RER'))
+    car_transport = ix.get_one(
+        bd_airborne_name,
+        ix.equals('name', 'transport, passenger car'),
+        ix.equals('location', 'RER'))
     new_ex = new_act.new_exchange(input=car_transport, type='technosphere', amount=521400)
     new_ex.save()
-    oil = ws.get_one(
-        bd.Database(bd_airborne_name),
-        ws.equals('name', 'lubricating oil production'),
-        ws.equals('location', 'RER'))
+    oil = ix.get_one(
+        bd_airborne_name,
+        ix.equals('name', 'lubricating oil production'),
+        ix.equals('location', 'RER'))
     new_ex = new_act.new_exchange(input=oil, type='technosphere', amount=273000)
     new_ex.save()
 
 
 ##### create fleets #####
 # wind_onshore
+@buffered_writes
+@traced
 def wind_onshore_fleet(db_wind_name: str, location: str,
                        fleet_turbines_definition: Dict[str, List[Union[Dict[str, Any], float]]],
-                       biosphere3: bd.Database = bd.Database('biosphere3')
+                       biosphere3: bd.Database = bd.Database('biosphere3'),
+                       processes: int = 1
                        ):
     """
+    ´´processes´´: number of worker processes computing the turbine inventories (see
+    WindTrace_onshore.lci_wind_parks()). They are written at once in any case.
     ´´fleet_turbines_definition´´ structure:
     {'turbine_1': [
     {
@@ -2155,46 +2164,49 @@ def wind_onshore_fleet(db_wind_name: str, location: str,
 
     expected_keys = {'power', 'manufacturer', 'rotor_diameter', 'hub_height', 'commissioning_year',
                      'generator_type', 'recycled_share_steel', 'lifetime', 'eol_scenario'}
+    # each turbine is identified by its parameters: turbines built before (in this or another fleet) are reused
     park_names = []
+    members = {}
     for turbine, info in fleet_turbines_definition.items():
         turbine_parameters = info[0]
-        park_name = f'{turbine}_{turbine_parameters["power"]}_{location}'
-        park_names.append(park_name)
         if turbine_parameters.keys() != expected_keys:
             raise ValueError(f'The keys introduced {turbine_parameters.keys()} do not match '
                              f'the expected keys {expected_keys}')
-    try:
-        # Check if lengths match, meaning no duplicates
-        if len(park_names) == len(list(set(park_names))):
-            print("No duplicates found in park names")
-        else:
-            print("Park name duplicates found. Try other names")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        sys.exit()
-
-    # create individual turbines
-    for turbine, info in fleet_turbines_definition.items():
-        turbine_parameters = info[0]
-        park_name = f'{turbine}_{turbine_parameters["power"]}_{location}'
-        WindTrace_onshore.lci_wind_turbine(
-            new_db=bd.Database('additional_acts'), cutoff391=bd.Database(db_wind_name),
-            park_name=park_name, park_power=turbine_parameters['power'], number_of_turbines=1,
-            park_location=location, park_coordinates=(51.181, 13.655),
-            manufacturer=turbine_parameters['manufacturer'], rotor_diameter=turbine_parameters['rotor_diameter'],
-            turbine_power=turbine_parameters['power'], hub_height=turbine_parameters['hub_height'],
-            commissioning_year=turbine_parameters['commissioning_year'],
-            generator_type=turbine_parameters['generator_type'],
-            recycled_share_steel=turbine_parameters['recycled_share_steel'],
-            lifetime=turbine_parameters['lifetime'], eol_scenario=turbine_parameters['eol_scenario'],
-            biosphere3=biosphere3
-        )
-
+        content_hash = fleet_members.member_hash('onshore wind turbine', location=location, database=db_wind_name,
+                                                 **turbine_parameters)
+        park_name = f'onshore_{turbine_parameters["power"]}_{location}_{content_hash}'
+        park_names.append(park_name)
+        members[park_name] = (turbine_parameters, content_hash)
+
+    # compute the turbines that are not built yet, and write them all at once
+    new_members = {park_name: member for park_name, member in members.items()
+                   if not fleet_members.reusable_park(park_name, member[1])}
+    for park_name in members:
+        if park_name not in new_members:
+            print(f'Reusing turbine {park_name}')
+    if new_members:
+        parks = [dict(park_name=park_name, park_power=turbine_parameters['power'], number_of_turbines=1,
+                      park_location=location, park_coordinates=(51.181, 13.655),
+                      manufacturer=turbine_parameters['manufacturer'],
+                      rotor_diameter=turbine_parameters['rotor_diameter'],
+                      turbine_power=turbine_parameters['power'], hub_height=turbine_parameters['hub_height'],
+                      commissioning_year=turbine_parameters['commissioning_year'],
+                      generator_type=turbine_parameters['generator_type'],
+                      recycled_share_steel=turbine_parameters['recycled_share_steel'],
+                      lifetime=turbine_parameters['lifetime'], eol_scenario=turbine_parameters['eol_scenario'])
+                 for park_name, (turbine_parameters, _) in new_members.items()]
+        with span('lci_wind_parks', parks=len(parks), processes=processes):
+            WindTrace_onshore.lci_wind_parks(new_db=bd.Database('additional_acts'),
+                                             cutoff391=bd.Database(db_wind_name), biosphere3=biosphere3,
+                                             parks=parks, processes=processes)
+
+    for park_name, (turbine_parameters, content_hash) in new_members.items():
         # maintenance activity per kWh
         turbine_kwh = bd.Database('additional_acts').get(park_name + '_turbine_kwh')
 
         for ex in turbine_kwh.technosphere():
-            new_single_turbine = ex.input.copy(database='additional_acts')
+            # the copy keeps the name of the park in its code, so it is deleted with the park
+            new_single_turbine = ex.input.copy(database='additional_acts', code=f'{ex.input["code"]}_kwh')
             ex.input = new_single_turbine
             ex.save()
             for e in new_single_turbine.technosphere():
@@ -2213,23 +2225,18 @@ def wind_onshore_fleet(db_wind_name: str, location: str,
         ex = list(maintenance_activity.upstream())
         for e in ex:
             e.delete()
+        fleet_members.mark_park(park_name, content_hash)
 
-    # create fleet activity
-    fleet_activity = bd.Database('additional_acts').new_activity(
-        name=f'onshore wind turbine fleet, 1 MW, for enbios, {location}',
+    # create fleet activity (only its inputs are written again if it already exists)
+    fleet_activity = fleet_members.aggregation_activity(
         code=f'onshore wind turbine fleet, 1 MW, for enbios, {location}',
-        unit='unit',
-        location=location
+        name=f'onshore wind turbine fleet, 1 MW, for enbios, {location}',
+        location=location, unit='unit', reference_product='onshore wind turbine fleet, 1 MW'
     )
-    fleet_activity['reference product'] = 'onshore wind turbine fleet, 1 MW'
-    fleet_activity.save()
-    new_ex = fleet_activity.new_exchange(input=fleet_activity.key, type='production', amount=1)
-    new_ex.save()
     # add inputs
-    for turbine, info in fleet_turbines_definition.items():
+    for (turbine, info), park_name in zip(fleet_turbines_definition.items(), park_names):
         share = info[1]
         turbine_parameters = info[0]
-        park_name = f'{turbine}_{turbine_parameters["power"]}_{location}'
         single_turbine_activity = bd.Database('additional_acts').get(park_name + '_single_turbine')
         # to fleet activity (infrastructure)
         new_ex = fleet_activity.new_exchange(input=single_turbine_activity, type='technosphere',
@@ -2237,21 +2244,13 @@ def wind_onshore_fleet(db_wind_name: str, location: str,
         new_ex.save()
 
     # create wind fleet maintenance (per 1 kWh)
-    fleet_activity = bd.Database('additional_acts').new_activity(
-        name=f'onshore wind turbine fleet, 1 kWh, maintenance, for enbios, {location}',
+    fleet_activity = fleet_members.aggregation_activity(
         code=f'onshore wind turbine fleet, 1 kWh, maintenance, for enbios, {location}',
-        unit='unit',
-        location=location
+        name=f'onshore wind turbine fleet, 1 kWh, maintenance, for enbios, {location}',
+        location=location, unit='unit', reference_product='onshore wind turbine fleet maintenance, 1 kWh'
     )
-    fleet_activity['reference product'] = 'onshore wind turbine fleet maintenance, 1 kWh'
-    fleet_activity.save()
-    new_ex = fleet_activity.new_exchange(input=fleet_activity.key, type='production', amount=1)
-    new_ex.save()
     # add inputs
-    for turbine, info in fleet_turbines_definition.items():
-        share = info[1]
-        turbine_parameters = info[0]
-        park_name = f'{turbine}_{turbine_parameters["power"]}_{location}'
+    for park_name in park_names:
         turbine_activity = bd.Database('additional_acts').get(park_name + '_turbine_kwh')
         # to fleet activity (infrastructure)
         new_ex = fleet_activity.new_exchange(input=turbine_activity, type='technosphere',
@@ -2261,6 +2260,8 @@ def wind_onshore_fleet(db_wind_name: str, location: str,
     return park_names
 
 
+@buffered_writes
+@traced
 def wind_offshore_fleet(db_wind_name: str, location: str,
                         fleet_turbines_definition: Dict[str, List[Union[Dict[str, Any], float]]]
                         ):
@@ -2289,99 +2290,82 @@ def wind_offshore_fleet(db_wind_name: str, location: str,
     expected_keys = {'power', 'manufacturer', 'rotor_diameter', 'hub_height', 'commissioning_year',
                      'generator_type', 'recycled_share_steel', 'lifetime', 'eol_scenario', 'offshore_type',
                      'floating_platform', 'sea_depth', 'distance_to_shore'}
+    # each turbine is identified by its parameters: turbines built before (in this or another fleet) are reused
     park_names = []
+    members = {}
     for turbine, info in fleet_turbines_definition.items():
         turbine_parameters = info[0]
-        if turbine_parameters['offshore_type'] == 'floating':
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["floating_platform"]}_{location}'
-        else:
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["offshore_type"]}_{location}'
-        park_names.append(park_name)
         if turbine_parameters.keys() != expected_keys:
             raise ValueError(f'The keys introduced {turbine_parameters.keys()} do not match '
                              f'the expected keys {expected_keys}')
-    try:
-        # Check if lengths match, meaning no duplicates
-        if len(park_names) == len(list(set(park_names))):
-            print("No duplicates found in park names")
-        else:
-            print("Park name duplicates found. Try other names")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        sys.exit()
-
-    # create individual turbines
-    for turbine, info in fleet_turbines_definition.items():
-        turbine_parameters = info[0]
+        content_hash = fleet_members.member_hash('offshore wind turbine', location=location, database=db_wind_name,
+                                                 **turbine_parameters)
         if turbine_parameters['offshore_type'] == 'floating':
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["floating_platform"]}_{location}'
+            park_name = (f'offshore_{turbine_parameters["power"]}_{turbine_parameters["floating_platform"]}_'
+                         f'{location}_{content_hash}')
         else:
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["offshore_type"]}_{location}'
-        WindTrace_offshore.lci_offshore_turbine(
-            new_db=bd.Database('additional_acts'), cutoff391=bd.Database(db_wind_name),
-            biosphere3=bd.Database('biosphere3'),
-            park_name=park_name, park_power=turbine_parameters['power'], number_of_turbines=1,
-            park_location=location, park_coordinates=(51.181, 13.655),
-            manufacturer=turbine_parameters['manufacturer'], rotor_diameter=turbine_parameters['rotor_diameter'],
-            turbine_power=turbine_parameters['power'], hub_height=turbine_parameters['hub_height'],
-            commissioning_year=turbine_parameters['commissioning_year'],
-            generator_type=turbine_parameters['generator_type'],
-            recycled_share_steel=turbine_parameters['recycled_share_steel'],
-            lifetime=turbine_parameters['lifetime'], scenario=turbine_parameters['eol_scenario'],
-            sea_depth=turbine_parameters['sea_depth'], distance_to_shore=turbine_parameters['distance_to_shore'],
-            offshore_type=turbine_parameters['offshore_type'],
-            floating_platform=turbine_parameters['floating_platform']
-        )
+            park_name = (f'offshore_{turbine_parameters["power"]}_{turbine_parameters["offshore_type"]}_'
+                         f'{location}_{content_hash}')
+        park_names.append(park_name)
+        members[park_name] = (turbine_parameters, content_hash)
 
-    # create fleet activity
-    fleet_activity = bd.Database('additional_acts').new_activity(
-        name=f'offshore wind turbine fleet, 1 MW, for enbios, {location}',
+    # create individual turbines (all of them share the same index of the ecoinvent database)
+    ei_index = None
+    for park_name, (turbine_parameters, content_hash) in members.items():
+        if fleet_members.reusable_park(park_name, content_hash):
+            print(f'Reusing turbine {park_name}')
+            continue
+        if ei_index is None:
+            ei_index = WindTrace_onshore.get_bw_index(bd.Database(db_wind_name))
+        with span('lci_offshore_turbine', park=park_name):
+            WindTrace_offshore.lci_offshore_turbine(
+                new_db=bd.Database('additional_acts'), cutoff391=bd.Database(db_wind_name),
+                biosphere3=bd.Database('biosphere3'),
+                park_name=park_name, park_power=turbine_parameters['power'], number_of_turbines=1,
+                park_location=location, park_coordinates=(51.181, 13.655),
+                manufacturer=turbine_parameters['manufacturer'], rotor_diameter=turbine_parameters['rotor_diameter'],
+                turbine_power=turbine_parameters['power'], hub_height=turbine_parameters['hub_height'],
+                commissioning_year=turbine_parameters['commissioning_year'],
+                generator_type=turbine_parameters['generator_type'],
+                recycled_share_steel=turbine_parameters['recycled_share_steel'],
+                lifetime=turbine_parameters['lifetime'], scenario=turbine_parameters['eol_scenario'],
+                sea_depth=turbine_parameters['sea_depth'], distance_to_shore=turbine_parameters['distance_to_shore'],
+                offshore_type=turbine_parameters['offshore_type'],
+                floating_platform=turbine_parameters['floating_platform'], ei_index=ei_index
+            )
+        # delete maintenance
+        maintenance_activity = bd.Database('additional_acts').get(park_name + '_offshore_maintenance')
+        ex = list(maintenance_activity.upstream())
+        for e in ex:
+            e.delete()
+        fleet_members.mark_park(park_name, content_hash)
+
+    # create fleet activity (only its inputs are written again if it already exists)
+    fleet_activity = fleet_members.aggregation_activity(
         code=f'offshore wind turbine fleet, 1 MW, for enbios, {location}',
-        unit='unit',
-        location=location
+        name=f'offshore wind turbine fleet, 1 MW, for enbios, {location}',
+        location=location, unit='unit', reference_product='offshore wind turbine fleet, 1 MW'
     )
-    fleet_activity['reference product'] = 'offshore wind turbine fleet, 1 MW'
-    fleet_activity.save()
-    new_ex = fleet_activity.new_exchange(input=fleet_activity.key, type='production', amount=1)
-    new_ex.save()
     # add inputs
-    for turbine, info in fleet_turbines_definition.items():
+    for (turbine, info), park_name in zip(fleet_turbines_definition.items(), park_names):
         share = info[1]
         turbine_parameters = info[0]
-        if turbine_parameters['offshore_type'] == 'floating':
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["floating_platform"]}_{location}'
-        else:
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["offshore_type"]}_{location}'
         single_turbine_activity = bd.Database('additional_acts').get(park_name + '_offshore_turbine')
         # to fleet activity (infrastructure)
         new_ex = fleet_activity.new_exchange(input=single_turbine_activity, type='technosphere',
                                              amount=share / turbine_parameters["power"])
         new_ex.save()
-        # delete maintenance
-        maintenance_activity = bd.Database('additional_acts').get(park_name + '_offshore_maintenance')
-        ex = list(maintenance_activity.upstream())
-        for e in ex:
-            e.delete()
 
     # create wind fleet maintenance (per 1 MW)
-    fleet_activity = bd.Database('additional_acts').new_activity(
-        name=f'offshore wind turbine fleet, 1 MW, maintenance, for enbios, {location}',
+    fleet_activity = fleet_members.aggregation_activity(
         code=f'offshore wind turbine fleet, 1 MW, maintenance, for enbios, {location}',
-        unit='unit',
-        location=location
+        name=f'offshore wind turbine fleet, 1 MW, maintenance, for enbios, {location}',
+        location=location, unit='unit', reference_product='offshore wind turbine fleet maintenance, 1 MW'
     )
-    fleet_activity['reference product'] = 'offshore wind turbine fleet maintenance, 1 MW'
-    fleet_activity.save()
-    new_ex = fleet_activity.new_exchange(input=fleet_activity.key, type='production', amount=1)
-    new_ex.save()
     # add inputs
-    for turbine, info in fleet_turbines_definition.items():
+    for (turbine, info), park_name in zip(fleet_turbines_definition.items(), park_names):
         share = info[1]
         turbine_parameters = info[0]
-        if turbine_parameters['offshore_type'] == 'floating':
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["floating_platform"]}_{location}'
-        else:
-            park_name = f'{turbine}_{turbine_parameters["power"]}_{turbine_parameters["offshore_type"]}_{location}'
         maintenance_activity = bd.Database('additional_acts').get(park_name + '_offshore_maintenance')
         # to fleet activity (infrastructure)
         new_ex = fleet_activity.new_exchange(input=maintenance_activity, type='technosphere',
@@ -2392,6 +2376,8 @@ def wind_offshore_fleet(db_wind_name: str, location: str,
 
 
 # solar_pv
+@buffered_writes
+@traced
 def solar_pv_fleet(db_solar_name: str,
                    open_technology_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND['openground'],
                    roof_technology_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND["rooftop_power_share"],
@@ -2452,21 +2438,18 @@ def solar_pv_fleet(db_solar_name: str,
         raise ValueError(f"each technology share must sum 1")
 
     # open ground
-    open_fleet_activity = bd.Database('additional_acts').new_activity(
-        name='photovoltaic, open ground, 570 kWp, for enbios',
+    open_fleet_activity = fleet_members.aggregation_activity(
         code='photovoltaic, open ground, 570 kWp, for enbios',
+        name='photovoltaic, open ground, 570 kWp, for enbios',
         location='RER',
         unit='unit',
+        reference_product='photovoltaic, open ground, 570 kWp',
         comment=f'technology share: {open_technology_share}'
     )
-    open_fleet_activity['reference product'] = 'photovoltaic, open ground, 570 kWp'
-    open_fleet_activity.save()
-    production_ex = open_fleet_activity.new_exchange(input=open_fleet_activity.key, type='production', amount=1)
-    production_ex.save()
 
-    open_pv = list(ws.get_many(bd.Database(db_solar_name),
-                               ws.contains('name', 'photovoltaic open ground installation'),
-                               ws.contains('location',
+    open_pv = list(ix.get_many(db_solar_name,
+                               ix.contains('name', 'photovoltaic open ground installation'),
+                               ix.contains('location',
                                            'RER')))  # CdTe, CIS, micro-Si, multi-Si, single-Si (all 570 kWp)
 
     tech_to_activity = {tech: act for act in open_pv for tech in open_technology_share.keys() if tech in act['name']}
@@ -2478,66 +2461,54 @@ def solar_pv_fleet(db_solar_name: str,
 
     # roof
     # slanted-roof
-    roof_pv_3kw = ws.get_many(bd.Database(db_solar_name), ws.contains('name', 'photovoltaic'),
-                              ws.contains('name', 'panel, mounted, on roof'),
-                              ws.exclude(ws.contains('name', '1.3 MWp')),
-                              ws.exclude(ws.contains('name', '93')),
-                              ws.equals('location', 'CH'))
-    roof_pv_93kw = ws.get_many(bd.Database(db_solar_name), ws.contains('name', 'photovoltaic'),
-                               ws.contains('name', 'panel, mounted, on roof'),
-                               ws.contains('name', '93 kWp'),
-                               ws.equals('location', 'CH'))
+    roof_pv_3kw = ix.get_many(db_solar_name, ix.contains('name', 'photovoltaic'),
+                              ix.contains('name', 'panel, mounted, on roof'),
+                              ix.exclude(ix.contains('name', '1.3 MWp')),
+                              ix.exclude(ix.contains('name', '93')),
+                              ix.equals('location', 'CH'))
+    roof_pv_93kw = ix.get_many(db_solar_name, ix.contains('name', 'photovoltaic'),
+                               ix.contains('name', 'panel, mounted, on roof'),
+                               ix.contains('name', '93 kWp'),
+                               ix.equals('location', 'CH'))
     # flat roof
-    roof_pv_156kw = ws.get_many(bd.Database(db_solar_name), ws.contains('name', '156'),
-                                ws.contains('name', 'on roof'), ws.equals('location', 'CH'))
-    roof_pv_280kw = ws.get_many(bd.Database(db_solar_name), ws.contains('name', '280'),
-                                ws.contains('name', 'on roof'), ws.equals('location', 'CH'))
+    roof_pv_156kw = ix.get_many(db_solar_name, ix.contains('name', '156'),
+                                ix.contains('name', 'on roof'), ix.equals('location', 'CH'))
+    roof_pv_280kw = ix.get_many(db_solar_name, ix.contains('name', '280'),
+                                ix.contains('name', 'on roof'), ix.equals('location', 'CH'))
 
     # create 3 kWp, 93 kWp, 156 kWp, and 280 kWp activities
-    act_3kw_fleet = bd.Database('additional_acts').new_activity(
-        name='photovoltaic slanted-roof installation, 3kWp, fleet',
+    act_3kw_fleet = fleet_members.aggregation_activity(
         code='photovoltaic slanted-roof installation, 3kWp, fleet',
+        name='photovoltaic slanted-roof installation, 3kWp, fleet',
         location='RER',
         unit='unit',
+        reference_product='photovoltaic slanted-roof installation, 3kWp, fleet',
         comment=f'technology share: {roof_3kw_share}'
     )
-    act_3kw_fleet['reference product'] = 'photovoltaic slanted-roof installation, 3kWp, fleet'
-    act_3kw_fleet.save()
-    production_ex = act_3kw_fleet.new_exchange(input=act_3kw_fleet.key, type='production', amount=1)
-    production_ex.save()
-    act_93kw_fleet = bd.Database('additional_acts').new_activity(
-        name='photovoltaic slanted-roof installation, 93kWp, fleet',
+    act_93kw_fleet = fleet_members.aggregation_activity(
         code='photovoltaic slanted-roof installation, 93kWp, fleet',
+        name='photovoltaic slanted-roof installation, 93kWp, fleet',
         location='RER',
         unit='unit',
+        reference_product='photovoltaic slanted-roof installation, 93kWp, fleet',
         comment=f'technology share: {roof_93kw_share}'
     )
-    act_93kw_fleet['reference product'] = 'photovoltaic slanted-roof installation, 93kWp, fleet'
-    act_93kw_fleet.save()
-    production_ex = act_93kw_fleet.new_exchange(input=act_93kw_fleet.key, type='production', amount=1)
-    production_ex.save()
-    act_156kw_fleet = bd.Database('additional_acts').new_activity(
-        name='photovoltaic slanted-roof installation, 156kWp, fleet',
+    act_156kw_fleet = fleet_members.aggregation_activity(
         code='photovoltaic slanted-roof installation, 156kWp, fleet',
+        name='photovoltaic slanted-roof installation, 156kWp, fleet',
         location='RER',
         unit='unit',
+        reference_product='photovoltaic slanted-roof installation, 156kWp, fleet',
         comment=f'technology share: {roof_156kw_share}'
     )
-    act_156kw_fleet['reference product'] = 'photovoltaic slanted-roof installation, 156kWp, fleet'
-    act_156kw_fleet.save()
-    production_ex = act_156kw_fleet.new_exchange(input=act_156kw_fleet.key, type='production', amount=1)
-    production_ex.save()
-    act_280kw_fleet = bd.Database('additional_acts').new_activity(
-        name='photovoltaic slanted-roof installation, 280kWp, fleet',
+    act_280kw_fleet = fleet_members.aggregation_activity(
         code='photovoltaic slanted-roof installation, 280kWp, fleet',
+        name='photovoltaic slanted-roof installation, 280kWp, fleet',
         location='RER',
         unit='unit',
+        reference_product='photovoltaic slanted-roof installation, 280kWp, fleet',
         comment=f'technology share: {roof_280kw_share}'
     )
-    act_280kw_fleet['reference product'] = 'photovoltaic slanted-roof installation, 280kWp, fleet'
-    act_280kw_fleet.save()
-    production_ex = act_280kw_fleet.new_exchange(input=act_280kw_fleet.key, type='production', amount=1)
-    production_ex.save()
 
     # add inputs to 3 KWp, 93 kWp, 156 kWp, and 280 kWp activities
     tech_to_3kw_activity = {tech: act for act in roof_pv_3kw for tech in roof_3kw_share.keys() if
@@ -2570,19 +2541,16 @@ def solar_pv_fleet(db_solar_name: str,
             new_ex.save()
 
     # create roof activity (which contains 3kWp, 93kWp, 156kWp, and 280kWp)
-    act_roof_fleet = bd.Database('additional_acts').new_activity(
-        name='photovoltaic slanted-roof installation, 1MW, fleet, for enbios',
+    act_roof_fleet = fleet_members.aggregation_activity(
         code='photovoltaic slanted-roof installation, 1MW, fleet, for enbios',
+        name='photovoltaic slanted-roof installation, 1MW, fleet, for enbios',
         location='RER',
         unit='unit',
+        reference_product='photovoltaic slanted-roof installation, 1MW, fleet',
         comment=f'Equivalent to 1MW. Technology share: {roof_technology_share}. '
                 f'93kWp: {roof_93kw_share}, 3kWp: {roof_3kw_share}, 156kWp: {roof_156kw_share}, '
                 f'280kWp: {roof_280kw_share}'
     )
-    act_roof_fleet['reference product'] = 'photovoltaic slanted-roof installation, 1MW, fleet'
-    act_roof_fleet.save()
-    production_ex = act_roof_fleet.new_exchange(input=act_roof_fleet.key, type='production', amount=1)
-    production_ex.save()
     # add inputs from 3kWp, 93kWp, 156kWp, and 280kWp fleets
     new_ex = act_roof_fleet.new_exchange(
         input=act_3kw_fleet, type='technosphere', amount=roof_technology_share['3kWp'] * 1000 / 3
@@ -2604,6 +2572,8 @@ def solar_pv_fleet(db_solar_name: str,
 
 
 # batteries
+@buffered_writes
+@traced
 def batteries_fleet(db_batteries_name: str, current_share: bool,
                     technology_share: Optional[Dict[str, float]] = None):
     """
@@ -2629,10 +2599,11 @@ def batteries_fleet(db_batteries_name: str, current_share: bool,
         technology_share = None
 
     if current_share:
-        battery_fleet_original = ws.get_one(bd.Database(db_batteries_name),
-                                            ws.equals('name',
+        battery_fleet_original = ix.get_one(db_batteries_name,
+                                            ix.equals('name',
                                                       'market for battery capacity, stationary (CONT scenario)'))
-        battery_fleet = battery_fleet_original.copy(database='additional_acts')
+        battery_fleet = fleet_members.aggregation_copy(
+            battery_fleet_original, country_expansion.copy_code(battery_fleet_original.key, 'additional_acts'))
     else:
         print(f'Manual battery scenario with the following technology shares: {technology_share}')
         # Runtime check to enforce battery types as keys
@@ -2645,11 +2616,11 @@ def batteries_fleet(db_batteries_name: str, current_share: bool,
 
         # create manual battery scenario
         create_additional_acts_db()
-        battery_original = ws.get_one(bd.Database(db_batteries_name),
-                                      ws.equals('name', 'market for battery capacity, stationary (TC scenario)'))
-        battery_fleet = battery_original.copy(database='additional_acts')
-        battery_fleet['name'] = 'market for battery capacity, stationary (manual scenario), for enbios'
-        battery_fleet.save()
+        battery_original = ix.get_one(db_batteries_name,
+                                      ix.equals('name', 'market for battery capacity, stationary (TC scenario)'))
+        battery_fleet = fleet_members.aggregation_copy(
+            battery_original, 'market for battery capacity, stationary (manual scenario), for enbios',
+            name='market for battery capacity, stationary (manual scenario), for enbios')
 
         battery_type_to_exchange = {battery_type: ex for ex in battery_fleet.technosphere() for battery_type in
                                     technology_share.keys() if battery_type in ex.input['name']}
@@ -2668,6 +2639,8 @@ def batteries_fleet(db_batteries_name: str, current_share: bool,
 
 
 # electrolysis
+@buffered_writes
+@traced
 def hydrogen_from_electrolysis_market(db_hydrogen_name: str, soec_share: float, aec_share: float, pem_share: float):
     """
     ´´soec_share´´, ´´aec_share´´´and ´´pem_share´´ need to be shares between 0 and 1, summing 1 in total.
@@ -2676,27 +2649,22 @@ def hydrogen_from_electrolysis_market(db_hydrogen_name: str, soec_share: float,
     """
     print('Creating electrolyser fleets')
     if (soec_share + aec_share + pem_share) != 1:
-        print(f'your inputs for soc ({soec_share}), aec ({aec_share}) and pem ({pem_share}) do not sum 1. '
-              f'They sum {soec_share + aec_share + pem_share}. Try a combination that sums 1)')
-        sys.exit()
+        raise ValueError(f'your inputs for soc ({soec_share}), aec ({aec_share}) and pem ({pem_share}) do not sum 1. '
+                         f'They sum {soec_share + aec_share + pem_share}. Try a combination that sums 1)')
 
     create_additional_acts_db()
 
     # create markets
-    electrolysers_market_act = bd.Database('additional_acts').new_activity(
-        name='electrolyser, fleet, 1 MWh/h, for enbios',
+    electrolysers_market_act = fleet_members.aggregation_activity(
         code='electrolyser, fleet, 1 MWh/h, for enbios',
+        name='electrolyser, fleet, 1 MWh/h, for enbios',
         location='RER',
         unit='kilowatt',
+        reference_product='electrolyser, fleet, 1 MWh/h',
         comment=f'aec: {aec_share * 100}%, '
                 f'pem: {pem_share * 100}%,'
                 f'soec: {soec_share * 100}%'
     )
-    electrolysers_market_act['reference product'] = 'electrolyser, fleet, 1 MWh/h'
-    electrolysers_market_act.save()
-    production_exchange = electrolysers_market_act.new_exchange(input=electrolysers_market_act.key, type='production',
-                                                                amount=1)
-    production_exchange.save()
     for electrolyser_type in ['AEC', 'SOEC', 'PEM']:
         # create individual hydrogen production activities per MWh/h of H2
         electrolyser_act = hydrogen_production_act_in_mwh_per_hour(electrolyser_name=electrolyser_type,
@@ -2717,7 +2685,13 @@ def hydrogen_production_act_in_mwh_per_hour(electrolyser_name: str, db_hydrogen_
     """
     :return: it creates individual hydrogen production activities per MWh/h of H2 instead of per kg of H2, using LHV
     it also creates a fleet for hydrogen production per MWh/h
+    The activity is reused if it was already created from the same database.
     """
+    content_hash = fleet_members.member_hash('electrolyser', type=electrolyser_name, database=db_hydrogen_name)
+    electrolyser_act = fleet_members.reusable_member(f'{electrolyser_name} electrolyser, production capacity 1 MWh/h',
+                                                     content_hash)
+    if electrolyser_act is not None:
+        return electrolyser_act
     # electrolysers (infrastructure)
     electrolyser_act = bd.Database('additional_acts').new_activity(
         name=f'{electrolyser_name} electrolyser, production capacity 1 MWh/h',
@@ -2732,10 +2706,10 @@ def hydrogen_production_act_in_mwh_per_hour(electrolyser_name: str, db_hydrogen_
     production_exchange.save()
 
     # add technosphere exchanges
-    electrolysers_acts = ws.get_many(bd.Database(db_hydrogen_name),
-                                     ws.contains('name', electrolyser_name),
-                                     ws.contains('name', '1MWe'),
-                                     ws.equals('location', 'RER')
+    electrolysers_acts = ix.get_many(db_hydrogen_name,
+                                     ix.contains('name', electrolyser_name),
+                                     ix.contains('name', '1MWe'),
+                                     ix.equals('location', 'RER')
                                      )
     lifetime_production = {'AEC': 3085961, 'SOEC': 3779894, 'PEM': 2964315}  # in kg, through the 20 years lifetime
     for act in electrolysers_acts:
@@ -2766,12 +2740,12 @@ def hydrogen_production_act_in_mwh_per_hour(electrolyser_name: str, db_hydrogen_
                 )
                 new_ex.save()
     # add biosphere exchanges
-    transformation_acts = ws.get_many(bd.Database('biosphere3'),
-                                      ws.contains('name', 'Transformation,'),
-                                      ws.contains('name', 'industrial area')
+    transformation_acts = ix.get_many('biosphere3',
+                                      ix.contains('name', 'Transformation,'),
+                                      ix.contains('name', 'industrial area')
                                       )
-    occupation_act = ws.get_one(bd.Database('biosphere3'),
-                                ws.equals('name', 'Occupation, industrial area'))
+    occupation_act = ix.get_one('biosphere3',
+                                ix.equals('name', 'Occupation, industrial area'))
     for act in transformation_acts:
         new_ex = electrolyser_act.new_exchange(input=act, type='biosphere', amount=1 / 120)
         new_ex.save()
@@ -2779,6 +2753,7 @@ def hydrogen_production_act_in_mwh_per_hour(electrolyser_name: str, db_hydrogen_
         input=occupation_act, type='biosphere',
         amount=1 / (120 * 27.5))  # although the original dataset assumes 20 years, PREMISE assumes 27.5
     new_ex.save()
+    fleet_members.mark_member(electrolyser_act, content_hash)
 
     return electrolyser_act
 
@@ -2791,16 +2766,18 @@ def hydrogen_production_update(db_hydrogen_production_name: str, soec_share: flo
     create_additional_acts_db()
     tech_acts = {}
     for tech in ['AEC', 'SOEC', 'PEM']:
-        hydrogen_act = ws.get_one(bd.Database(db_hydrogen_production_name),
-                                  ws.contains('name', 'hydrogen production, gaseous'),
-                                  ws.contains('name', tech),
-                                  ws.exclude(ws.contains('name', 'steam')))
-        new_act = hydrogen_act.copy(database='additional_acts')
-        new_act.save()
-        land_use = [e for e in new_act.biosphere() if
-                    any(keyword in e.input._data['name'] for keyword in ['Transformation', 'Occupation'])]
-        for e in land_use:
-            e.delete()
+        hydrogen_act = ix.get_one(db_hydrogen_production_name,
+                                  ix.contains('name', 'hydrogen production, gaseous'),
+                                  ix.contains('name', tech),
+                                  ix.exclude(ix.contains('name', 'steam')))
+        content_hash = fleet_members.member_hash('hydrogen production', key=hydrogen_act.key)
+        new_act, reused = fleet_members.member_copy(hydrogen_act, content_hash)
+        if not reused:
+            land_use = [e for e in new_act.biosphere() if
+                        any(keyword in e.input._data['name'] for keyword in ['Transformation', 'Occupation'])]
+            for e in land_use:
+                e.delete()
+            fleet_members.mark_member(new_act, content_hash)
         if tech == 'AEC':
             tech_acts[new_act] = aec_share
         elif tech == 'SOEC':
@@ -2809,336 +2786,71 @@ def hydrogen_production_update(db_hydrogen_production_name: str, soec_share: flo
             tech_acts[new_act] = pem_share
 
     # create hydrogen production with fleet
-    new_act = bd.Database('additional_acts').new_activity(
-        name='hydrogen production, from electrolyser fleet, for enbios',
+    new_act = fleet_members.aggregation_activity(
         code='hydrogen production, from electrolyser fleet, for enbios',
+        name='hydrogen production, from electrolyser fleet, for enbios',
         location='RER',
         unit='kilogram',
+        reference_product='hydrogen, gaseous',
         comment=f'aec: {aec_share * 100}%, '
                 f'pem: {pem_share * 100}%,'
                 f'soec: {soec_share * 100}%'
     )
-    new_act['reference product'] = 'hydrogen, gaseous'
-    new_act.save()
-
-    new_ex = new_act.new_exchange(input=new_act.key, type='production', amount=1)
-    new_ex.save()
     for act, share in tech_acts.items():
         new_ex = new_act.new_exchange(input=act, type='technosphere', amount=share)
         new_ex.save()
 
 
-def collect_biosphere_flows(activity, scaling_factor=1, specific_inputs=None, current_tier=0, tier_limit=2):
-    """
-    Collects biosphere flows and biosphere exchanges up to a specified tier depth.
-    Parameters:
-    - activity: Brightway activity whose flows are analyzed.
-    - scaling_factor: Float, used to scale amounts of flows.
-    - specific_inputs: List of names of technosphere inputs to include.
-    - current_tier: Int, depth of recursion.
-    - tier_limit: Int, maximum depth for recursive search.
-    Returns:
-    - biosphere_flows: List of tuples, each containing (biosphere flow, scaled amount).
-    - biosphere_exchanges: List of biosphere exchanges collected.
-    """
-    # Check if the current tier exceeds the limit
-    if current_tier > tier_limit:
-        return [], []
-    biosphere_flows = []
-    biosphere_exchanges = []
-    for exc in activity.exchanges():
-        if exc['type'] == 'biosphere':
-            # Collect biosphere flow with scaling
-            biosphere_flows.append((exc.input, exc.amount * scaling_factor))
-            biosphere_exchanges.append(exc)
-        elif specific_inputs and exc.input['name'] in specific_inputs and exc['type'] == 'technosphere':
-            # If input is in specific_inputs and within tier limit, collect its contributions
-            new_scaling_factor = exc.amount * scaling_factor
-            nested_flows, nested_exchanges = collect_biosphere_flows(
-                exc.input,
-                new_scaling_factor,
-                specific_inputs,
-                current_tier + 1,
-                tier_limit
-            )
-            biosphere_flows.extend(nested_flows)
-            biosphere_exchanges.extend(nested_exchanges)
-    return biosphere_flows, biosphere_exchanges
-
-
-def aggregate_flows(biosphere_flows):
-    # Use defaultdict to sum amounts for each unique biosphere flow
-    aggregated_flows = defaultdict(float)
-    for flow, amount in biosphere_flows:
-        aggregated_flows[flow] += amount
-    # Convert back to list of tuples for final result
-    return list(aggregated_flows.items())
-
-
-def aggregate_technosphere_inputs(activity, scaling_factor=1, specific_inputs=None, current_tier=0, tier_limit=2):
-    """
-    Aggregates technosphere flows up to a specified tier depth, ensuring all inputs
-    from the deepest tier are included, and filtering intermediate tiers by `specific_inputs`.
-    Some inputs (e.g., `always_include`) are added directly to the results if not in tier 0.
-    Parameters:
-    - activity: Brightway activity to analyze.
-    - scaling_factor: Float, scales the amount of flows.
-    - specific_inputs: List of names of technosphere inputs to explore specifically.
-    - current_tier: Int, current depth of recursion.
-    - tier_limit: Int, maximum depth for recursive search.
-    Returns:
-    - aggregated_flows: Dictionary with aggregated inputs and their scaled amounts.
-    """
-    if current_tier > tier_limit:
-        return {}
-    aggregated_flows = {}
-    # List of inputs that must be directly included in the results
-    always_include = [
-        "hydrogen production, gaseous, 30 bar, from PEM electrolysis, from grid electricity",
-        "market group for electricity, low voltage",
-        "hydrogen production, gaseous, 25 bar, from gasification of woody biomass in entrained flow gasifier, "
-        "at gasification plant"
-    ]
-    for exc in activity.exchanges():
-        if exc['type'] == 'technosphere':
-            # Scale the current input amount
-            scaled_amount = exc.amount * scaling_factor
-            if exc.input['name'] in always_include and current_tier != 0:
-                # Add `always_include` inputs directly to results if not in tier 0
-                if exc.input in aggregated_flows:
-                    aggregated_flows[exc.input] += scaled_amount
-                else:
-                    aggregated_flows[exc.input] = scaled_amount
-                continue  # Do not explore these inputs further
-            if current_tier == tier_limit:
-                # Add inputs directly at the last tier
-                if exc.input in aggregated_flows:
-                    aggregated_flows[exc.input] += scaled_amount
-                else:
-                    aggregated_flows[exc.input] = scaled_amount
-            else:
-                # Check if input should be included based on specific_inputs
-                if specific_inputs and exc.input['name'] not in specific_inputs:
-                    print(f"Skipping {exc.input['name']} at tier {current_tier}")
-                    continue
-                print(f"Exploring {exc.input['name']} at tier {current_tier}")
-                # Recursively explore deeper tiers
-                nested_flows = aggregate_technosphere_inputs(
-                    exc.input,
-                    scaling_factor=scaled_amount,
-                    specific_inputs=specific_inputs,
-                    current_tier=current_tier + 1,
-                    tier_limit=tier_limit
-                )
-                # Merge nested flows into aggregated flows
-                for key, value in nested_flows.items():
-                    if key in aggregated_flows:
-                        aggregated_flows[key] += value
-                    else:
-                        aggregated_flows[key] = value
-    return aggregated_flows
-
-
-def rebuild_acts(act, specific_inputs=None, tier_limit=3):
-    """
-    It reconstructs the diesel and kerosene acts, so it includes what previously was in all tiers of
-    fuel production into tier 0.
-    """
-    # deal with the technosphere
-    updated_act = act.copy(database='additional_acts')
-    print(f'{updated_act["name"]}copy created in additional_acts')
-    for ex in updated_act.technosphere():
-        if ex.input['name'] == specific_inputs[0]:
-            ex.delete()
-            print(f'deleted {ex.input["name"]} input')
-    aggregated_flows = aggregate_technosphere_inputs(
-        activity=act, specific_inputs=specific_inputs, tier_limit=tier_limit)
-    for activity, amount in aggregated_flows.items():
-        new_ex = updated_act.new_exchange(input=activity, amount=amount, type='technosphere')
-        new_ex.save()
-        print(f'adding act: {activity}, amount: {amount}')
-    # deal with the biosphere
-    if act[
-        'name'] == 'diesel production, synthetic, from Fischer Tropsch process, hydrogen from wood gasification, energy allocation, at fuelling station':
-        print('dealing with the biosphere')
-        bioflows, bioexchanges = collect_biosphere_flows(
-            activity=act,
-            tier_limit=3,
-            specific_inputs=[
-                'diesel production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
-                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
-                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'
-            ]
-        )
-        bioflows_gruped = aggregate_flows(bioflows)
-        updated_act.biosphere().delete()
-        print('biosphere deleted')
-        for flow in bioflows_gruped:
-            new_ex = updated_act.new_exchange(input=flow[0], type='biosphere', amount=flow[1])
-            new_ex.save()
-            print(f'adding flow: {flow[0]["name"]}, amount: {flow[1]}')
-    elif act[
-        'name'] == 'diesel production, synthetic, from Fischer Tropsch process, hydrogen from electrolysis, energy allocation, at fuelling station':
-        bioflows, bioexchanges = collect_biosphere_flows(
-            activity=act,
-            tier_limit=1,
-            specific_inputs=[
-                'diesel production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation',
-            ]
-        )
-        bioflows_gruped = aggregate_flows(bioflows)
-        updated_act.biosphere().delete()
-        for flow in bioflows_gruped:
-            new_ex = updated_act.new_exchange(input=flow[0], type='biosphere', amount=flow[1])
-            new_ex.save()
-    elif act[
-        'name'] == 'kerosene production, synthetic, from Fischer Tropsch process, hydrogen from wood gasification, energy allocation, at fuelling station':
-        bioflows, bioexchanges = collect_biosphere_flows(
-            activity=act,
-            tier_limit=3,
-            specific_inputs=[
-                'kerosene production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
-                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
-                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'
-            ]
-        )
-        bioflows_gruped = aggregate_flows(bioflows)
-        updated_act.biosphere().delete()
-        for flow in bioflows_gruped:
-            new_ex = updated_act.new_exchange(input=flow[0], type='biosphere', amount=flow[1])
-            new_ex.save()
-    elif act[
-        'name'] == 'kerosene production, synthetic, from Fischer Tropsch process, hydrogen from electrolysis, energy allocation, at fuelling station':
-        bioflows, bioexchanges = collect_biosphere_flows(
-            activity=act,
-            tier_limit=1,
-            specific_inputs=[
-                'kerosene production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation',
-            ]
-        )
-        bioflows_gruped = aggregate_flows(bioflows)
-        updated_act.biosphere().delete()
-        for flow in bioflows_gruped:
-            new_ex = updated_act.new_exchange(input=flow[0], type='biosphere', amount=flow[1])
-            new_ex.save()
-
-
+@traced
 def rebuild_kerosene_and_diesel_acts():
     """
     diesel and kerosene at fuelling station is produced from hydrogen, which is synthesised either via wood gasification
     or electrolysis. The process involves several steps, separated into different activities in premise_base. These
     include carbon monoxide production, followed by syngas production, followed by kerosene production and finally
     kerosene at fuelling station. This function puts all the value chain together (both technosphere and biosphere) in
-    one single activity, which will be located in additional_acts.
+    one single activity, which will be located in additional_acts. The chains are defined in
+    config_parameters.FT_FUEL_CHAINS and collapsed together (see chain_collapse.py).
     """
-    diesel_wood = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'diesel production, synthetic, from Fischer Tropsch process, '
-                          'hydrogen from wood gasification, energy allocation, at fuelling station')
-    )
-    diesel_electrolysis = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'diesel production, synthetic, from Fischer Tropsch process, '
-                          'hydrogen from electrolysis, energy allocation, at fuelling station')
-    )
-    kerosene_wood = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'kerosene production, synthetic, from Fischer Tropsch process, '
-                          'hydrogen from wood gasification, energy allocation, at fuelling station')
-    )
-    kerosene_electrolysis = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'kerosene production, synthetic, from Fischer Tropsch process, '
-                          'hydrogen from electrolysis, energy allocation, at fuelling station')
-    )
-    for act in [diesel_wood, diesel_electrolysis, kerosene_wood, kerosene_electrolysis]:
-        if act['name'] == ('diesel production, synthetic, from Fischer Tropsch process, '
-                           'hydrogen from wood gasification, energy allocation, at fuelling station'):
-            rebuild_acts(act, [
-                'diesel production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
-                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
-                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'
-            ])
-        elif act['name'] == ('diesel production, synthetic, from Fischer Tropsch process, '
-                             'hydrogen from electrolysis, energy allocation, at fuelling station'):
-            rebuild_acts(act, [
-                'diesel production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation',
-                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from electrolysis',
-                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from electrolysis'
-            ])
-        elif act['name'] == ('kerosene production, synthetic, from Fischer Tropsch process, '
-                             'hydrogen from wood gasification, energy allocation, at fuelling station'):
-            rebuild_acts(act, [
-                'kerosene production, synthetic, Fischer Tropsch process, hydrogen from wood gasification, energy allocation',
-                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from wood gasification',
-                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from wood gasification'
-            ])
-        elif act['name'] == ('kerosene production, synthetic, from Fischer Tropsch process, '
-                             'hydrogen from electrolysis, energy allocation, at fuelling station'):
-            rebuild_acts(act, [
-                'kerosene production, synthetic, Fischer Tropsch process, hydrogen from electrolysis, energy allocation',
-                'syngas, RWGS, Production, for Fischer Tropsch process, hydrogen from electrolysis',
-                'carbon monoxide, from RWGS, for Fischer Tropsch process, hydrogen from electrolysis'
-            ])
+    chain_collapse.collapse_chains(config_parameters.FT_FUEL_CHAINS)
 
 
 def methanol_distillation_update():
     """
     Change steam input in methanol acts and make it European.
     """
-    methanol_act = ws.get_one(bd.Database('additional_acts'),
-                              ws.equals('name', 'methanol distillation, from wood, without CCS'))
-    methanol_act_electrolysis = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'methanol distillation, hydrogen from electrolysis, CO2 from DAC'))
+    methanol_act = ix.get_one('additional_acts',
+                              ix.equals('name', 'methanol distillation, from wood, without CCS'))
+    methanol_act_electrolysis = ix.get_one(
+        'premise_base',
+        ix.equals('name', 'methanol distillation, hydrogen from electrolysis, CO2 from DAC'))
     for act in [methanol_act, methanol_act_electrolysis]:
         for ex in act.technosphere():
             # change steam input to make it European
             if 'steam' in ex.input['name']:
-                ex.input = ws.get_one(
-                    bd.Database('premise_base'),
-                    ws.equals('name', ex.input['name']),
-                    ws.equals('location', 'RER'))
+                ex.input = ix.get_one(
+                    'premise_base',
+                    ix.equals('name', ex.input['name']),
+                    ix.equals('location', 'RER'))
                 ex.save()
 
 
+@traced
 def rebuild_methanol_act():
     """
     methanol production in premise_base consists of methanol synthesis (which produces unpurified methanol), followed by
     methanol distillation, which purifies this methanol. This function puts these to activities together in a single one
-    and leaves it in 'additional_acts'.
-    """
-    inner_technosphere = []
-    methanol_act = ws.get_one(bd.Database('additional_acts'),
-                              ws.equals('name', 'methanol distillation, from wood, without CCS'))
-    for ex in methanol_act.technosphere():
-        if ex.input['name'] == 'methanol synthesis, from wood, without CCS':
-            inner_technosphere = ex.input.technosphere()
-            ex.delete()
-    if inner_technosphere:
-        for ex in inner_technosphere:
-            ex.output = methanol_act
-            ex.save()
-    methanol_act_electrolysis = ws.get_one(
-        bd.Database('premise_base'),
-        ws.equals('name', 'methanol distillation, hydrogen from electrolysis, CO2 from DAC'))
-    methanol_act_2 = methanol_act_electrolysis.copy(database='additional_acts')
-    for ex in methanol_act_2.technosphere():
-        if ex.input['name'] == 'methanol synthesis, hydrogen from electrolysis, CO2 from DAC':
-            inner_technosphere = ex.input.technosphere()
-            ex.delete()
-    if inner_technosphere:
-        for ex in inner_technosphere:
-            ex.output = methanol_act_2
-            ex.save()
+    and leaves it in 'additional_acts'. The chains are defined in config_parameters.METHANOL_CHAINS and collapsed
+    together (see chain_collapse.py).
+    """
+    chain_collapse.collapse_chains(config_parameters.METHANOL_CHAINS)
 
 
 def lcia_materials_methods(materials: list) -> list:
     materials = [s.capitalize() for s in materials]
     new_method_names = []
     for material in materials:
-        biosphere3_acts = ws.get_many(bd.Database('biosphere3'), ws.startswith('name', material),
-                                        ws.equals('type', 'natural resource'))
+        biosphere3_acts = ix.get_many('biosphere3', ix.startswith('name', material),
+                                        ix.equals('type', 'natural resource'))
         cfs = []
         for b3_act in biosphere3_acts:
             cfs.append((b3_act, 1))
@@ -3151,8 +2863,8 @@ def lcia_materials_methods(materials: list) -> list:
 
 
 def lcia_land_use():
-    transformation_acts = ws.get_many(bd.Database('biosphere3'), ws.startswith('name', 'Transformation, to'),
-                                        ws.equals('type', 'natural resource'))
+    transformation_acts = ix.get_many('biosphere3', ix.startswith('name', 'Transformation, to'),
+                                        ix.equals('type', 'natural resource'))
     cfs = []
     for b3_act in transformation_acts:
         cfs.append((b3_act, 1))
@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import os
+import pickle
+from typing import Any, Optional
+
+import bw2data as bd
+import bw2io as bi
+from bw2io.importers.base_lci import LCIImporter
+
+from config_parameters import ECOINVENT_CACHE_FOLDER
+
+# change it when the content of the artifacts changes (e.g., other strategies), so older artifacts are not used
+ARTIFACT_VERSION = 1
+
+
+def spold_directory_hash(spolds_path: str) -> str:
+    """
+    Hash of the names, sizes and modification times of the spold files. Replacing or editing any dataset changes it.
+    """
+    sha = hashlib.sha256()
+    for entry in sorted(os.scandir(spolds_path), key=lambda e: e.name):
+        if entry.is_file():
+            stat = entry.stat()
+            sha.update(f'{entry.name}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def artifact_path(spolds_path: str, db_name: str, cache_folder: str = ECOINVENT_CACHE_FOLDER) -> str:
+    """
+    The artifact depends on the database name too, because the linking strategies write it in the exchanges.
+    """
+    key = f'{spold_directory_hash(spolds_path)}|{db_name}|{bi.__version__}|{ARTIFACT_VERSION}'
+    key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_folder, f'{db_name}_{key_hash}_v{ARTIFACT_VERSION}.pkl.gz')
+
+
+def save_artifact(data: Any, file_path: str):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # write to a temporary file and rename it, so a half-written artifact is never used
+    tmp_file = f'{file_path}.{os.getpid()}.tmp'
+    with gzip.open(tmp_file, 'wb', compresslevel=1) as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, file_path)
+
+
+def load_artifact(file_path: str) -> Optional[Any]:
+    try:
+        with gzip.open(file_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        print(f'Could not read the artifact {file_path} ({e}). Generating it again.')
+        return None
+
+
+def import_ecoinvent_database(spolds_path: str, db_name: str, use_mp: bool = True,
+                              cache_folder: str = ECOINVENT_CACHE_FOLDER):
+    """
+    Imports the ecoinvent spold files in ´´spolds_path´´ as ´´db_name´´, if it is not in the current project yet.
+    The first time, the spold files are parsed (with multiprocessing if ´´use_mp´´; on Windows the calling script
+    needs an ´´if __name__ == '__main__':´´ guard), the strategies are applied and the resulting datasets are saved
+    in ´´cache_folder´´. Later imports (e.g., in new scenario projects) write that artifact straight into the project,
+    without parsing the spold files nor applying the strategies again.
+    """
+    if db_name in bd.databases:
+        return
+    file_path = artifact_path(spolds_path, db_name, cache_folder)
+    data = load_artifact(file_path) if os.path.exists(file_path) else None
+    if data is not None:
+        print(f'Writing {db_name} from the import artifact {file_path}')
+        importer = LCIImporter(db_name)
+        importer.data = data
+        importer.write_database()
+        return
+
+    ei = bi.SingleOutputEcospold2Importer(spolds_path, db_name, use_mp=use_mp)
+    ei.apply_strategies()
+    save_artifact(ei.data, file_path)
+    print(f'Saved the import artifact of {db_name} in {file_path}')
+    ei.write_database()
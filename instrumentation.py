@@ -0,0 +1,180 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from bw2data.backends import Activity, sqlite3_lci_db
+
+import activity_index
+
+# 0: only errors and summaries, 1: progress (default), 2: details of every activity and exchange changed
+VERBOSITY = 1
+# counters of each span
+COUNTERS = ('reads', 'writes', 'searches', 'copies')
+
+
+def set_verbosity(level: int):
+    global VERBOSITY
+    VERBOSITY = level
+
+
+def log(message: str, *args, level: int = 2):
+    """
+    Prints ´´message´´ if the verbosity is at least ´´level´´. Per-exchange messages use level 2, so they are not
+    printed in normal runs. ´´args´´ are %-formatted into ´´message´´ only when it is printed: pass the exchanges and
+    activities as ´´args´´ (log('changing %s', ex)) rather than in an f-string, since their str() reads the database.
+    """
+    if VERBOSITY >= level:
+        print(message % args if args else message)
+
+
+##### tracing #####
+class Tracer:
+    """
+    Nested timing spans of a run, with the database reads and writes (SQL statements), activity index searches and
+    activity copies done inside each span (including its children). Saved as a Chrome trace (chrome://tracing or
+    https://ui.perfetto.dev): one complete event ('ph': 'X') per span, with the counters in its 'args'.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self.stack: List[Dict[str, Any]] = []
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self.start) * 1e6
+
+    def begin(self, name: str, **args):
+        self.stack.append({'name': name, 'ts': self._now_us(), 'args': dict(args), 'counters': Counter()})
+
+    def end(self):
+        span = self.stack.pop()
+        self.events.append({'name': span['name'], 'ph': 'X', 'ts': span['ts'], 'dur': self._now_us() - span['ts'],
+                            'pid': os.getpid(), 'tid': threading.get_ident(),
+                            'args': {**span['args'], **{c: span['counters'][c] for c in COUNTERS}}})
+
+    def count(self, counter: str, n: int = 1):
+        for span in self.stack:
+            span['counters'][counter] += n
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Total time and counters per span name, slowest first.
+        """
+        totals: Dict[str, Counter] = {}
+        for event in self.events:
+            total = totals.setdefault(event['name'], Counter())
+            total['calls'] += 1
+            total['seconds'] += event['dur'] / 1e6
+            for c in COUNTERS:
+                total[c] += event['args'].get(c, 0)
+        return sorted(({'name': name, **total} for name, total in totals.items()), key=lambda t: -t['seconds'])
+
+    def save(self, file_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': sorted(self.events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms',
+                       'summary': self.summary()}, f, default=str)
+
+
+_TRACER: Optional[Tracer] = None
+
+
+def start_trace() -> Tracer:
+    global _TRACER
+    install_hooks()
+    _TRACER = Tracer()
+    return _TRACER
+
+
+def stop_trace(file_path: Optional[str] = None) -> Optional[Tracer]:
+    """
+    Closes the open spans, saves the trace in ´´file_path´´ (if given) and stops tracing.
+    """
+    global _TRACER
+    tracer, _TRACER = _TRACER, None
+    if tracer is None:
+        return None
+    while tracer.stack:
+        tracer.end()
+    if file_path is not None:
+        tracer.save(file_path)
+        print(f'Trace saved in {file_path}')
+    return tracer
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Timing span (nested in the current one). Does nothing if no trace was started.
+    """
+    tracer = _TRACER
+    if tracer is None:
+        yield
+        return
+    tracer.begin(name, **args)
+    try:
+        yield
+    finally:
+        if _TRACER is tracer and tracer.stack:
+            tracer.end()
+
+
+def traced(function: Callable) -> Callable:
+    """
+    Decorator: each call of ´´function´´ is a span named after it.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _TRACER is None:
+            return function(*args, **kwargs)
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def count(counter: str, n: int = 1):
+    if _TRACER is not None:
+        _TRACER.count(counter, n)
+
+
+##### counters #####
+def _wrap_execute_sql(execute_sql):
+    @functools.wraps(execute_sql)
+    def wrapper(self, sql, *args, **kwargs):
+        if _TRACER is not None:
+            statement = sql.lstrip()[:6].upper()
+            if statement == 'SELECT':
+                _TRACER.count('reads')
+            elif statement in ('INSERT', 'UPDATE', 'DELETE'):
+                _TRACER.count('writes')
+        return execute_sql(self, sql, *args, **kwargs)
+    wrapper._instrumentation_hook = True
+    return wrapper
+
+
+def _wrap_counting(method, counter: str):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        count(counter)
+        return method(*args, **kwargs)
+    wrapper._instrumentation_hook = True
+    return wrapper
+
+
+def install_hooks():
+    """
+    Counts the SQL statements of the project database (reads: SELECT; writes: INSERT, UPDATE and DELETE), the
+    activity index searches and the activity copies.
+    """
+    database_class = type(sqlite3_lci_db.db)
+    for owner, name, wrap in [(database_class, 'execute_sql', _wrap_execute_sql),
+                              (activity_index.ActivityIndex, 'search', lambda m: _wrap_counting(m, 'searches')),
+                              (Activity, 'copy', lambda m: _wrap_counting(m, 'copies'))]:
+        method = getattr(owner, name)
+        if not getattr(method, '_instrumentation_hook', False):
+            setattr(owner, name, wrap(method))
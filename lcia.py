@@ -0,0 +1,263 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Collection, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import bw2calc as bc
+import bw2data as bd
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+import activity_index as ix
+import tech_mapping as tm
+
+Key = Tuple[str, str]
+Method = Tuple[str, ...]
+
+# databases that change between scenarios sharing the same background. The rest of the technosphere is the background
+FOREGROUND_DATABASES = ('additional_acts', 'infrastructure (with European steel and concrete)')
+# number of background factorisations kept in memory
+MAX_CACHED_FACTORISATIONS = 4
+
+
+def database_state(db_names: Sequence[str]) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """
+    The databases ´´db_names´´ and all the databases they depend on, with their last modification time. A
+    factorisation is valid while this state does not change.
+    """
+    names = set()
+    for db_name in db_names:
+        names.add(db_name)
+        names |= set(bd.Database(db_name).find_graph_dependents())
+    return tuple(sorted((name, bd.databases[name].get('modified')) for name in names))
+
+
+##### block factorisation #####
+def matrix_hash(matrix: sparse.spmatrix, row_keys: Sequence[Key], col_keys: Sequence[Key]) -> str:
+    """
+    Content hash of a matrix and the activities of its rows and columns: equal hashes mean identical matrices.
+    """
+    matrix = sparse.csc_matrix(matrix)
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    sha = hashlib.sha256()
+    sha.update(json.dumps([list(row_keys), list(col_keys), list(matrix.shape)]).encode('utf-8'))
+    for array in (matrix.indptr, matrix.indices, matrix.data):
+        sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()
+
+
+# LU factorisations of background blocks, by content hash (least recently used first)
+_FACTORISATIONS: 'OrderedDict[str, object]' = OrderedDict()
+
+
+def background_factorisation(matrix: sparse.spmatrix, row_keys: Sequence[Key], col_keys: Sequence[Key]):
+    """
+    LU factorisation of the background block. It is only reused when the block is identical (same content hash), e.g.,
+    in another scenario project with the same background.
+    """
+    block_hash = matrix_hash(matrix, row_keys, col_keys)
+    if block_hash in _FACTORISATIONS:
+        print(f'Reusing the factorisation of the background ({len(row_keys)} activities)')
+        _FACTORISATIONS.move_to_end(block_hash)
+        return _FACTORISATIONS[block_hash]
+    print(f'Factorising the background ({len(row_keys)} activities)')
+    lu = splu(sparse.csc_matrix(matrix))
+    _FACTORISATIONS[block_hash] = lu
+    while len(_FACTORISATIONS) > MAX_CACHED_FACTORISATIONS:
+        _FACTORISATIONS.popitem(last=False)
+    return lu
+
+
+class BlockSolver:
+    """
+    Solves the technosphere A x = d split in background (b) and foreground (f) blocks:
+        A = [[A_bb, A_bf],
+             [A_fb, A_ff]]
+    A_bb is factorised once per distinct content (background_factorisation()), so scenarios that only change the
+    foreground reuse it. The foreground is solved with the Schur complement S = A_ff - A_fb A_bb^-1 A_bf:
+        x_f = S^-1 (d_f - A_fb A_bb^-1 d_b)
+        x_b = A_bb^-1 (d_b - A_bf x_f)
+    A_fb only has rows for the foreground products consumed by the background (usually few or none), so S costs a
+    handful of background solves and a factorisation of the size of the foreground.
+    """
+
+    def __init__(self, technosphere: sparse.spmatrix, product_dict: Mapping[Key, int], activity_dict: Mapping[Key, int],
+                 foreground: Collection[str] = FOREGROUND_DATABASES):
+        # background and foreground rows (products) and columns (activities), in a canonical order (by key). The
+        # dictionaries must be keyed by (database, code), i.e., lca.dicts after lca.remap_inventory_dicts()
+        if any(not isinstance(k, tuple) for k in product_dict) or any(not isinstance(k, tuple) for k in activity_dict):
+            raise TypeError('The product and activity dictionaries must be keyed by (database, code); call '
+                            'remap_inventory_dicts() on the LCA first')
+        row_keys = {part: sorted(k for k in product_dict if (k[0] in foreground) == (part == 'f')) for part in 'bf'}
+        col_keys = {part: sorted(k for k in activity_dict if (k[0] in foreground) == (part == 'f')) for part in 'bf'}
+        if len(row_keys['b']) != len(col_keys['b']):
+            raise ValueError('The background block of the technosphere matrix is not square')
+        self.rows = {part: np.array([product_dict[k] for k in keys], dtype=int) for part, keys in row_keys.items()}
+        self.cols = {part: np.array([activity_dict[k] for k in keys], dtype=int) for part, keys in col_keys.items()}
+        self.shape = technosphere.shape
+        matrix = sparse.csr_matrix(technosphere)
+        blocks = {(r, c): matrix[self.rows[r], :][:, self.cols[c]] for r in 'bf' for c in 'bf'}
+        self.lu_bb = background_factorisation(blocks[('b', 'b')], row_keys['b'], col_keys['b'])
+        self.a_bf = sparse.csr_matrix(blocks[('b', 'f')])
+
+        # rows of A_fb A_bb^-1 (only the foreground products consumed by the background)
+        a_fb = sparse.csr_matrix(blocks[('f', 'b')])
+        self.coupled = np.unique(a_fb.nonzero()[0])
+        if len(self.coupled):
+            self.w = self.lu_bb.solve(a_fb[self.coupled].toarray().T, trans='T').T
+            correction = sparse.csr_matrix(np.asarray(self.a_bf.T @ self.w.T).T)
+            expand = sparse.csr_matrix((np.ones(len(self.coupled)), (self.coupled, np.arange(len(self.coupled)))),
+                                       shape=(len(row_keys['f']), len(self.coupled)))
+            schur = blocks[('f', 'f')] - expand @ correction
+        else:
+            self.w = None
+            schur = blocks[('f', 'f')]
+        self.lu_schur = splu(sparse.csc_matrix(schur)) if len(col_keys['f']) else None
+
+    def solve(self, demand: np.ndarray) -> np.ndarray:
+        """
+        Supply vectors (activity x demand) for the demand vectors (product x demand).
+        """
+        d_b, d_f = demand[self.rows['b']], demand[self.rows['f']]
+        supply = np.zeros((self.shape[1], demand.shape[1]))
+        if self.lu_schur is not None:
+            rhs_f = np.array(d_f, dtype=float)
+            if self.w is not None:
+                rhs_f[self.coupled] -= self.w @ d_b
+            x_f = self.lu_schur.solve(rhs_f)
+            supply[self.cols['f']] = x_f
+            d_b = d_b - self.a_bf @ x_f
+        supply[self.cols['b']] = self.lu_bb.solve(np.asarray(d_b, dtype=float))
+        return supply
+
+
+class BatchLCA:
+    """
+    LCA of many activities and methods at once. The technosphere matrix of all the databases the activities depend on
+    is built and factorised once (the background block only when its content changes, see BlockSolver); the demand
+    vectors of all the activities are solved together, and the scores of all
+    the methods are obtained with a single product with the stacked characterisation factors (one row per method).
+    bl = BatchLCA(keys)
+    scores = bl.scores(methods)  # activity x method
+    """
+
+    def __init__(self, keys: Sequence[Key], foreground: Collection[str] = FOREGROUND_DATABASES):
+        self.keys = list(keys)
+        # the processed arrays must be up to date with the databases
+        bd.databases.clean()
+        self.state = database_state({key[0] for key in self.keys})
+        self.lca = bc.LCA({key: 1 for key in self.keys})
+        self.lca.load_lci_data()
+        # bw2calc 2 indexes the matrices by activity id: use (database, code) keys as the rest of the module
+        self.lca.remap_inventory_dicts()
+        self.solver = BlockSolver(self.lca.technosphere_matrix, self.lca.dicts.product, self.lca.dicts.activity,
+                                  foreground)
+
+    def covers(self, keys: Sequence[Key]) -> bool:
+        return all(key in self.lca.dicts.product for key in keys)
+
+    def inventories(self, keys: Optional[Sequence[Key]] = None) -> np.ndarray:
+        """
+        Life cycle inventories (biosphere flow x activity) of one unit of each activity in ´´keys´´ (all the activities
+        of the batch if None). All the demand vectors are solved with one call.
+        """
+        keys = self.keys if keys is None else list(keys)
+        demand = np.zeros((self.lca.technosphere_matrix.shape[0], len(keys)))
+        for column, key in enumerate(keys):
+            demand[self.lca.dicts.product[key], column] = 1
+        supply = self.solver.solve(demand)
+        return self.lca.biosphere_matrix @ supply
+
+    def characterisation_factors(self, methods: Sequence[Method]) -> sparse.csr_matrix:
+        """
+        Characterisation factors of all the methods (method x biosphere flow), in one sparse matrix.
+        """
+        rows = []
+        for method in methods:
+            self.lca.switch_method(method)
+            rows.append(sparse.csr_matrix(self.lca.characterization_matrix.diagonal()))
+        return sparse.vstack(rows).tocsr()
+
+    def scores(self, methods: Sequence[Method], keys: Optional[Sequence[Key]] = None) -> pd.DataFrame:
+        keys = self.keys if keys is None else list(keys)
+        scores = self.characterisation_factors(methods) @ self.inventories(keys)
+        return pd.DataFrame(np.asarray(scores).T, index=pd.Index(keys, tupleize_cols=False),
+                            columns=pd.Index(list(methods), tupleize_cols=False))
+
+
+# factorised batches, by project and database state
+_BATCHES: Dict[Tuple[str, Tuple], BatchLCA] = {}
+
+
+def get_batch(keys: Sequence[Key], foreground: Collection[str] = FOREGROUND_DATABASES) -> BatchLCA:
+    """
+    BatchLCA able to calculate ´´keys´´. The factorisation is reused while the databases do not change (e.g., several
+    calls after the same scenario), and redone once they are modified. Even then, the factorisation of the background
+    (all but the ´´foreground´´ databases) is reused if its content did not change (e.g., in the next scenario).
+    """
+    bd.databases.clean()
+    state = database_state({key[0] for key in keys})
+    cache_key = (bd.projects.current, state)
+    batch = _BATCHES.get(cache_key)
+    if batch is None or not batch.covers(keys):
+        batch = BatchLCA(keys, foreground)
+        _BATCHES.clear()
+        _BATCHES[cache_key] = batch
+    return batch
+
+
+##### mapping file #####
+def mapping_activities(file_path: str) -> pd.DataFrame:
+    """
+    Activity of each row of both sheets of the output mapping file (tech_mapping_out.xlsx). Rows located in 'country'
+    give one activity per country. Rows without a unique activity (exact name, location and reference product in
+    their 'prod_database') are reported and left out.
+    """
+    mapping = tm.load_mapping(file_path)
+    records, missing, ambiguous = [], [], []
+    for sheet, rows in mapping.rows.items():
+        for row in rows:
+            for loc in row.locations():
+                filters = [ix.equals('name', row.name), ix.equals('location', loc)]
+                if row.reference_product:
+                    filters.append(ix.contains('reference product', row.reference_product))
+                acts = ix.get_many(row.database, *filters)
+                label = f"{sheet} row {row.id}: '{row.name}' ({loc}) in {row.database}"
+                if len(acts) == 1:
+                    records.append({'sheet': sheet, 'id': row.id, 'technology_name_calliope': row.technology,
+                                    'life_cycle_inventory_name': row.name, 'location': loc, 'key': acts[0].key})
+                elif acts:
+                    ambiguous.append(label)
+                elif row.location != tm.COUNTRY_LOCATION:
+                    missing.append(label)
+    for label in missing:
+        print(f'  Missing: {label}')
+    for label in ambiguous:
+        print(f'  Ambiguous: {label}')
+    return pd.DataFrame(records, columns=['sheet', 'id', 'technology_name_calliope', 'life_cycle_inventory_name',
+                                          'location', 'key'])
+
+
+def mapping_scores(file_path: str, methods: Sequence[Method]) -> pd.DataFrame:
+    """
+    Scores of one unit of each activity of the output mapping file for each of ´´methods´´, as a table with one row per
+    (sheet, id, technology, inventory name, location) and one column per method.
+    """
+    activities = mapping_activities(file_path)
+    keys = list(dict.fromkeys(activities['key']))
+    print(f'Calculating {len(keys)} activities x {len(methods)} methods')
+    scores = get_batch(keys).scores(methods, keys)
+    positions = {key: i for i, key in enumerate(keys)}
+    table = scores.iloc[[positions[key] for key in activities['key']]].copy()
+    table.index = pd.MultiIndex.from_frame(activities.drop(columns='key'))
+    return table
+
+
+def methods_matching(method: str = 'ReCiPe 2016 v1.03, midpoint (H)') -> List[Method]:
+    """
+    Methods whose name contains ´´method´´ (excluding the 'no LT' versions), as in lca_wind_turbine().
+    """
+    return [m for m in bd.methods if method in m[0] and 'no LT' not in m[0]]
@@ -4,9 +4,20 @@ from premise import *
 from config_parameters import *
 from functions import *
 import bw2data as bd
+import pandas as pd
 import shutil
 from datetime import datetime
 import config_parameters as cfg
+from checkpoints import StageRunner
+from write_buffer import exchange_write_buffer
+from double_accounting import avoid_double_accounting_matrix
+import database_copy
+import fleet_members
+from import_cache import import_ecoinvent_database, spold_directory_hash
+import premise_cache
+import tech_mapping as tm
+import lcia
+import instrumentation
 
 
 def save_config_snapshot(file_path):
@@ -28,6 +39,7 @@ def save_run_parameters(file_path, params_dict):
 
 def run(# metadata
         log_save_path: str,
+        project_name: str = PROJECT_NAME,
 
         materials: list = [],
         ccs_clinker: bool = True,
@@ -65,6 +77,7 @@ def run(# metadata
         om_spheres_separation: bool = True,
         avoid_double_counting: bool = True,
         file_out_path: str = r'C:\Users\1361185\OneDrive - UAB\Documentos\GitHub\calliope_enbios_int\data\output\tech_mapping_out.xlsx',
+        lcia_methods: Optional[List[tuple]] = None,  # if given, score every activity of the output file (see lcia.py)
 
         avoid_electricity: bool = True,
         avoid_heat: bool = True,
@@ -76,8 +89,12 @@ def run(# metadata
         avoid_kerosene: bool = True,
         avoid_diesel: bool = True,
         avoid_countries_list: Optional[List[str]] = None,
+        double_accounting_method: str = 'exchanges',  # 'exchanges' or 'matrix' (bulk)
 
-        biosphere3: bd.Database = bd.Database('biosphere3')  # biosphere database
+        biosphere3: bd.Database = bd.Database('biosphere3'),  # biosphere database
+        stage_snapshots: bool = True,  # snapshot the project before each stage to roll back failed stages
+        plan: bool = False,  # only plan the next pending stage (no writes) and return its changeset
+        verbosity: int = 1  # 0: summaries, 1: progress, 2: every activity and exchange changed
         ):
     """
     Databases:
@@ -92,11 +109,20 @@ def run(# metadata
     7. Final databases (all of them come WITH background changes):
         - 'infrastructure (with European steel and concrete)': infrastructure activities WITH European markets for
           steel and concrete.
+    Project: everything is written in the brightway project ´´project_name´´ (config_parameters.PROJECT_NAME by default).
+    Checkpoints: each stage (database imports, premise, background, foreground, infrastructure, double accounting)
+    is recorded in the project once completed, together with a hash of its inputs. Running run() again skips the
+    completed stages. If a stage fails, the databases are restored to their state before it (stage_snapshots=True).
+    The fleets stage is the only one that runs again when its inputs change, if no later stage was completed (e.g., in
+    a fork of a project stopped after the fleets, see sweep.py).
+    Plan mode (plan=True): nothing is written. The next pending stage runs against a transaction that is rolled back
+    and run() returns the changeset of creates, relinks, amount changes and deletes it would do. It can be inspected
+    (changeset.summary()) and applied in one batch with checkpoints.apply_planned_stage(changeset).
     """
 
     # 1. Create logfile
     timestamp = datetime.now().strftime("%Y%m%d")
-    full_path = os.path.join(log_save_path, f'{PROJECT_NAME}_{timestamp}.txt')
+    full_path = os.path.join(log_save_path, f'{project_name}_{timestamp}.txt')
     # 2. Freeze + save config parameters
     save_config_snapshot(full_path)
     # 3. Save run() arguments
@@ -104,118 +130,191 @@ def run(# metadata
     save_run_parameters(full_path, params)
     print(f"Saved log to: {full_path}")
 
-
-    # setup_databases
-    bd.projects.set_current(PROJECT_NAME)
-    bi.bw2setup()
-
-    # set new materials and land use lcia methods (resource accounting)
-    methods = lcia_materials_methods(materials=materials)
-    lcia_land_use()
-
+    # 4. Trace of the stages (timings and database reads, writes, searches and copies), saved next to the log
+    instrumentation.set_verbosity(verbosity)
+    instrumentation.start_trace()
+    trace_path = os.path.join(log_save_path, f'{project_name}_{timestamp}_trace.json')
+    try:
+        # setup_databases
+        bd.projects.set_current(project_name)
+        bi.bw2setup()
+
+        # set new materials and land use lcia methods (resource accounting)
+        methods = lcia_materials_methods(materials=materials)
+        lcia_land_use()
+
+        # Every stage below records a completion marker in the project. Stages already completed with the same inputs
+        # are skipped, and a stage that fails is rolled back, so run() can be called again to resume where it stopped.
+        stages = StageRunner(snapshots=stage_snapshots, plan=plan)
+
+        # ecoinvent, premise and background changes
+        run_background_stages(stages,
+                              ccs_clinker=ccs_clinker,
+                              train_electrification=train_electrification,
+                              biomass_from_residues=biomass_from_residues,
+                              biomass_from_residues_share=biomass_from_residues_share,
+                              h2_iron_and_steel=h2_iron_and_steel,
+                              olefins_from_methanol=olefins_from_methanol,
+                              methanol_from_electrolysis=methanol_from_electrolysis,
+                              ammonia_from_hydrogen=ammonia_from_hydrogen,
+                              trucks_electrification=trucks_electrification,
+                              trucks_electrification_share=trucks_electrification_share,
+                              sea_transport_syn_diesel=sea_transport_syn_diesel)
+        # TODO: allow to have shares of today's and future's industry!!!!
+        # TODO: allow the rest of the world to also update their industries (according to IAMs?)
+        # TODO: allow to change Europe's electricity mix in case we apply the code to only one country
+
+        # auxiliary copies, foreground changes and fleets
+        run_foreground_stages(stages, ccs=ccs, vehicles_as_batteries=vehicles_as_batteries,
+                              soec_electrolyser_share=soec_electrolyser_share,
+                              aec_electrolyser_share=aec_electrolyser_share,
+                              pem_electrolyser_share=pem_electrolyser_share,
+                              battery_current_share=battery_current_share,
+                              battery_technology_share=battery_technology_share,
+                              open_technology_share=open_technology_share,
+                              roof_technology_share=roof_technology_share,
+                              roof_3kw_share=roof_3kw_share,
+                              roof_93kw_share=roof_93kw_share,
+                              roof_156kw_share=roof_156kw_share,
+                              roof_280kw_share=roof_280kw_share,
+                              onshore_wind_fleet=onshore_wind_fleet,
+                              offshore_wind_fleet=offshore_wind_fleet,
+                              biosphere3=biosphere3)
+
+        # 'infrastructure (with European steel and concrete)' operating.
+        if infrastructure_production_in_europe:
+            stages.run('update_cement_iron_foreground', update_cement_iron_foreground, file_path=mapping_file_path)
+
+        # O&M activities in premise_base and additional_acts do not have infrastructure inputs after running this
+        # function. Moreover, now we have activities (with ', biosphere' and ', technosphere' at the end of the name
+        # indicated in the mapping file) in additional_acts.
+        if delete_infrastructure:
+            availability = stages.run('delete_infrastructure_main', delete_infrastructure_main,
+                                      file_path=mapping_file_path, om_spheres_separation=om_spheres_separation)
+            if availability is not None and not availability.empty:
+                availability_path = os.path.join(os.path.dirname(file_out_path), 'country_availability.csv')
+                availability.to_csv(availability_path)
+                print(f'Country availability of the mapping rows saved in {availability_path}')
+
+        # avoid double accounting
+        if avoid_double_counting:
+            stages.run('avoid_double_accounting', avoid_double_accounting,
+                       electricity=avoid_electricity, heat=avoid_heat, co2=avoid_co2,
+                       hydrogen=avoid_hydrogen, biomass=avoid_biomass, methane=avoid_methane,
+                       methanol=avoid_methanol, kerosene=avoid_kerosene, diesel=avoid_diesel,
+                       avoid_countries_list=avoid_countries_list, method=double_accounting_method)
+
+        if plan:
+            return stages.changeset
+
+        # save the output file
+        if om_spheres_separation:
+            create_output_file(file_in=mapping_file_path, file_out=file_out_path)
+        else:
+            shutil.copy(mapping_file_path, file_out_path)
+
+        # activity x method scores of the output file, with one factorisation
+        if lcia_methods:
+            scores = lcia.mapping_scores(file_out_path, lcia_methods)
+            scores_path = os.path.join(os.path.dirname(file_out_path), 'lcia_scores.csv')
+            scores.to_csv(scores_path)
+            print(f'LCIA scores saved in {scores_path}')
+    finally:
+        instrumentation.stop_trace(trace_path)
+
+
+# run() arguments that change the background (premise_base before the auxiliary copies are made). Scenarios sharing
+# them can share the same background.
+BACKGROUND_ARGUMENTS = ('ccs_clinker', 'train_electrification', 'biomass_from_residues', 'biomass_from_residues_share',
+                        'h2_iron_and_steel', 'olefins_from_methanol', 'methanol_from_electrolysis',
+                        'ammonia_from_hydrogen', 'trucks_electrification', 'trucks_electrification_share',
+                        'sea_transport_syn_diesel')
+
+# run() arguments of update_foreground and of the fleets. Scenarios sharing FOREGROUND_ARGUMENTS (and the background)
+# can share the same foreground; their fleets are built again on top of it (see run_foreground_stages()).
+FOREGROUND_ARGUMENTS = ('ccs', 'vehicles_as_batteries')
+FLEET_ARGUMENTS = ('soec_electrolyser_share', 'aec_electrolyser_share', 'pem_electrolyser_share',
+                   'battery_current_share', 'battery_technology_share', 'open_technology_share',
+                   'roof_technology_share', 'roof_3kw_share', 'roof_93kw_share', 'roof_156kw_share', 'roof_280kw_share',
+                   'onshore_wind_fleet', 'offshore_wind_fleet', 'biosphere3')
+
+
+def run_premise_stages(stages: StageRunner):
+    """
+    Stages that do not depend on any run() argument: ecoinvent import, premise databases and 'premise_base'.
+    """
     # Ecoinvent v3.9.1 cutoff and apos
-    if 'original_cutoff391' not in bd.databases:
-        ei = bi.SingleOutputEcospold2Importer(SPOLDS_CUTOFF, "original_cutoff391", use_mp=False)
-        ei.apply_strategies()
-        ei.write_database()
-    if 'apos391' not in bd.databases:
-        ei = bi.SingleOutputEcospold2Importer(SPOLDS_APOS, "apos391", use_mp=False)
-        ei.apply_strategies()
-        ei.write_database()
-
-    if 'premise_original' not in bd.databases:
-        # premise, without updates (only imported inventories)
-        ndb = NewDatabase(
-            scenarios=[
-                {"model": "image", "pathway": "SSP2-RCP19", "year": 2020},
-            ],
-            source_db="original_cutoff391",
-            source_version="3.9.1",
-            key='tUePmX_S5B8ieZkkM7WUU2CnO8SmShwmAeWK9x2rTFo='
-        )
-        ndb.write_db_to_brightway(name='premise_original')
-
-    if 'premise_cement' not in bd.databases:
-        # premise with cement and biomass update
-        ndb = NewDatabase(
-            scenarios=[
-                {"model": "image", "pathway": "SSP2-RCP19", "year": 2020},
-            ],
-            source_db="original_cutoff391",
-            source_version="3.9.1",
-            key='tUePmX_S5B8ieZkkM7WUU2CnO8SmShwmAeWK9x2rTFo='
-        )
-        ndb.update('cement')
-        ndb.update('biomass')
-        ndb.write_db_to_brightway(name='premise_cement')
-
+    stages.run('import_ecoinvent', import_ecoinvent)
+    # premise databases: 'premise_original' and 'premise_cement'
+    stages.run('premise_databases', create_premise_databases)
     # create a premise_original copy named 'premise_base'
-    if 'premise_base' not in bd.databases:
-        bd.Database('premise_original').copy(name="premise_base")
+    stages.run('premise_base', create_premise_base)
+
 
+def run_background_stages(stages: StageRunner, **background_parameters):
+    """
+    Stages up to the updated background: ecoinvent import, premise databases, 'premise_base' and update_background.
+    ´´background_parameters´´ are the BACKGROUND_ARGUMENTS of run().
+    """
+    run_premise_stages(stages)
     # background changes
-    update_background(ccs_clinker=ccs_clinker,
-                      train_electrification=train_electrification,
-                      biomass_from_residues=biomass_from_residues,
-                      biomass_from_residues_share=biomass_from_residues_share,
-                      h2_iron_and_steel=h2_iron_and_steel,
-                      olefins_from_methanol=olefins_from_methanol,
-                      methanol_from_electrolysis=methanol_from_electrolysis,
-                      ammonia_from_hydrogen=ammonia_from_hydrogen,
-                      trucks_electrification=trucks_electrification,
-                      trucks_electrification_share=trucks_electrification_share,
-                      sea_transport_syn_diesel=sea_transport_syn_diesel)
-    # TODO: allow to have shares of today's and future's industry!!!!
-    # TODO: allow the rest of the world to also update their industries (according to IAMs?)
-    # TODO: allow to change Europe's electricity mix in case we apply the code to only one country
+    stages.run('update_background', update_background, **background_parameters)
 
-    # create a copy for each of the databases that we will have in the project.
-    premise_base_auxiliary()
 
+def run_foreground_stages(stages: StageRunner, ccs: bool = False, vehicles_as_batteries: bool = True,
+                          **fleet_parameters):
+    """
+    Stages after the background: auxiliary copies, update_foreground and the fleets. ´´fleet_parameters´´ are the
+    FLEET_ARGUMENTS of run().
+    The fleets stage can run again with other shares in a project where it was already completed, as long as no later
+    stage was completed (see StageRunner.run()): its aggregation activities are rewritten, and the members (turbines,
+    parks, electrolysers...) built from the same parameters are reused (see fleet_members.py).
+    """
+    # create a copy for each of the databases that we will have in the project.
+    stages.run('premise_base_auxiliary', premise_base_auxiliary)
     # foreground changes
-    update_foreground(ccs=ccs, vehicles_as_batteries=vehicles_as_batteries,
-                      soec_electrolyser_share=soec_electrolyser_share, aec_electrolyser_share=aec_electrolyser_share,
-                      pem_electrolyser_share=pem_electrolyser_share,
-                      battery_current_share=battery_current_share,
-                      battery_technology_share=battery_technology_share,
-                      open_technology_share=open_technology_share,
-                      roof_technology_share=roof_technology_share,
-                      roof_3kw_share=roof_3kw_share,
-                      roof_93kw_share=roof_93kw_share,
-                      roof_156kw_share=roof_156kw_share,
-                      roof_280kw_share=roof_280kw_share,
-                      onshore_wind_fleet=onshore_wind_fleet,
-                      offshore_wind_fleet=offshore_wind_fleet,
-                      biosphere3=biosphere3)
-
-    # 'infrastructure (with European steel and concrete)' operating.
-    if infrastructure_production_in_europe:
-        update_cement_iron_foreground(file_path=mapping_file_path)
-
-    # O&M activities in premise_base and additional_acts do not have infrastructure inputs after running this function.
-    # Moreover, now we have activities (with ', biosphere' and ', technosphere' at the end of the name indicated in the
-    # mapping file) in additional_acts.
-    if delete_infrastructure:
-        delete_infrastructure_main(
-            file_path=mapping_file_path, om_spheres_separation=om_spheres_separation)
-
-    # avoid double accounting
-    if avoid_double_counting:
-        avoid_double_accounting(electricity=avoid_electricity, heat=avoid_heat, co2=avoid_co2,
-                                hydrogen=avoid_hydrogen, biomass=avoid_biomass, methane=avoid_methane,
-                                methanol=avoid_methanol, kerosene=avoid_kerosene, diesel=avoid_diesel,
-                                avoid_countries_list=avoid_countries_list)
-
-    # save the output file
-    if om_spheres_separation:
-        create_output_file(file_in=mapping_file_path, file_out=file_out_path)
-    else:
-        shutil.copy(mapping_file_path, file_out_path)
+    stages.run('update_foreground', update_foreground, ccs=ccs, vehicles_as_batteries=vehicles_as_batteries)
+    # technology fleets
+    stages.run('fleets', create_fleets, rerunnable=True, **fleet_parameters)
+
+
+def import_ecoinvent():
+    """
+    Imports ecoinvent v3.9.1 cutoff ('original_cutoff391') and apos ('apos391'), if not in the project yet. After the
+    first import, new projects write them from the cached import artifacts (see import_cache.py).
+    """
+    import_ecoinvent_database(SPOLDS_CUTOFF, "original_cutoff391")
+    import_ecoinvent_database(SPOLDS_APOS, "apos391")
+
+
+def create_premise_databases():
+    """
+    Creates 'premise_original' (premise, without updates, only imported inventories) and 'premise_cement' (premise
+    with cement and biomass update), if not in the project yet. Both come from a single premise pass, and new projects
+    write them from the cached premise artifacts (see premise_cache.py).
+    """
+    premise_cache.create_premise_databases(
+        variants={'premise_original': [], 'premise_cement': ['cement', 'biomass']},
+        model="image", pathway="SSP2-RCP19", year=2020,
+        source_db="original_cutoff391",
+        source_version="3.9.1",
+        key='tUePmX_S5B8ieZkkM7WUU2CnO8SmShwmAeWK9x2rTFo=',
+        source_hash=spold_directory_hash(SPOLDS_CUTOFF)
+    )
+
+
+def create_premise_base():
+    """
+    'premise_base' is a copy of 'premise_original' that will contain the updated background and foreground.
+    """
+    if 'premise_base' not in bd.databases:
+        database_copy.copy_database('premise_original', 'premise_base')
 
 
 def avoid_double_accounting(electricity: bool, heat: bool, co2: bool, hydrogen: bool, biomass: bool,
                             methane: bool, methanol: bool, kerosene: bool, diesel: bool,
                             avoid_countries_list: Optional[List[str]] = None,
+                            method: str = 'exchanges'
                             ):
     """
     We use the polluter pays principle to avoid double accounting. There are two possible sources of double accounting.
@@ -230,68 +329,85 @@ def avoid_double_accounting(electricity: bool, heat: bool, co2: bool, hydrogen:
     to Calliope)
     The following energy carriers are dealt with: electricity, heat, CO2, hydrogen, waste, biomass, methane, methanol,
     kerosene, diesel.
+    method: 'exchanges' walks the upstream of each activity and deletes the exchanges one by one (unlink_* functions).
+    'matrix' computes all the cuts at once over the exchanges table and deletes them in one bulk write (see
+    double_accounting.avoid_double_accounting_matrix), and prints a report of the cut exchanges.
     """
+    if method == 'matrix':
+        carriers = [name for name, apply in [('electricity', electricity), ('heat', heat), ('co2', co2),
+                                             ('hydrogen', hydrogen), ('biomass', biomass), ('methane', methane),
+                                             ('methanol', methanol), ('kerosene', kerosene), ('diesel', diesel)]
+                    if apply]
+        return avoid_double_accounting_matrix(carriers=carriers, avoid_countries_list=avoid_countries_list)
+    elif method != 'exchanges':
+        raise ValueError(f"Unknown double accounting method: {method}. Use 'exchanges' or 'matrix'.")
     print(f'Starting avoiding double accounting protocol. Applied to: electricity: {electricity}, heat: {heat}, '
           f'CO2: {co2}, hydrogen: {hydrogen}, biomass: {biomass}, methane: {methane}, methanol: {methanol}, '
           f'kerosene: {kerosene}, diesel: {diesel}')
-    for name in ['premise_base', 'additional_acts',
-                 'premise_auxiliary_for_infrastructure', 'infrastructure (with European steel and concrete)']:
-        if electricity:
-            try:
-                # Electricity
-                unlink_electricity(db_name=name, country_codes_list=avoid_countries_list)
-            except wurst.errors.NoResults:
-                print(f'electricity not available in {name}')
-        if heat:
-            try:
-                # Heat
-                unlink_heat(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'heat not available in {name}')
-        if co2:
-            try:
-                # CO2
-                unlink_co2(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'co2 not available in {name}')
-        if hydrogen:
-            try:
-                # Hydrogen
-                unlink_hydrogen(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'hydrogen not available in {name}')
-        # Waste
-        # In cutoff it comes without any environmental burdens, so there is no need to apply any unlinking
-        if biomass:
-            try:
-                # Biomass
-                unlink_biomass(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'biomass not available in {name}')
-        if methane:
-            try:
-                # Methane
-                unlink_methane(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'methane not available in {name}')
-        if methanol:
-            try:
-                # Methanol
-                unlink_methanol(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'methanol not available in {name}')
-        if kerosene:
-            try:
-                # Kerosene
-                unlink_kerosene(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'kerosene not available in {name}')
-        if diesel:
-            try:
-                # Diesel
-                unlink_diesel(db_name=name)
-            except wurst.errors.NoResults:
-                print(f'diesel not available in {name}')
+    # all the deletions are committed together and each database is processed once at the end
+    with exchange_write_buffer(process=True) as write_buffer:
+        # writes made before in an outer buffer are not part of this protocol
+        first_write = len(write_buffer.outputs)
+        for name in ['premise_base', 'additional_acts',
+                     'premise_auxiliary_for_infrastructure', 'infrastructure (with European steel and concrete)']:
+            if electricity:
+                try:
+                    # Electricity
+                    unlink_electricity(db_name=name, country_codes_list=avoid_countries_list)
+                except wurst.errors.NoResults:
+                    print(f'electricity not available in {name}')
+            if heat:
+                try:
+                    # Heat
+                    unlink_heat(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'heat not available in {name}')
+            if co2:
+                try:
+                    # CO2
+                    unlink_co2(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'co2 not available in {name}')
+            if hydrogen:
+                try:
+                    # Hydrogen
+                    unlink_hydrogen(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'hydrogen not available in {name}')
+            # Waste
+            # In cutoff it comes without any environmental burdens, so there is no need to apply any unlinking
+            if biomass:
+                try:
+                    # Biomass
+                    unlink_biomass(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'biomass not available in {name}')
+            if methane:
+                try:
+                    # Methane
+                    unlink_methane(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'methane not available in {name}')
+            if methanol:
+                try:
+                    # Methanol
+                    unlink_methanol(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'methanol not available in {name}')
+            if kerosene:
+                try:
+                    # Kerosene
+                    unlink_kerosene(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'kerosene not available in {name}')
+            if diesel:
+                try:
+                    # Diesel
+                    unlink_diesel(db_name=name)
+                except wurst.errors.NoResults:
+                    print(f'diesel not available in {name}')
+        # the fleet members whose exchanges were cut are not reused as they are anymore (see fleet_members)
+        fleet_members.invalidate_members(write_buffer.outputs[first_write:])
 
     print('Double accounting protocol successfully completed')
 
@@ -368,24 +484,7 @@ def update_background(
     print('Background update finished.')
 
 
-def update_foreground(ccs: bool = False, vehicles_as_batteries: bool = True,
-                      soec_electrolyser_share: float = 0.3, aec_electrolyser_share: float = 0.4,
-                      pem_electrolyser_share: float = 0.3,  # electrolyser variables
-                      battery_current_share: bool = False,
-                      battery_technology_share: Optional[Dict[str, float]] = config_parameters.EMERGING_TECH_MODERATE,
-                      # battery variables
-                      open_technology_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND['openground'],
-                      roof_technology_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND[
-                          "rooftop_power_share"],
-                      roof_3kw_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND["rooftop_3kw"],
-                      roof_93kw_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND["rooftop_93kw"],
-                      roof_156kw_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND["rooftop_156kw"],
-                      roof_280kw_share: Dict[str, float] = config_parameters.PV_CURRENT_TREND["rooftop_280kw"],
-                      # solar pv variables
-                      onshore_wind_fleet: Dict = config_parameters.BALANCED_ON_WIND_FLEET,  # onshore wind variables
-                      offshore_wind_fleet: Dict = config_parameters.OFF_WIND_FLEET,  # offshore wind variables
-                      biosphere3: bd.Database = bd.Database('biosphere3')
-                      ):
+def update_foreground(ccs: bool = False, vehicles_as_batteries: bool = True):
     """
     Adapt the foreground activities as follows:
     - Fixes from premise inventories:
@@ -408,7 +507,7 @@ def update_foreground(ccs: bool = False, vehicles_as_batteries: bool = True,
     - VARIABLE DEPENDANT UPDATES:
         (1) Use of Carbon Capture and Storage in hydrogen for biofuel-to-methanol (default: False)
         (2) Model vehicles as only the electric and electronic parts (battery, etc.) (default: True)
-        (3) Create fleets. Scenarios described in create_fleets().
+    The fleets are created afterwards, in their own stage (create_fleets()).
     """
     print('Updating foreground.')
     create_additional_acts_db()
@@ -450,21 +549,6 @@ def update_foreground(ccs: bool = False, vehicles_as_batteries: bool = True,
         trucks_and_bus_update(db_truck_name='premise_base')
         passenger_car_and_scooter_update(db_passenger_name='premise_base')
 
-    # create fleets
-    create_fleets(soec_electrolyser_share=soec_electrolyser_share, aec_electrolyser_share=aec_electrolyser_share,
-                  pem_electrolyser_share=pem_electrolyser_share,
-                  battery_current_share=battery_current_share,
-                  battery_technology_share=battery_technology_share,
-                  open_technology_share=open_technology_share,
-                  roof_technology_share=roof_technology_share,
-                  roof_3kw_share=roof_3kw_share,
-                  roof_93kw_share=roof_93kw_share,
-                  roof_156kw_share=roof_156kw_share,
-                  roof_280kw_share=roof_280kw_share,
-                  onshore_wind_fleet=onshore_wind_fleet,
-                  offshore_wind_fleet=offshore_wind_fleet,
-                  biosphere3=biosphere3)
-
     # create empty pv_operation inventories
     pv_operation_inventories(pv_db='additional_acts')
     print('Foreground updated successfully.')
@@ -533,36 +617,40 @@ def create_fleets(
         · 14 MW (based on the SG 14-222 DD) and 10 MW (based on the V164-10MW) ->
           gravity: 5%, monopile: 20%, tripod: 10%, floating (spar-buoy): 15%
     """
-    # Hydrogen
-    hydrogen_from_electrolysis_market(db_hydrogen_name='premise_base',
-                                      soec_share=soec_electrolyser_share,
-                                      aec_share=aec_electrolyser_share, pem_share=pem_electrolyser_share)
-    # Batteries
-    batteries_fleet(db_batteries_name='premise_base', current_share=battery_current_share,
-                    technology_share=battery_technology_share)
-    # Solar photovoltaics
-    solar_pv_fleet(db_solar_name='premise_base', open_technology_share=open_technology_share,
-                   roof_technology_share=roof_technology_share, roof_3kw_share=roof_3kw_share,
-                   roof_93kw_share=roof_93kw_share, roof_156kw_share=roof_156kw_share, roof_280kw_share=roof_280kw_share
-                   )
-
-    # Onshore wind fleets
-    wind_onshore_fleet(db_wind_name='original_cutoff391', location='ES', fleet_turbines_definition=onshore_wind_fleet,
-                       biosphere3=biosphere3)
-
-    # Offshore wind fleets
-    # TODO: 1. offshore per kWh, 2. maintenance emissions are onsite!
-    wind_offshore_fleet(db_wind_name='original_cutoff391', location='ES', fleet_turbines_definition=offshore_wind_fleet)
+    # all fleets are written in a single transaction
+    with exchange_write_buffer():
+        # Hydrogen
+        hydrogen_from_electrolysis_market(db_hydrogen_name='premise_base',
+                                          soec_share=soec_electrolyser_share,
+                                          aec_share=aec_electrolyser_share, pem_share=pem_electrolyser_share)
+        # Batteries
+        batteries_fleet(db_batteries_name='premise_base', current_share=battery_current_share,
+                        technology_share=battery_technology_share)
+        # Solar photovoltaics
+        solar_pv_fleet(db_solar_name='premise_base', open_technology_share=open_technology_share,
+                       roof_technology_share=roof_technology_share, roof_3kw_share=roof_3kw_share,
+                       roof_93kw_share=roof_93kw_share, roof_156kw_share=roof_156kw_share,
+                       roof_280kw_share=roof_280kw_share
+                       )
+
+        # Onshore wind fleets
+        wind_onshore_fleet(db_wind_name='original_cutoff391', location='ES',
+                           fleet_turbines_definition=onshore_wind_fleet, biosphere3=biosphere3)
+
+        # Offshore wind fleets
+        # TODO: 1. offshore per kWh, 2. maintenance emissions are onsite!
+        wind_offshore_fleet(db_wind_name='original_cutoff391', location='ES',
+                            fleet_turbines_definition=offshore_wind_fleet)
 
 
 def create_output_file(file_in: str, file_out: str):
     print('Creating output file')
-    # Load the Excel file with both sheets
-    sheets = pd.read_excel(file_in, sheet_name=None)
+    # Load the Excel file with both sheets (parsed once, see tech_mapping.py)
+    mapping = tm.load_mapping(file_in)
 
     # Extract the sheets
-    o_m_df = sheets['o&m']
-    infrastructure_df = sheets['infrastructure']
+    o_m_df = mapping.sheet(tm.OM_SHEET)
+    infrastructure_df = mapping.sheet(tm.INFRASTRUCTURE_SHEET)
 
     # Create two versions for 'life_cycle_inventory_name'
     biosphere_df = o_m_df.copy()
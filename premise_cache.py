@@ -0,0 +1,109 @@
+import copy
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence
+
+import bw2data as bd
+import premise
+from bw2data.backends import ActivityDataset, ExchangeDataset
+
+import activity_index
+import bulk_write
+from config_parameters import PREMISE_CACHE_FOLDER
+from import_cache import load_artifact, save_artifact
+
+# change it when the content of the artifacts changes, so older artifacts are not used
+ARTIFACT_VERSION = 1
+
+
+def premise_artifact_path(model: str, pathway: str, year: int, source_db: str, source_version: str,
+                          updates: Sequence[str] = (), source_hash: str = '',
+                          cache_folder: str = PREMISE_CACHE_FOLDER) -> str:
+    """
+    Path of the cached premise database for the scenario (´´model´´, ´´pathway´´, ´´year´´) generated from
+    ´´source_db´´ with the sectors in ´´updates´´. The key includes the premise version, and ´´source_hash´´ can be
+    used to tell apart different contents of the source database (e.g., the hash of its spold files).
+    """
+    key = '|'.join([model, pathway, str(year), source_db, source_version, ','.join(updates), source_hash,
+                    str(premise.__version__), str(ARTIFACT_VERSION)])
+    key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    label = '_'.join([model, pathway, str(year)] + list(updates))
+    return os.path.join(cache_folder, f'premise_{label}_{key_hash}_v{ARTIFACT_VERSION}.pkl.gz')
+
+
+##### databases as table rows #####
+def database_rows(db_name: str) -> Dict:
+    """
+    Metadata, activity rows and exchange rows of ´´db_name´´, as written by bw2data (without the row ids).
+    """
+    metadata = copy.copy(bd.databases[db_name])
+    for k in ['modified', 'processed', 'number', 'dirty']:
+        metadata.pop(k, None)
+    activities = [row for row in ActivityDataset.select().where(ActivityDataset.database == db_name).dicts()]
+    exchanges = [row for row in ExchangeDataset.select().where(ExchangeDataset.output_database == db_name).dicts()]
+    for row in activities + exchanges:
+        row.pop('id')
+    return {'name': db_name, 'metadata': metadata, 'activities': activities, 'exchanges': exchanges}
+
+
+def write_database_rows(rows: Dict, db_name: Optional[str] = None):
+    """
+    Writes a database saved with database_rows() in the current project, as ´´db_name´´ (by default, with the name it
+    was saved with). The rows are relabelled to ´´db_name´´ as in copy_database(), inserted in one transaction without
+    validating them again, with new ids, and registered.
+    """
+    source = rows['name']
+    if db_name is None:
+        db_name = source
+    bd.Database(db_name).register(**rows['metadata'])
+    activity_index.invalidate(db_name)
+    bulk_write.write_rows(db_name, (bulk_write.relabelled_activity_row(row, db_name) for row in rows['activities']),
+                          (bulk_write.relabelled_exchange_row(row, source, db_name) for row in rows['exchanges']))
+
+
+##### premise databases #####
+def create_premise_databases(variants: Dict[str, List[str]], model: str, pathway: str, year: int, source_db: str,
+                             source_version: str, key: str, source_hash: str = '',
+                             cache_folder: str = PREMISE_CACHE_FOLDER):
+    """
+    Creates one premise database per item of ´´variants´´ ({database name: sectors to update}) for the same scenario,
+    skipping those already in the project.
+    Databases cached in ´´cache_folder´´ are written from their artifact. The rest are generated in a single premise
+    pass: the source database is extracted and the inventories are imported and matched once, and the variants are
+    written in order of number of updates. premise keeps the extracted database, so writing a variant does not change
+    the data the next updates start from. Order ´´variants´´ so each one adds sectors to the previous one (e.g.,
+    {'premise_original': [], 'premise_cement': ['cement', 'biomass']}).
+    """
+    pending = {}
+    for db_name, updates in variants.items():
+        if db_name in bd.databases:
+            continue
+        file_path = premise_artifact_path(model, pathway, year, source_db, source_version, updates, source_hash,
+                                          cache_folder)
+        rows = load_artifact(file_path) if os.path.exists(file_path) else None
+        if rows is not None:
+            print(f"Writing '{db_name}' from the premise artifact {file_path}")
+            write_database_rows(rows, db_name)
+        else:
+            pending[db_name] = (updates, file_path)
+    if not pending:
+        return
+
+    ndb = premise.NewDatabase(
+        scenarios=[
+            {"model": model, "pathway": pathway, "year": year},
+        ],
+        source_db=source_db,
+        source_version=source_version,
+        key=key
+    )
+    applied = []
+    for db_name, (updates, file_path) in sorted(pending.items(), key=lambda item: len(item[1][0])):
+        if applied != list(updates[:len(applied)]):
+            raise ValueError(f"The updates of '{db_name}' ({updates}) do not extend the previous ones ({applied}).")
+        for sector in updates[len(applied):]:
+            ndb.update(sector)
+            applied.append(sector)
+        ndb.write_db_to_brightway(name=db_name)
+        save_artifact(database_rows(db_name), file_path)
+        print(f"Saved the premise artifact of '{db_name}' in {file_path}")
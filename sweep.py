@@ -0,0 +1,261 @@
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import bw2data as bd
+import bw2io as bi
+from bw2data.backends import sqlite3_lci_db
+
+from checkpoints import StageRunner, inputs_hash
+from config_parameters import PROJECT_NAME
+from main import (BACKGROUND_ARGUMENTS, FLEET_ARGUMENTS, FOREGROUND_ARGUMENTS, run, run_background_stages,
+                  run_foreground_stages, run_premise_stages)
+
+SWEEP_INDEX_FILE = 'sweep_scenarios.json'
+
+
+##### scenarios #####
+def expand_grid(grid: Dict[str, List[Any]], base_parameters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    All the combinations of the values in ´´grid´´ (run() argument -> list of values), each one on top of
+    ´´base_parameters´´ (run() arguments common to all the scenarios, e.g., mapping_file_path).
+    """
+    base_parameters = base_parameters or {}
+    names = list(grid)
+    return [{**base_parameters, **dict(zip(names, values))} for values in itertools.product(*grid.values())]
+
+
+def _run_arguments(parameters: Dict[str, Any], names: Tuple[str, ...]) -> Dict[str, Any]:
+    # the run() arguments ´´names´´ of a scenario, with the default value of run() for those not in ´´parameters´´
+    defaults = inspect.signature(run).parameters
+    return {k: parameters.get(k, defaults[k].default) for k in names}
+
+
+def background_parameters(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The BACKGROUND_ARGUMENTS of a scenario, with the default value of run() for those not in ´´parameters´´. They must
+    be exactly the ones run() passes to update_background, so the background stage checkpoints match.
+    """
+    return _run_arguments(parameters, BACKGROUND_ARGUMENTS)
+
+
+def foreground_parameters(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The FOREGROUND_ARGUMENTS and FLEET_ARGUMENTS of a scenario, as run() passes them to run_foreground_stages().
+    """
+    return _run_arguments(parameters, FOREGROUND_ARGUMENTS + FLEET_ARGUMENTS)
+
+
+def scenario_id(parameters: Dict[str, Any]) -> str:
+    return 'scenario_' + inputs_hash('scenario', parameters)[:10]
+
+
+def group_by_background(scenarios: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Groups the scenarios by their background-affecting arguments. Key: hash of the background arguments.
+    """
+    groups = {}
+    for parameters in scenarios:
+        key = inputs_hash('background', background_parameters(parameters))[:10]
+        groups.setdefault(key, []).append(parameters)
+    return groups
+
+
+def group_by_foreground(scenarios: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Groups the scenarios (of the same background) by their foreground arguments, without the fleet shares. Key: hash
+    of the foreground arguments.
+    """
+    groups = {}
+    for parameters in scenarios:
+        key = inputs_hash('foreground', _run_arguments(parameters, FOREGROUND_ARGUMENTS))[:10]
+        groups.setdefault(key, []).append(parameters)
+    return groups
+
+
+##### projects #####
+def fork_project(source_project: str, new_project: str):
+    """
+    Copies the brightway project ´´source_project´´ (databases and stage checkpoints) into ´´new_project´´, if it
+    does not exist yet. The current project is left as ´´source_project´´.
+    """
+    if new_project in bd.projects:
+        print(f"Project '{new_project}' already exists. Not forking it again.")
+        return
+    bd.projects.set_current(source_project)
+    # write the pending write-ahead log into the SQLite file before copying it
+    sqlite3_lci_db.db.close()
+    print(f"Forking project '{source_project}' into '{new_project}'")
+    bd.projects.copy_project(new_project, switch=False)
+
+
+def build_shared_project(base_project: str):
+    """
+    ecoinvent, premise databases and 'premise_base' (without background changes), done once for the whole sweep.
+    """
+    bd.projects.set_current(base_project)
+    bi.bw2setup()
+    run_premise_stages(StageRunner())
+
+
+def build_background(background_project: str, parameters: Dict[str, Any]):
+    """
+    Background changes of ´´parameters´´ in ´´background_project´´ (a fork of the shared project).
+    """
+    bd.projects.set_current(background_project)
+    run_background_stages(StageRunner(), **background_parameters(parameters))
+
+
+def build_foreground(foreground_project: str, parameters: Dict[str, Any]):
+    """
+    Foreground changes and fleets of ´´parameters´´ in ´´foreground_project´´ (a fork of its background project). The
+    scenarios forked from it only build again the fleet members whose parameters differ.
+    """
+    bd.projects.set_current(foreground_project)
+    stages = StageRunner()
+    run_background_stages(stages, **background_parameters(parameters))
+    run_foreground_stages(stages, **foreground_parameters(parameters))
+
+
+def run_scenario(scenario_project: str, scenario_folder: str, parameters: Dict[str, Any]):
+    os.makedirs(scenario_folder, exist_ok=True)
+    run(**{**parameters,
+           'log_save_path': scenario_folder,
+           'project_name': scenario_project,
+           'file_out_path': os.path.join(scenario_folder, 'tech_mapping_out.xlsx')})
+
+
+##### workers #####
+def _worker(task: Tuple[str, Callable, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Runs one task in a worker process. Each task works on its own project, so no SQLite file is shared between
+    processes. Errors are returned (not raised), so one failing scenario does not stop the others.
+    """
+    name, function, kwargs = task
+    start = time.time()
+    try:
+        function(**kwargs)
+        return {'task': name, 'status': 'completed', 'seconds': time.time() - start}
+    except Exception:
+        return {'task': name, 'status': 'failed', 'seconds': time.time() - start, 'error': traceback.format_exc()}
+
+
+def _run_tasks(tasks: List[Tuple[str, Callable, Dict[str, Any]]], processes: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    if processes <= 1:
+        for task in tasks:
+            results[task[0]] = _worker(task)
+    else:
+        # 'spawn': a forked worker would share the open SQLite connections of this process (projects registry,
+        # parameters and lci databases)
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(_worker, task) for task in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['task']] = result
+                print(f"{result['task']} {result['status']} in {result['seconds']:.0f} s")
+    for result in results.values():
+        if result['status'] == 'failed':
+            print(f"{result['task']} failed:\n{result['error']}")
+    return results
+
+
+##### sweep #####
+def run_sweep(grid: Dict[str, List[Any]], output_folder: str,
+              base_parameters: Optional[Dict[str, Any]] = None,
+              base_project: str = PROJECT_NAME,
+              processes: int = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Runs run() for every combination of ´´grid´´. Example:
+    run_sweep(grid={'trucks_electrification_share': [0.3, 0.5, 0.8],
+                    'battery_technology_share': [EMERGING_TECH_MODERATE, EMERGING_TECH_OPTIMISTIC]},
+              output_folder=r'C:\\...\\sweep', base_parameters={'mapping_file_path': r'C:\\...\\tech_mapping_in.xlsx'},
+              processes=8)
+    Projects:
+        - ´´base_project´´: template project with ecoinvent, premise and 'premise_base', built once.
+        - '<base_project>_bg_<hash>': one fork of the base project per distinct set of background arguments, with the
+          background updated once.
+        - '<base_project>_fg_<hash>': one fork of a background project per distinct set of foreground arguments
+          (without the fleet shares), with the foreground and the fleets of its first scenario.
+        - '<base_project>_<scenario id>': one fork of its foreground project per scenario. run() skips there the
+          stages already done in the foreground project (they have the same checkpoints), builds the fleets again if
+          its shares differ (reusing the fleet members already built, see fleet_members.py), and does the
+          infrastructure and double accounting stages.
+    Parallelism: with ´´processes´´ > 1, the backgrounds, the foregrounds and then the scenarios run in a pool of
+    worker processes.
+    Each one works on its own project (SQLite databases cannot be shared between processes). The projects are forked
+    in this process before starting the workers, so only this process writes the projects registry.
+    Outputs: each scenario writes its log and tech_mapping_out.xlsx in ´´output_folder´´/<scenario id>/. The
+    parameters of each scenario id are written in ´´output_folder´´/sweep_scenarios.json.
+    Since each scenario has its own project, a sweep that stops can be run again and resumes where it stopped.
+    Returns the status, duration and (if failed) the error of each scenario.
+    """
+    scenarios = expand_grid(grid, base_parameters)
+    groups = group_by_background(scenarios)
+    n_foregrounds = sum(len(group_by_foreground(group)) for group in groups.values())
+    print(f'Sweep: {len(scenarios)} scenarios, {len(groups)} distinct backgrounds, {n_foregrounds} distinct '
+          f'foregrounds')
+
+    os.makedirs(output_folder, exist_ok=True)
+    index = {scenario_id(parameters): parameters for parameters in scenarios}
+    with open(os.path.join(output_folder, SWEEP_INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2, default=str)
+
+    build_shared_project(base_project)
+
+    # backgrounds
+    background_tasks = []
+    for background_key, group in groups.items():
+        background_project = f'{base_project}_bg_{background_key}'
+        fork_project(base_project, background_project)
+        background_tasks.append((background_project, build_background,
+                                 {'background_project': background_project, 'parameters': group[0]}))
+    background_results = _run_tasks(background_tasks, processes)
+
+    # foregrounds
+    foreground_tasks = []
+    foreground_groups = {}
+    results = {}
+    for background_key, group in groups.items():
+        background_project = f'{base_project}_bg_{background_key}'
+        for foreground_key, foreground_group in group_by_foreground(group).items():
+            foreground_project = f'{base_project}_fg_{background_key}_{foreground_key}'
+            if background_results[background_project]['status'] == 'failed':
+                for parameters in foreground_group:
+                    sc_id = scenario_id(parameters)
+                    results[sc_id] = {'task': sc_id, 'status': 'failed',
+                                      'error': f"background project '{background_project}' failed"}
+                continue
+            fork_project(background_project, foreground_project)
+            foreground_groups[foreground_project] = foreground_group
+            foreground_tasks.append((foreground_project, build_foreground,
+                                     {'foreground_project': foreground_project, 'parameters': foreground_group[0]}))
+    foreground_results = _run_tasks(foreground_tasks, processes)
+
+    # scenarios
+    scenario_tasks = []
+    for foreground_project, foreground_group in foreground_groups.items():
+        for parameters in foreground_group:
+            sc_id = scenario_id(parameters)
+            if foreground_results[foreground_project]['status'] == 'failed':
+                results[sc_id] = {'task': sc_id, 'status': 'failed',
+                                  'error': f"foreground project '{foreground_project}' failed"}
+                continue
+            scenario_project = f'{base_project}_{sc_id}'
+            fork_project(foreground_project, scenario_project)
+            scenario_tasks.append((sc_id, run_scenario,
+                                   {'scenario_project': scenario_project,
+                                    'scenario_folder': os.path.join(output_folder, sc_id),
+                                    'parameters': parameters}))
+    results.update(_run_tasks(scenario_tasks, processes))
+    bd.projects.set_current(base_project)
+    completed = sum(1 for r in results.values() if r['status'] == 'completed')
+    print(f'Sweep finished: {completed}/{len(scenarios)} scenarios completed')
+    return results
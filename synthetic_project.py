@@ -0,0 +1,232 @@
+import ast
+import hashlib
+import os
+import random
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import bw2data as bd
+
+import consts
+import database_copy
+import tech_mapping as tm
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# modules whose activity searches define the activities the synthetic databases must contain
+PIPELINE_SOURCES = [os.path.join(script_dir, f) for f in ['functions.py', 'main.py', 'double_accounting.py',
+                                                           'config_parameters.py']]
+DEFAULT_MAPPING_FILE = os.path.join(script_dir, 'data', 'input', 'tech_mapping_in.xlsx')
+# locations of the names searched in a location taken from a variable (names searched without a location are
+# created once, in GLO, so that their searches find a single activity)
+DEFAULT_LOCATIONS = ['GLO', 'RER', 'RoW', 'CH', 'ES']
+# databases written with the synthetic activities (copies of 'premise_original')
+SYNTHETIC_COPIES = ['premise_base', 'premise_cement', 'apos391', 'original_cutoff391']
+# words in the names of infrastructure activities (measured in units, as in ecoinvent)
+INFRASTRUCTURE_WORDS = ['construction', 'factory', 'facility', 'plant', 'system', 'tank', 'reactor', 'turbine',
+                        'power station', 'unit', 'installation']
+BIOSPHERE_FLOWS = [
+    ('Carbon dioxide, fossil', 'emission', ('air',)),
+    ('Carbon dioxide, non-fossil', 'emission', ('air',)),
+    ('Carbon dioxide, in air', 'natural resource', ('natural resource', 'in air')),
+    ('Methane, fossil', 'emission', ('air',)),
+    ('Dinitrogen monoxide', 'emission', ('air',)),
+    ('Nitrogen oxides', 'emission', ('air',)),
+    ('Sulfur dioxide', 'emission', ('air',)),
+    ('Particulate Matter, < 2.5 um', 'emission', ('air',)),
+    ('Water', 'emission', ('water',)),
+    ('Water, river', 'natural resource', ('natural resource', 'in water')),
+    ('Occupation, industrial area', 'natural resource', ('natural resource', 'land')),
+    ('Transformation, from unspecified', 'natural resource', ('natural resource', 'land')),
+    ('Transformation, to industrial area', 'natural resource', ('natural resource', 'land')),
+    ('Iron', 'natural resource', ('natural resource', 'in ground')),
+    ('Copper', 'natural resource', ('natural resource', 'in ground')),
+    ('Energy, gross calorific value, in biomass', 'natural resource', ('natural resource', 'biotic')),
+]
+
+
+class ActivitySpec(NamedTuple):
+    name: str
+    location: str
+    reference_product: str
+    unit: str
+
+
+def _literal(node: ast.AST) -> Optional[str]:
+    return node.value if isinstance(node, ast.Constant) and isinstance(node.value, str) else None
+
+
+def _filter_literal(node: ast.AST):
+    # (field, value) of ix.equals / ix.contains / ix.startswith calls with a literal field (value None if not literal)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and \
+            node.func.attr in ('equals', 'contains', 'startswith') and len(node.args) == 2:
+        field = _literal(node.args[0])
+        if field is not None:
+            return field, _literal(node.args[1])
+    return None
+
+
+def searched_activities(source_files: Sequence[str] = PIPELINE_SOURCES) -> List[Dict[str, Optional[str]]]:
+    """
+    Name, location and reference product of the activity searches of the pipeline, read from its source code: each
+    group of filters (arguments of a call, or items of a list) with a literal name gives one search. Location and
+    reference product are None when they are not literals, and the location is 'GLO' when it is not filtered.
+    """
+    searches = []
+    for file_path in source_files:
+        with open(file_path, encoding='utf-8') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                group = node.args
+            elif isinstance(node, ast.List):
+                group = node.elts
+            else:
+                continue
+            literals = dict(filter(None, (_filter_literal(n) for n in group)))
+            if literals.get('name') is not None:
+                searches.append({'name': literals['name'], 'location': literals.get('location', 'GLO'),
+                                 'reference product': literals.get('reference product')})
+    return searches
+
+
+def compared_names(source_files: Sequence[str] = PIPELINE_SOURCES) -> List[str]:
+    """
+    Names the pipeline compares activities with (e.g., ´´ex.input['name'] == 'market for cast iron'´´) or keeps in
+    dictionaries and lists of names.
+    """
+    names = set()
+    for file_path in source_files:
+        with open(file_path, encoding='utf-8') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Compare):
+                candidates = [node.left] + list(node.comparators)
+            elif isinstance(node, ast.Dict):
+                candidates = list(node.keys) + list(node.values)
+            elif isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+                candidates = node.elts
+            else:
+                continue
+            for candidate in candidates:
+                value = _literal(candidate) if candidate is not None else None
+                if value and len(value) > 12 and ' ' in value and ',' in value:
+                    names.add(value)
+    return sorted(names)
+
+
+def _unit(name: str) -> str:
+    if any(word in name for word in INFRASTRUCTURE_WORDS) and not name.startswith('market for electricity'):
+        return 'unit'
+    if name.startswith(('electricity', 'market for electricity', 'heat', 'market for heat')):
+        return 'kilowatt hour'
+    if 'transport' in name:
+        return 'ton kilometer'
+    return 'kilogram'
+
+
+def _reference_product(name: str) -> str:
+    for prefix in ['market group for ', 'market for ']:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name.split(', ')[0]
+
+
+def pipeline_specs(source_files: Sequence[str] = PIPELINE_SOURCES,
+                   mapping_file: Optional[str] = DEFAULT_MAPPING_FILE) -> List[ActivitySpec]:
+    """
+    Activities the pipeline looks for: the searches in its source code, the compared names, the WindTrace materials
+    (consts.MATERIALS_EI_ACTIVITY_CODES) and the rows of the mapping file. Names searched in a variable location are
+    created in DEFAULT_LOCATIONS and in all the countries; compared names, in GLO.
+    """
+    countries = list(consts.LOCATION_EQUIVALENCE.values())
+    specs = {}
+
+    def add(name: str, locations: Iterable[str], reference_product: Optional[str] = None):
+        for location in locations:
+            spec = ActivitySpec(name, location, reference_product or _reference_product(name), _unit(name))
+            specs.setdefault((spec.name, spec.location, spec.reference_product), spec)
+
+    for search in searched_activities(source_files):
+        if search['location'] is not None:
+            add(search['name'], [search['location']], search['reference product'])
+        else:
+            add(search['name'], DEFAULT_LOCATIONS + countries, search['reference product'])
+    for name in compared_names(source_files):
+        add(name, ['GLO'])
+    for material in consts.MATERIALS_EI_ACTIVITY_CODES.values():
+        if isinstance(material, dict) and {'name', 'location', 'reference product'} <= set(material):
+            add(material['name'], [material['location']], material['reference product'])
+    if mapping_file is not None and os.path.exists(mapping_file):
+        mapping = tm.load_mapping(mapping_file)
+        for row in mapping.om + mapping.infrastructure:
+            add(row.name, row.locations(), row.reference_product)
+    return list(specs.values())
+
+
+##### databases #####
+def _code(*parts: str) -> str:
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def biosphere_data() -> Dict:
+    return {('biosphere3', _code(name, *categories)): {'name': name, 'type': flow_type, 'categories': categories,
+                                                       'unit': 'kilogram', 'code': _code(name, *categories),
+                                                       'database': 'biosphere3'}
+            for name, flow_type, categories in BIOSPHERE_FLOWS}
+
+
+def technosphere_data(specs: Sequence[ActivitySpec], db_name: str, n_activities: int, seed: int = 0,
+                      inputs_per_activity: int = 5, flows_per_activity: int = 4) -> Dict:
+    """
+    Activities of ´´specs´´ plus synthetic ones up to ´´n_activities´´, each one with ´´inputs_per_activity´´
+    technosphere inputs and ´´flows_per_activity´´ biosphere flows chosen at random. Inputs amounts are small
+    (the technosphere matrix is diagonally dominant), so the database can always be solved.
+    """
+    rng = random.Random(seed)
+    countries = list(consts.LOCATION_EQUIVALENCE.values())
+    specs = list(specs)
+    for i in range(len(specs), n_activities):
+        name = f'synthetic activity {i}'
+        specs.append(ActivitySpec(name, rng.choice(DEFAULT_LOCATIONS + countries), f'synthetic product {i}',
+                                  rng.choice(['kilogram', 'kilowatt hour', 'megajoule', 'unit'])))
+    keys = [(db_name, _code(spec.name, spec.location, spec.reference_product)) for spec in specs]
+    flows = list(biosphere_data())
+    data = {}
+    for i, (spec, key) in enumerate(zip(specs, keys)):
+        exchanges = [{'input': key, 'amount': 1.0, 'type': 'production', 'unit': spec.unit}]
+        for input_key in rng.sample(keys, min(inputs_per_activity, len(keys))):
+            if input_key != key:
+                exchanges.append({'input': input_key, 'amount': rng.uniform(0.001, 0.5 / inputs_per_activity),
+                                  'type': 'technosphere'})
+        for flow in rng.sample(flows, min(flows_per_activity, len(flows))):
+            exchanges.append({'input': flow, 'amount': rng.uniform(0.001, 1.0), 'type': 'biosphere'})
+        data[key] = {'name': spec.name, 'location': spec.location, 'reference product': spec.reference_product,
+                     'unit': spec.unit, 'code': key[1], 'database': db_name, 'type': 'process',
+                     'comment': 'Synthetic activity', 'exchanges': exchanges}
+    return data
+
+
+def build_synthetic_project(project_name: str, n_activities: int = 10000, seed: int = 0,
+                            mapping_file: Optional[str] = DEFAULT_MAPPING_FILE, overwrite: bool = True):
+    """
+    Creates the brightway project ´´project_name´´ with synthetic 'biosphere3', 'premise_original' and its copies
+    (SYNTHETIC_COPIES), i.e., the state of the project after the premise stages. The activities have the names,
+    locations and reference products the pipeline looks for (see pipeline_specs()), plus synthetic ones up to
+    ´´n_activities´´ (the minimum is the number of activities the pipeline looks for). No ecoinvent files nor premise
+    key are needed, so the stages can be benchmarked offline.
+    """
+    if project_name in bd.projects:
+        if not overwrite:
+            raise ValueError(f'Project {project_name} already exists')
+        if bd.projects.current == project_name:
+            bd.projects.set_current('default')
+        bd.projects.delete_project(project_name, delete_dir=True)
+    bd.projects.set_current(project_name)
+
+    specs = pipeline_specs(mapping_file=mapping_file)
+    if len(specs) > n_activities:
+        print(f'The pipeline looks for {len(specs)} activities: writing {len(specs)} instead of {n_activities}')
+    print(f"Writing synthetic project '{project_name}' ({max(n_activities, len(specs))} activities)")
+    bd.Database('biosphere3').write(biosphere_data())
+    bd.Database('premise_original').write(technosphere_data(specs, 'premise_original', n_activities, seed))
+    for name in SYNTHETIC_COPIES:
+        database_copy.copy_database('premise_original', name)
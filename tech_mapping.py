@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import bw2data as bd
+import pandas as pd
+from bw2data.backends import ActivityDataset
+
+import activity_index as ix
+import consts
+from checkpoints import file_hash
+
+OM_SHEET = 'o&m'
+INFRASTRUCTURE_SHEET = 'infrastructure'
+REQUIRED_COLUMNS = {
+    OM_SHEET: ['id', 'technology_name_calliope', 'life_cycle_inventory_name', 'prod_reference_product',
+               'prod_location', 'prod_database'],
+    INFRASTRUCTURE_SHEET: ['id', 'technology_name_calliope', 'life_cycle_inventory_name', 'prod_location',
+                           'prod_database'],
+}
+# rows with this location are expanded to all the countries in consts.LOCATION_EQUIVALENCE
+COUNTRY_LOCATION = 'country'
+# suffix of the file with the resolved activities, saved next to the workbook
+RESOLUTION_SUFFIX = '.resolved.json'
+
+Key = Tuple[str, str]
+
+
+class MappingRow(NamedTuple):
+    sheet: str
+    id: int
+    technology: str
+    name: str
+    location: str
+    database: str
+    reference_product: Optional[str] = None
+
+    def locations(self) -> List[str]:
+        if self.location == COUNTRY_LOCATION:
+            return list(consts.LOCATION_EQUIVALENCE.values())
+        return [self.location]
+
+
+class TechMapping:
+    """
+    Both sheets of the mapping workbook (tech_mapping_in.xlsx), parsed and validated once. ´´sheets´´ keeps the
+    original tables (e.g., to write the output file) and ´´rows´´ the typed rows of each sheet.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = os.path.abspath(file_path)
+        self.content_hash = file_hash(self.file_path)
+        self.sheets: Dict[str, pd.DataFrame] = pd.read_excel(self.file_path, sheet_name=None)
+        self.rows: Dict[str, List[MappingRow]] = {}
+        errors = []
+        for sheet, columns in REQUIRED_COLUMNS.items():
+            if sheet not in self.sheets:
+                errors.append(f"missing sheet '{sheet}'")
+                continue
+            df = self.sheets[sheet]
+            missing_columns = [c for c in columns if c not in df.columns]
+            if missing_columns:
+                errors.append(f"missing columns in '{sheet}': {missing_columns}")
+                continue
+            self.rows[sheet] = []
+            for record in df.to_dict('records'):
+                empty = [c for c in columns if not isinstance(record[c], str) and pd.isna(record[c])]
+                if empty:
+                    errors.append(f"row {record['id']} of '{sheet}' has empty values in {empty}")
+                    continue
+                self.rows[sheet].append(MappingRow(
+                    sheet=sheet, id=int(record['id']), technology=str(record['technology_name_calliope']),
+                    name=str(record['life_cycle_inventory_name']), location=str(record['prod_location']),
+                    database=str(record['prod_database']),
+                    reference_product=str(record['prod_reference_product']) if sheet == OM_SHEET else None))
+        if errors:
+            raise ValueError(f'Invalid mapping file {self.file_path}: ' + '; '.join(errors))
+
+    @property
+    def om(self) -> List[MappingRow]:
+        return self.rows[OM_SHEET]
+
+    @property
+    def infrastructure(self) -> List[MappingRow]:
+        return self.rows[INFRASTRUCTURE_SHEET]
+
+    def sheet(self, sheet: str) -> pd.DataFrame:
+        return self.sheets[sheet].copy()
+
+
+# parsed workbooks, by (path, content hash)
+_MAPPINGS: Dict[Tuple[str, str], TechMapping] = {}
+
+
+def load_mapping(file_path: str) -> TechMapping:
+    """
+    Parsed mapping workbook. It is read only once per process (and again if the file changes).
+    """
+    key = (os.path.abspath(file_path), file_hash(file_path))
+    if key not in _MAPPINGS:
+        _MAPPINGS[key] = TechMapping(file_path)
+    return _MAPPINGS[key]
+
+
+##### resolution #####
+class Resolution:
+    """
+    Activities matching each (row, location) of a mapping, as {database: [keys]}, in the order the databases are
+    searched. match() gives the activity a stage uses: the only match of the first database with exactly one match.
+    """
+
+    def __init__(self, name: str, databases: List[str], hits: Dict[Tuple[str, int, str], Dict[str, List[Key]]]):
+        self.name = name
+        self.databases = databases
+        self.hits = hits
+
+    def candidates(self, row: MappingRow, location: Optional[str] = None) -> Dict[str, List[Key]]:
+        return self.hits.get((row.sheet, row.id, location or row.location), {})
+
+    def match(self, row: MappingRow, location: Optional[str] = None) -> Optional[Tuple[str, Key]]:
+        candidates = self.candidates(row, location)
+        for database in self.databases:
+            keys = candidates.get(database, [])
+            if len(keys) == 1:
+                return database, keys[0]
+        return None
+
+    def problems(self, rows: List[MappingRow]) -> Tuple[List[str], List[str]]:
+        """
+        Rows without a match (missing) and rows with several matches and no unique one (ambiguous). Rows expanded to
+        countries are only reported if no country has a match.
+        """
+        missing, ambiguous = [], []
+        for row in rows:
+            locations = row.locations()
+            if any(self.match(row, loc) is not None for loc in locations):
+                continue
+            label = f"{row.sheet} row {row.id}: '{row.name}' ({row.location})"
+            if any(len(keys) > 1 for loc in locations for keys in self.candidates(row, loc).values()):
+                ambiguous.append(label)
+            else:
+                missing.append(label)
+        return missing, ambiguous
+
+    def report(self, rows: List[MappingRow]):
+        missing, ambiguous = self.problems(rows)
+        print(f"Mapping resolution '{self.name}': {len(rows) - len(missing) - len(ambiguous)} of {len(rows)} rows "
+              f"resolved in {self.databases}")
+        for label in missing:
+            print(f'  Missing: {label}')
+        for label in ambiguous:
+            print(f'  Ambiguous: {label}')
+
+
+def _resolution_path(mapping: TechMapping) -> str:
+    return os.path.splitext(mapping.file_path)[0] + RESOLUTION_SUFFIX
+
+
+def _database_state(databases: List[str]) -> Dict[str, str]:
+    # hash of the code, name, location and reference product of the activities of each database: a resolution saved in
+    # another state of the databases (activities added, deleted, renamed or relocated) is not reused
+    state = {}
+    for db in databases:
+        sha = hashlib.sha256()
+        for row in ActivityDataset.select(ActivityDataset.code, ActivityDataset.name, ActivityDataset.location,
+                                          ActivityDataset.product).where(
+                ActivityDataset.database == db).order_by(ActivityDataset.code).tuples():
+            sha.update(json.dumps(row).encode('utf-8'))
+        state[db] = sha.hexdigest()
+    return state
+
+
+def _keys_exist(hits: Dict[Tuple[str, int, str], Dict[str, List[Key]]]) -> bool:
+    codes = defaultdict(set)
+    for candidates in hits.values():
+        for keys in candidates.values():
+            for database, code in keys:
+                codes[database].add(code)
+    for database, database_codes in codes.items():
+        database_codes = list(database_codes)
+        found = 0
+        for start in range(0, len(database_codes), 900):
+            found += ActivityDataset.select().where((ActivityDataset.database == database) & (
+                ActivityDataset.code.in_(database_codes[start:start + 900]))).count()
+        if found != len(database_codes):
+            return False
+    return True
+
+
+def _load_resolution(mapping: TechMapping, name: str, databases: List[str]) -> Optional[Resolution]:
+    path = _resolution_path(mapping)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        saved = json.load(f).get(name)
+    if saved is None or saved['project'] != bd.projects.current or saved['workbook_hash'] != mapping.content_hash \
+            or saved['databases'] != databases or saved['state'] != _database_state(databases):
+        return None
+    hits = {(sheet, row_id, loc): {db: [tuple(k) for k in keys] for db, keys in candidates.items()}
+            for sheet, row_id, loc, candidates in saved['hits']}
+    if not _keys_exist(hits):
+        return None
+    return Resolution(name, databases, hits)
+
+
+def _save_resolution(mapping: TechMapping, resolution: Resolution):
+    path = _resolution_path(mapping)
+    saved = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+    saved[resolution.name] = {
+        'project': bd.projects.current, 'workbook_hash': mapping.content_hash, 'databases': resolution.databases,
+        'state': _database_state(resolution.databases),
+        'hits': [[sheet, row_id, loc, candidates] for (sheet, row_id, loc), candidates in resolution.hits.items()]}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(saved, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def resolve(mapping: TechMapping, name: str, rows: List[MappingRow], databases: List[str],
+            filters: Callable[[MappingRow, str], Optional[List[ix.Filter]]]) -> Resolution:
+    """
+    Resolves each row (and each of its locations) to the keys of the activities matching ´´filters´´(row, location)
+    in each of ´´databases´´, using the activity indexes. Rows for which ´´filters´´ returns None are not resolved.
+    The resolution is saved next to the workbook under ´´name´´ and reused while the workbook, the project and the
+    activities of the databases (codes, names, locations and reference products) do not change. Missing and
+    ambiguous rows are reported.
+    """
+    resolution = _load_resolution(mapping, name, databases)
+    if resolution is not None:
+        print(f"Mapping resolution '{name}' loaded from {_resolution_path(mapping)}")
+    else:
+        hits = {}
+        for row in rows:
+            for loc in row.locations():
+                row_filters = filters(row, loc)
+                if row_filters is None:
+                    continue
+                hits[(row.sheet, row.id, loc)] = {db: [act.key for act in ix.get_many(db, *row_filters)]
+                                                  for db in databases}
+        resolution = Resolution(name, databases, hits)
+        _save_resolution(mapping, resolution)
+    resolved_rows = {(sheet, row_id) for sheet, row_id, _ in resolution.hits}
+    resolution.report([row for row in rows if (row.sheet, row.id) in resolved_rows])
+    return resolution
@@ -0,0 +1,227 @@
+from collections import defaultdict
+from typing import Collection, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import bw2data as bd
+import numpy as np
+from bw2data.backends import Activity, ActivityDataset, ExchangeDataset
+from scipy import sparse
+
+import bulk_write
+
+Key = Tuple[str, str]
+
+# technosphere inputs added as they are (not explored) below tier 0 by technosphere_inputs()
+ALWAYS_INCLUDE = (
+    'hydrogen production, gaseous, 30 bar, from PEM electrolysis, from grid electricity',
+    'market group for electricity, low voltage',
+    'hydrogen production, gaseous, 25 bar, from gasification of woody biomass in entrained flow gasifier, '
+    'at gasification plant',
+)
+
+
+def _exchange_rows(keys: Iterable[Key]) -> Dict[Key, List[Tuple[Key, str, float]]]:
+    # (input key, type, amount) of the technosphere and biosphere exchanges of each activity, one query per chunk
+    codes = defaultdict(list)
+    for database, code in keys:
+        codes[database].append(code)
+    rows = defaultdict(list)
+    for database, database_codes in codes.items():
+        for start in range(0, len(database_codes), bulk_write.CHUNK):
+            for output_code, input_database, input_code, ex_type, data in ExchangeDataset.select(
+                    ExchangeDataset.output_code, ExchangeDataset.input_database, ExchangeDataset.input_code,
+                    ExchangeDataset.type, ExchangeDataset.data).where(
+                    (ExchangeDataset.output_database == database) &
+                    (ExchangeDataset.output_code.in_(database_codes[start:start + bulk_write.CHUNK])) &
+                    (ExchangeDataset.type.in_(['technosphere', 'biosphere']))).tuples():
+                rows[(database, output_code)].append(((input_database, input_code), ex_type, data['amount']))
+    return rows
+
+
+def _activities(keys: Iterable[Key], fields: Optional[tuple] = None) -> Dict[Key, object]:
+    # activities of ´´keys´´ (or only their name, if ´´fields´´ is ('name',)), one query per chunk
+    codes = defaultdict(set)
+    for database, code in keys:
+        codes[database].add(code)
+    found = {}
+    for database, database_codes in codes.items():
+        database_codes = sorted(database_codes)
+        for start in range(0, len(database_codes), bulk_write.CHUNK):
+            where = (ActivityDataset.database == database) & (
+                ActivityDataset.code.in_(database_codes[start:start + bulk_write.CHUNK]))
+            if fields == ('name',):
+                for code, name in ActivityDataset.select(ActivityDataset.code, ActivityDataset.name).where(
+                        where).tuples():
+                    found[(database, code)] = name
+            else:
+                for document in ActivityDataset.select().where(where):
+                    found[(database, document.code)] = Activity(document)
+    return found
+
+
+class TierGraph:
+    """
+    Sub-graph of the supply chains of ´´roots´´ explored through the technosphere inputs named in ´´specific_inputs´´
+    (all of them if None), down to ´´depth´´ tiers. It is read once (one query per tier) into sparse matrices:
+    - T: technosphere amounts, explored activity (node) x input (nodes first, then the rest of the inputs)
+    - B: biosphere amounts, node x biosphere flow
+    Tiered aggregations are truncated power series of the exploration matrix E (T restricted to the explored inputs),
+    evaluated for all the nodes at once and memoised per number of remaining tiers, e.g., the biosphere flows of a node
+    with r tiers below it are F_r = B + E F_r-1 (i.e., (I + E + ... + E^r) B). Aggregations of chains explored through
+    only some of ´´specific_inputs´´ exclude the rest from E, so several chains can share one sub-graph.
+    """
+
+    def __init__(self, roots: Sequence[Key], specific_inputs: Optional[FrozenSet[str]], depth: int):
+        self.roots = list(dict.fromkeys(tuple(root) for root in roots))
+        self.specific_inputs = specific_inputs
+        self.depth = depth
+        nodes, names, seen = list(self.roots), {}, set(self.roots)
+        edges, flows = [], []
+        frontier = list(self.roots)
+        for tier in range(depth + 1):
+            rows = _exchange_rows(frontier)
+            inputs = {input_key for key in frontier for input_key, ex_type, _ in rows.get(key, [])
+                      if ex_type == 'technosphere'}
+            names.update(_activities([k for k in inputs if k not in names], ('name',)))
+            next_frontier = []
+            for key in frontier:
+                for input_key, ex_type, amount in rows.get(key, []):
+                    if ex_type == 'biosphere':
+                        flows.append((key, input_key, amount))
+                        continue
+                    edges.append((key, input_key, amount))
+                    if tier < depth and input_key not in seen and self.explored(names.get(input_key)):
+                        seen.add(input_key)
+                        next_frontier.append(input_key)
+            nodes += next_frontier
+            frontier = next_frontier
+        self.nodes = nodes
+        self.inputs = nodes + sorted({k for _, k, _ in edges} - set(nodes))
+        self.flows = sorted({k for _, k, _ in flows})
+        self.names = [names.get(k) for k in self.inputs]
+        node_index = {k: i for i, k in enumerate(nodes)}
+        input_index = {k: i for i, k in enumerate(self.inputs)}
+        flow_index = {k: i for i, k in enumerate(self.flows)}
+        self.technosphere = sparse.csr_matrix(
+            ([a for _, _, a in edges], ([node_index[o] for o, _, _ in edges], [input_index[i] for _, i, _ in edges])),
+            shape=(len(nodes), len(self.inputs)))
+        self.biosphere = sparse.csr_matrix(
+            ([a for _, _, a in flows], ([node_index[o] for o, _, _ in flows], [flow_index[i] for _, i, _ in flows])),
+            shape=(len(nodes), len(self.flows)))
+        self.state = _database_state({key[0] for key in self.inputs + self.flows})
+        self._biosphere_series: Dict[Tuple[FrozenSet[str], int], sparse.csr_matrix] = {}
+        self._technosphere_series: Dict[Tuple[Tuple[str, ...], FrozenSet[str], int], sparse.csr_matrix] = {}
+
+    def explored(self, name: Optional[str], excluded: Collection[str] = ()) -> bool:
+        return name not in excluded and (self.specific_inputs is None or name in self.specific_inputs)
+
+    def exploration(self, excluded: Collection[str] = ()) -> sparse.csr_matrix:
+        """
+        E: node x node, the technosphere amounts of the explored inputs (except those named in ´´excluded´´).
+        """
+        mask = np.array([self.explored(name, excluded) for name in self.names[:len(self.nodes)]], dtype=bool)
+        return sparse.csr_matrix(self.technosphere[:, :len(self.nodes)] @ sparse.diags(mask.astype(float)))
+
+    def biosphere_series(self, tiers: int, excluded: FrozenSet[str] = frozenset()) -> sparse.csr_matrix:
+        """
+        Biosphere flows (node x flow) of each node and of its explored inputs down to ´´tiers´´ tiers below it.
+        """
+        key = (excluded, tiers)
+        if key not in self._biosphere_series:
+            if tiers == 0 or self.specific_inputs is None:
+                # without specific inputs only the node itself is considered
+                series = self.biosphere
+            else:
+                series = self.biosphere + self.exploration(excluded) @ self.biosphere_series(tiers - 1, excluded)
+            self._biosphere_series[key] = sparse.csr_matrix(series)
+        return self._biosphere_series[key]
+
+    def technosphere_series(self, tiers: int, always_include: Tuple[str, ...],
+                            excluded: FrozenSet[str] = frozenset()) -> sparse.csr_matrix:
+        """
+        Aggregated technosphere inputs (node x input) of each node below tier 0 with ´´tiers´´ tiers below it: all its
+        inputs in the last tier; above it, the ´´always_include´´ inputs as they are, plus the aggregation of the
+        explored inputs (other inputs are left out).
+        """
+        key = (always_include, excluded, tiers)
+        if key not in self._technosphere_series:
+            if tiers == 0:
+                series = self.technosphere
+            else:
+                mask = np.array([name in always_include for name in self.names], dtype=bool)
+                series = self.technosphere @ sparse.diags(mask.astype(float)) + \
+                    self.exploration(excluded | set(always_include)) @ \
+                    self.technosphere_series(tiers - 1, always_include, excluded)
+            self._technosphere_series[key] = sparse.csr_matrix(series)
+        return self._technosphere_series[key]
+
+    def collapsed_technosphere(self, tier_limit: int, always_include: Tuple[str, ...] = ALWAYS_INCLUDE,
+                               excluded: FrozenSet[str] = frozenset()) -> sparse.csr_matrix:
+        """
+        Aggregated technosphere inputs (node x input) of each node taken as tier 0 (see technosphere_inputs()).
+        """
+        if tier_limit == 0:
+            return self.technosphere
+        return sparse.csr_matrix(self.exploration(excluded) @
+                                 self.technosphere_series(tier_limit - 1, tuple(always_include), excluded))
+
+    def amounts(self, matrix: sparse.csr_matrix, root: Key, columns: List[Key]) -> Dict[Key, float]:
+        row = matrix.getrow(self.nodes.index(tuple(root))).tocoo()
+        return {columns[j]: amount for j, amount in zip(row.col, row.data)}
+
+
+def _database_state(db_names: Collection[str]) -> Tuple[Tuple[str, Optional[str]], ...]:
+    return tuple(sorted((name, bd.databases[name].get('modified')) for name in db_names if name in bd.databases))
+
+
+# sub-graphs, by (project, root, explored input names). Reused while their databases are not modified
+_GRAPHS: Dict[Tuple[str, Key, Optional[FrozenSet[str]]], TierGraph] = {}
+
+
+def get_graph(root: Key, specific_inputs: Optional[Collection[str]], depth: int) -> TierGraph:
+    """
+    TierGraph of ´´root´´ at least ´´depth´´ tiers deep. It is extracted once and reused by later aggregations of the
+    same activity and inputs (e.g., the technosphere and the biosphere of a chain), unless its databases change.
+    """
+    specific = frozenset(specific_inputs) if specific_inputs else None
+    cache_key = (bd.projects.current, tuple(root), specific)
+    graph = _GRAPHS.get(cache_key)
+    if graph is None or graph.depth < depth or graph.state != _database_state({k for k, _ in graph.state}):
+        graph = TierGraph([root], specific, depth)
+        _GRAPHS[cache_key] = graph
+    return graph
+
+
+def invalidate():
+    """
+    Drops all the sub-graphs, so they are extracted again in the next aggregation.
+    """
+    _GRAPHS.clear()
+
+
+def _with_activities(amounts: Dict[Key, float]) -> List[Tuple[Activity, float]]:
+    activities = _activities(amounts)
+    return [(activities[key], amount) for key, amount in amounts.items()]
+
+
+##### aggregations #####
+def biosphere_flows(activity: Activity, specific_inputs: Optional[Collection[str]] = None,
+                    tier_limit: int = 2) -> List[Tuple[Activity, float]]:
+    """
+    Biosphere flows of ´´activity´´ plus those of its technosphere inputs named in ´´specific_inputs´´ (scaled by
+    their amount), recursively down to ´´tier_limit´´ tiers, summed per flow as (flow, amount).
+    """
+    graph = get_graph(activity.key, specific_inputs, tier_limit if specific_inputs else 0)
+    return _with_activities(graph.amounts(graph.biosphere_series(tier_limit), activity.key, graph.flows))
+
+
+def technosphere_inputs(activity: Activity, specific_inputs: Optional[Collection[str]] = None, tier_limit: int = 2,
+                        always_include: Tuple[str, ...] = ALWAYS_INCLUDE) -> List[Tuple[Activity, float]]:
+    """
+    Technosphere inputs of the supply chain of ´´activity´´ explored through the inputs named in ´´specific_inputs´´
+    (all of them if None), summed per input as (input, amount): all the inputs of the activities in tier
+    ´´tier_limit´´, and the ´´always_include´´ inputs of the activities in the tiers in between (not explored further).
+    Other inputs of tier 0 and of the tiers in between are left out.
+    """
+    graph = get_graph(activity.key, specific_inputs, tier_limit)
+    return _with_activities(graph.amounts(graph.collapsed_technosphere(tier_limit, tuple(always_include)),
+                                          activity.key, graph.inputs))
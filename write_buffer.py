@@ -0,0 +1,153 @@
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import bw2data as bd
+from bw2data.backends import Exchange, sqlite3_lci_db
+from bw2data.backends.proxies import Exchanges
+
+import activity_index
+import consumer_index
+import tier_aggregation
+from instrumentation import log
+
+
+class ExchangeWriteBuffer:
+    """
+    Groups all the exchange inserts, updates and deletes made inside it in a single SQLite transaction, instead of one
+    transaction per ´´.save()´´ / ´´.delete()´´ call. The writes are executed in the open transaction as they happen,
+    so later reads in the same block see them, and they are committed once when the buffer is closed.
+    The 'dirty' flag of the touched databases (which bw2data rewrites on every single save) is set once at the end and,
+    optionally, each touched database is processed once.
+    """
+
+    def __init__(self, process: bool = False):
+        self.process = process
+        self.databases: Set[str] = set()
+        self.counts: Dict[str, int] = {'insert': 0, 'update': 0, 'delete': 0}
+        # consumer (output) of every exchange written or deleted (also in bulk), in order
+        self.outputs: List[Tuple[str, str]] = []
+        self._transaction = None
+        self._set_dirty = None
+        self._exchange_save = None
+        self._exchange_delete = None
+        self._exchanges_delete = None
+        self._delete_exchange_ids = None
+
+    def _record_dirty(self, database: str):
+        self.databases.add(database)
+        # the cached sub-graphs are checked against the 'modified' time of their databases, which is only set on
+        # closing: drop them on every write instead
+        tier_aggregation.invalidate()
+
+    def _wrap_save(self, save: Callable):
+        @functools.wraps(save)
+        def wrapper(ex, *args, **kwargs):
+            self.counts['insert' if ex._document.id is None else 'update'] += 1
+            self.outputs.append(tuple(ex['output']))
+            return save(ex, *args, **kwargs)
+        return wrapper
+
+    def _wrap_delete(self, delete: Callable):
+        @functools.wraps(delete)
+        def wrapper(ex, *args, **kwargs):
+            self.counts['delete'] += 1
+            self.outputs.append(tuple(ex['output']))
+            return delete(ex, *args, **kwargs)
+        return wrapper
+
+    def _wrap_exchanges_delete(self, delete: Callable):
+        # bulk deletes (e.g., act.technosphere().delete())
+        @functools.wraps(delete)
+        def wrapper(exchanges, *args, **kwargs):
+            outputs = [tuple(ex['output']) for ex in exchanges]
+            self.counts['delete'] += len(outputs)
+            self.outputs += outputs
+            return delete(exchanges, *args, **kwargs)
+        return wrapper
+
+    def _wrap_delete_exchange_ids(self, delete: Callable):
+        # bulk deletes by id (consumer_index.delete_exchange_ids(), which returns the outputs of the deleted exchanges)
+        @functools.wraps(delete)
+        def wrapper(*args, **kwargs):
+            outputs = delete(*args, **kwargs)
+            self.counts['delete'] += len(outputs)
+            self.outputs += outputs
+            return outputs
+        return wrapper
+
+    def open(self):
+        self._transaction = sqlite3_lci_db.db.atomic()
+        self._transaction.__enter__()
+        # set_dirty flushes the databases metadata on every call. Record the names and set them once on closing.
+        self._set_dirty = bd.databases.set_dirty
+        bd.databases.set_dirty = self._record_dirty
+        self._exchange_save, self._exchange_delete = Exchange.save, Exchange.delete
+        Exchange.save = self._wrap_save(self._exchange_save)
+        Exchange.delete = self._wrap_delete(self._exchange_delete)
+        self._exchanges_delete, self._delete_exchange_ids = Exchanges.delete, consumer_index.delete_exchange_ids
+        Exchanges.delete = self._wrap_exchanges_delete(self._exchanges_delete)
+        consumer_index.delete_exchange_ids = self._wrap_delete_exchange_ids(self._delete_exchange_ids)
+
+    def close(self, exc_type=None, exc_value=None, traceback=None):
+        Exchange.save, Exchange.delete = self._exchange_save, self._exchange_delete
+        Exchanges.delete, consumer_index.delete_exchange_ids = self._exchanges_delete, self._delete_exchange_ids
+        del bd.databases.set_dirty
+        # commit (or roll back, if there was an error) all the writes at once
+        self._transaction.__exit__(exc_type, exc_value, traceback)
+        tier_aggregation.invalidate()
+        if exc_type is not None:
+            # the in-memory indexes were updated with the writes that have been rolled back
+            activity_index.invalidate()
+            consumer_index.invalidate()
+            return
+        for name in sorted(self.databases):
+            if name in bd.databases:
+                bd.databases.set_dirty(name)
+        log('Exchange writes committed: %d inserted, %d updated, %d deleted, in %s', self.counts['insert'],
+            self.counts['update'], self.counts['delete'], sorted(self.databases), level=1)
+        if self.process:
+            for name in sorted(self.databases):
+                if name in bd.databases:
+                    print(f'Processing {name}')
+                    bd.Database(name).process()
+
+
+_ACTIVE_BUFFER: Optional[ExchangeWriteBuffer] = None
+
+
+@contextmanager
+def exchange_write_buffer(process: bool = False):
+    """
+    with exchange_write_buffer():
+        ... exchange writes ...
+    Nested buffers join the outermost one, so only the outermost buffer commits and processes the databases.
+    ´´process´´=True processes each touched database once at the end (only for the outermost buffer).
+    """
+    global _ACTIVE_BUFFER
+    if _ACTIVE_BUFFER is not None:
+        _ACTIVE_BUFFER.process = _ACTIVE_BUFFER.process or process
+        yield _ACTIVE_BUFFER
+        return
+    write_buffer = ExchangeWriteBuffer(process=process)
+    write_buffer.open()
+    _ACTIVE_BUFFER = write_buffer
+    try:
+        yield write_buffer
+    except BaseException as e:
+        _ACTIVE_BUFFER = None
+        write_buffer.close(type(e), e, e.__traceback__)
+        raise
+    _ACTIVE_BUFFER = None
+    write_buffer.close()
+
+
+def buffered_writes(function: Callable) -> Callable:
+    """
+    Decorator to run the whole function inside an exchange_write_buffer().
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with exchange_write_buffer():
+            return function(*args, **kwargs)
+    return wrapper